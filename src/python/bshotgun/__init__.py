@@ -14,3 +14,10 @@ from .base import *
 from .sql import *
 from .interfaces import *
 from .schema import *
+from .filters import *
+from .summaries import *
+from .cache import *
+from .serialization import *
+from .fetch import *
+from .sync import *
+from .journal import *
@@ -6,13 +6,16 @@
 @author Sebastian Thiel
 @copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
 """
-__all__ = ['shotgun_schema', 'ProxyShotgunConnection', 'ProxyMeta']
+__all__ = ['shotgun_schema', 'ProxyShotgunConnection', 'ProxyMeta', 'WriteBatch']
 
 import logging
+import threading
 from inspect import isroutine
+from itertools import islice
 
 from .interfaces import IShotgunConnection
 from .schema import shotgun_schema
+from .fetch import iter_entities
 
 from bapp import ApplicationSettingsMixin
 from butility import LazyMixin
@@ -90,6 +93,84 @@ class ProxyMeta(IShotgunConnection.__metaclass__):
 ## -- End Utilities -- @}
 
 
+class WriteBatch(object):
+    """Collects create(), update() and delete() calls of a connection, and sends them with batch() calls.
+
+    Use it as context manager, as returned by ProxyShotgunConnection.batching(). Collected calls are sent once
+    max_size of them were collected, and when the context is left. If it is left with an exception, the calls
+    which were not yet sent are dropped.
+    A WriteBatch is only active in the thread which entered it, calls of other threads are not collected."""
+    __slots__ = (
+                    '_connection', # the ProxyShotgunConnection whose calls we collect
+                    '_max_size',   # the maximum amount of requests per batch() call
+                    '_requests',   # the requests which were not yet sent
+                    '_results',    # the results of all requests sent so far, in order
+                    '_depth'       # the amount of times we were entered
+                )
+
+    def __init__(self, connection, max_size):
+        """Initialize this instance
+        @param connection the ProxyShotgunConnection whose calls we collect
+        @param max_size the maximum amount of requests per batch() call"""
+        assert max_size > 0, "max_size must be positive"
+        self._connection = connection
+        self._max_size = max_size
+        self._requests = list()
+        self._results = list()
+        self._depth = 0
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth:
+            return False
+        # end handle nested contexts
+        self._connection._batches.active = None
+        if exc_type is None:
+            self.flush()
+        else:
+            del(self._requests[:])
+        # end handle errors
+        return False
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def add(self, request):
+        """Add the given request, and send all requests if we have max_size of them
+        @param request a dict as passed to batch()
+        @return self"""
+        self._requests.append(request)
+        if len(self._requests) >= self._max_size:
+            self.flush()
+        # end handle full batch
+        return self
+
+    def flush(self):
+        """Send all collected requests now, in chunks of max_size
+        @return self"""
+        # the connection sends pending requests before calls it doesn't collect, which includes batch()
+        requests, self._requests = self._requests, list()
+        while requests:
+            chunk = requests[:self._max_size]
+            del(requests[:self._max_size])
+            self._results.extend(self._connection.batch(chunk))
+        # end while there are requests
+        return self
+
+    def results(self):
+        """@return a list of the results of all requests sent so far, in the order the calls were made"""
+        return self._results
+
+    ## -- End Interface -- @}
+
+# end class WriteBatch
+
+
 class PluginProxyMeta(ProxyMeta, Plugin.__metaclass__):
     """A MetaClass for Proxies and use with types that derive from Plugin.
     Such a type must redefine its __metaclass__ to use this one instead"""
@@ -103,9 +184,12 @@ class PluginProxyMeta(ProxyMeta, Plugin.__metaclass__):
 class ProxyShotgunConnection(IShotgunConnection, LazyMixin, ApplicationSettingsMixin):
     """Wraps an actual shotgun connection object and redirects all calls to it.
     
-    It implements support for a proxy server
+    It implements support for a proxy server, and for sending writes in the background, see 
+    set_write_journal()
     """
-    __slots__ = ('_proxy')
+    __slots__ = ('_proxy', 
+                 '_journal',
+                 '_batches')
     __metaclass__ = ProxyMeta
     
     # -------------------------
@@ -114,6 +198,9 @@ class ProxyShotgunConnection(IShotgunConnection, LazyMixin, ApplicationSettingsM
     
     _proxy_attr = '_proxy'
     _schema = shotgun_schema
+
+    ## Amount of records iter_find() reads with each request
+    records_per_page = 500
     
     ## -- End Configuration -- @}
 
@@ -137,9 +224,207 @@ class ProxyShotgunConnection(IShotgunConnection, LazyMixin, ApplicationSettingsM
                                                 http_proxy = settings.http_proxy or None
                                                )
             log.info("Shotgun connection established")
+        elif name == '_journal':
+            self._journal = None
+        elif name == '_batches':
+            self._batches = threading.local()
         else:
             super(ProxyShotgunConnection, self)._set_cache_(name)
         # end handle attribute name
 
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def write_journal(self):
+        """@return the WriteJournal our writes go to, or None if they are sent to shotgun right away"""
+        return self._journal
+
+    def set_write_journal(self, journal):
+        """Send update(), delete() and revive() calls, as well as batch() calls without creations, to the given 
+        journal instead of shotgun. They return right away, as if shotgun accepted them, while the journal 
+        sends them in the background. 
+        Calls which create entities need shotgun to assign ids, and are sent right away, after the journal
+        sent all pending writes. If that isn't possible, they raise the error the journal encountered.
+        @param journal a WriteJournal, or None to send writes to shotgun right away
+        @return this instance"""
+        self._journal = journal
+        return self
+
+    def batching(self, max_size = 100):
+        """@return a WriteBatch context manager which collects all create(), update() and delete() calls made
+        while it is active, and sends them with batch() calls of up to max_size requests. The calls return 
+        None, their results are available with WriteBatch.results(), in order, once they were sent.
+        If we are batching already, the active WriteBatch is returned.
+        @param max_size the maximum amount of requests per batch() call
+        @note the collected calls are sent when the context is left, unless it is left with an exception. 
+        revive() and batch() calls are not collected, they send the collected calls first.
+        @note each thread has its own WriteBatch"""
+        batch = self._active_batch()
+        if batch is None:
+            batch = self._batches.active = WriteBatch(self, max_size)
+        # end create batch
+        return batch
+
+    ## -- End Interface -- @}
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _append_to_journal(self, request):
+        """Put the given request into our journal
+        @return the result shotgun would return for it"""
+        self._journal.append(request)
+        if request['request_type'] != 'update':
+            return True
+        # end handle delete and revive
+        result = dict(request['data'])
+        result.update({'type' : request['entity_type'], 'id' : request['entity_id']})
+        return result
+
+    def _active_batch(self):
+        """@return the WriteBatch which collects the calls of the current thread, or None"""
+        return getattr(self._batches, 'active', None)
+
+    def _flush_batch(self):
+        """Send the calls our active WriteBatch collected, if there is one, which is needed before calls are 
+        sent which it doesn't collect"""
+        batch = self._active_batch()
+        if batch is not None:
+            batch.flush()
+        # end handle batching
+
+    def _send_journal(self):
+        """Send all pending writes of our journal, which is needed before calls are sent to shotgun directly
+        @throws the error the journal encountered if shotgun couldn't be reached"""
+        if not self._journal.wait():
+            raise self._journal.last_error() or EnvironmentError("Could not send pending writes to shotgun")
+        # end handle unreachable shotgun
+
+    def _iter_pages(self, entity_type, filters, fields, order, filter_operator, limit):
+        """@return an iterator over the records of all pages of the given query, see iter_find()"""
+        page_size = limit and min(limit, self.records_per_page) or self.records_per_page
+        page = 1
+        count = 0
+        while True:
+            records = self._proxy.find(entity_type, filters, fields, order, filter_operator, page_size, page=page)
+            for record in records:
+                yield record
+                count += 1
+                if count == limit:
+                    return
+                # end handle limit
+            # end for each record
+            if len(records) < page_size:
+                break
+            # end handle last page
+            page += 1
+        # end while there are pages
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Shotgun Interface Overrides
+    # @{
+
+    def iter_find(self, entity_type, filters, fields, order=list(), filter_operator='all', limit=0):
+        """@return an iterator over the records find() would return for the given arguments. They are read 
+        page by page, with records_per_page records per request, so only one page is in memory at a time.
+        @note without order, records are returned in order of their id, and each page starts after the last id
+        of the previous one, which is robust to entities being created or deleted while we iterate."""
+        if order:
+            return self._iter_pages(entity_type, filters, fields, order, filter_operator, limit)
+        # end handle order
+
+        if isinstance(filters, dict):
+            filters = [filters]
+        elif filter_operator not in (None, 'all', 'and'):
+            filters = [{'filter_operator' : filter_operator, 'filters' : filters}]
+        # end handle filter operator
+        page_size = limit and min(limit, self.records_per_page) or self.records_per_page
+        records = iter_entities(self._proxy, entity_type, fields, page_size, filters=filters)
+        if limit:
+            records = islice(records, limit)
+        # end handle limit
+        return records
+
+    def count(self, entity_type, filters, filter_operator='all'):
+        """@return the amount of entities matching the given filters, which shotgun computes with a 
+        record_count summary, so no records are transferred"""
+        result = self._proxy.summarize(entity_type, filters, [{'field' : 'id', 'type' : 'record_count'}], 
+                                       filter_operator)
+        return result['summaries']['id']
+
+    def create(self, entity_type, data, return_fields=list()):
+        """@note if we are batching, the call is collected. If we have a write journal, it sends all pending 
+        writes first, see set_write_journal()"""
+        batch = self._active_batch()
+        if batch is not None:
+            request = {'request_type' : 'create', 'entity_type' : entity_type, 'data' : data}
+            if return_fields:
+                request['return_fields'] = return_fields
+            # end handle return fields
+            batch.add(request)
+            return None
+        # end handle batching
+        if self._journal is not None:
+            self._send_journal()
+        # end handle pending writes
+        return self._proxy.create(entity_type, data, return_fields)
+
+    def update(self, entity_type, entity_id, data):
+        """@note if we are batching, the call is collected, otherwise it goes to our write journal, if we have 
+        one"""
+        batch = self._active_batch()
+        if batch is not None:
+            batch.add({'request_type' : 'update', 'entity_type' : entity_type, 'entity_id' : entity_id,
+                       'data' : data})
+            return None
+        # end handle batching
+        if self._journal is None:
+            return self._proxy.update(entity_type, entity_id, data)
+        # end handle direct writes
+        return self._append_to_journal({'request_type' : 'update', 'entity_type' : entity_type, 
+                                        'entity_id' : entity_id, 'data' : data})
+
+    def delete(self, entity_type, entity_id):
+        """@note if we are batching, the call is collected, otherwise it goes to our write journal, if we have 
+        one"""
+        batch = self._active_batch()
+        if batch is not None:
+            batch.add({'request_type' : 'delete', 'entity_type' : entity_type, 'entity_id' : entity_id})
+            return None
+        # end handle batching
+        if self._journal is None:
+            return self._proxy.delete(entity_type, entity_id)
+        # end handle direct writes
+        return self._append_to_journal({'request_type' : 'delete', 'entity_type' : entity_type, 
+                                        'entity_id' : entity_id})
+
+    def revive(self, entity_type, entity_id):
+        """@note goes to our write journal, if we have one. If we are batching, the collected calls are sent 
+        first"""
+        self._flush_batch()
+        if self._journal is None:
+            return self._proxy.revive(entity_type, entity_id)
+        # end handle direct writes
+        return self._append_to_journal({'request_type' : 'revive', 'entity_type' : entity_type, 
+                                        'entity_id' : entity_id})
+
+    def batch(self, requests):
+        """@note goes to our write journal, if we have one, unless entities are created. If we are batching, 
+        the collected calls are sent first"""
+        self._flush_batch()
+        if self._journal is None or any(request['request_type'] == 'create' for request in requests):
+            if self._journal is not None:
+                self._send_journal()
+            # end handle pending writes
+            return self._proxy.batch(requests)
+        # end handle direct writes
+        return [self._append_to_journal(request) for request in requests]
+
+    ## -- End Shotgun Interface Overrides -- @}
+
 # end class ProxyShotgunConnection
 
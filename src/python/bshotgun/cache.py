@@ -0,0 +1,183 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.cache
+@brief An in-process cache for decoded shotgun records
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = ['RecordCache']
+
+import sys
+import threading
+from copy import deepcopy
+from collections import OrderedDict
+
+
+def _value_size(value):
+    """@return the approximate amount of bytes the given value occupies in memory"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        size += sum(_value_size(v) for v in value)
+    # end handle containers
+    return size
+
+
+def _record_size(record):
+    """@return the approximate amount of bytes the given record occupies in memory"""
+    return sys.getsizeof(record) + sum(sys.getsizeof(k) + _value_size(v) for k, v in record.iteritems())
+
+
+class RecordCache(object):
+    """A bounded least-recently-used cache of decoded records, keyed by (type, id).
+
+    Each entry keeps all fields of a record that were put into the cache so far. A lookup is a hit if the
+    entry has all requested fields.
+
+    Values are either shared, in which case callers must treat them as read-only, or copied on the way in and
+    out, which is safe but slower. Either way, lookups return new dicts with only the requested fields, and
+    entries are replaced instead of being changed, so records handed out never change.
+
+    Instances may be shared by threads."""
+    __slots__ = (
+                    '_max_entries', # maximum amount of entries
+                    '_max_bytes',   # maximum amount of bytes all entries may occupy, approximately
+                    '_copy',        # if True, records are copied
+                    '_entries',     # (type, id) -> [record, size], in least-recently-used order
+                    '_bytes',       # approximate size of all entries
+                    '_lock',        # serializes access to _entries, _bytes and our counters
+                    'hits',         # amount of lookups which could be served
+                    'misses',       # amount of lookups which couldn't be served
+                    'evictions'     # amount of entries dropped to respect our limits
+                )
+
+    def __init__(self, max_entries = 10000, max_bytes = 64 * 1024 * 1024, copy_records = True):
+        """Initialize this instance
+        @param max_entries the maximum amount of records to keep
+        @param max_bytes the maximum amount of memory all records may occupy, approximately
+        @param copy_records if True, records are copied when put into the cache and when returned, so callers
+        may change them. Otherwise they are shared, and must not be changed by anyone"""
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._copy = copy_records
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _evict(self):
+        """Drop least recently used entries until we are within our limits. Must be called with our lock held"""
+        entries = self._entries
+        while entries and (len(entries) > self._max_entries or self._bytes > self._max_bytes):
+            key, (record, size) = entries.popitem(last = False)
+            self._bytes -= size
+            self.evictions += 1
+        # end while we are too large
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def get(self, entity_type, entity_id, fields):
+        """@return the cached record of the given type and id, or None if there is none, or if it doesn't
+        have all of the given fields
+        @param fields an iterable of field names the record must have. Only those are returned, along with 
+        'id' and 'type'. Their values are shared if records are not copied"""
+        key = (entity_type, entity_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            # end handle unknown records
+
+            record = entry[0]
+            for field_name in fields:
+                if field_name not in record:
+                    self.misses += 1
+                    return None
+                # end handle missing fields
+            # end for each field
+
+            # mark as most recently used
+            del(self._entries[key])
+            self._entries[key] = entry
+            self.hits += 1
+        # end with lock
+
+        # entries are never changed, so they can be projected without holding the lock
+        copy = self._copy and deepcopy or (lambda value: value)
+        out = dict((field_name, copy(record[field_name])) for field_name in fields)
+        for field_name in ('id', 'type'):
+            if field_name in record:
+                out[field_name] = record[field_name]
+            # end copy identity
+        # end for each identity field
+        return out
+
+    def put(self, entity_type, record):
+        """Put the given record into the cache, or add its fields to the existing entry
+        @param entity_type the type of the record, used as key along with its id
+        @param record a record with at least the 'id' field
+        @return self"""
+        key = (entity_type, record['id'])
+        if self._copy:
+            record = deepcopy(record)
+        # end handle copies
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+                merged = dict(entry[0])
+                merged.update(record)
+                record = merged
+            # end merge with existing entry, which may have been handed out
+
+            size = _record_size(record)
+            self._entries[key] = [record, size]
+            self._bytes += size
+            self._evict()
+        # end with lock
+        return self
+
+    def invalidate(self, entity_type = None, entity_ids = None):
+        """Drop the given records from the cache
+        @param entity_type if None, all records are dropped
+        @param entity_ids if None, all records of the given type are dropped, otherwise an iterable of ids
+        @return self"""
+        with self._lock:
+            if entity_type is None:
+                keys = self._entries.keys()
+            elif entity_ids is None:
+                keys = [key for key in self._entries if key[0] == entity_type]
+            else:
+                keys = [(entity_type, entity_id) for entity_id in entity_ids]
+            # end handle keys to drop
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry[1]
+                # end handle known entries
+            # end for each key
+        # end with lock
+        return self
+
+    def stats(self):
+        """@return a dict with 'entries', 'bytes', 'hits', 'misses' and 'evictions'"""
+        with self._lock:
+            return {'entries' : len(self._entries), 'bytes' : self._bytes, 'hits' : self.hits,
+                    'misses' : self.misses, 'evictions' : self.evictions}
+        # end with lock
+
+    ## -- End Interface -- @}
+
+# end class RecordCache
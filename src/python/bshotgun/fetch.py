@@ -0,0 +1,231 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.fetch
+@brief Utilities to read all entities of many types from shotgun, as needed to initialize an SQL cache
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = ['iter_entities', 'ParallelFetcher']
+
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+
+## Order by id, ascending
+_id_order = [{'field_name' : 'id', 'direction' : 'asc'}]
+
+
+def iter_entities(connection, type_name, fields, records_per_page = 500, after_id = None, filters = None):
+    """@return an iterator over all entities of the given type, which are read page by page, in order of
+    their id. Only one page is in memory at a time.
+    @param connection a shotgun connection
+    @param type_name the shotgun type to read
+    @param fields the fields to read
+    @param records_per_page the amount of records to read with each request
+    @param after_id if not None, only entities with a larger id are returned
+    @param filters if not None, a list of filters all returned entities must match"""
+    last_id = after_id
+    while True:
+        page_filters = list(filters or list())
+        if last_id is not None:
+            page_filters.append(['id', 'greater_than', last_id])
+        # end handle pages after the first one
+        records = connection.find(type_name, page_filters, fields, _id_order, limit=records_per_page)
+        for record in records:
+            yield record
+        # end for each record
+        if len(records) < records_per_page:
+            break
+        # end handle last page
+        last_id = records[-1]['id']
+    # end while there are pages
+
+
+class ParallelFetcher(object):
+    """A fetcher for SQLProxyShotgunConnection.init_database() which reads entities of many types at once,
+    using a pool of threads with a connection each.
+
+    Each type is split into ranges of ids with about records_per_page records, which are read in parallel.
+    Records are still returned one type after another, in order of their id, which allows a single
+    consumer to write them. Only a few ranges are read ahead of the consumer, and each request returns at most
+    records_per_page records, which bounds memory. If ids are clustered, ranges with more records are read 
+    in several requests.
+
+    Types must be requested in the order they were given in. Types which are skipped are not read, and types
+    which are requested out of order, or after an id, are read page by page with iter_entities(). Errors are 
+    raised when the type they belong to is read."""
+    __slots__ = (
+                    '_new_connection',   # f() -> a new shotgun connection
+                    '_fields',           # f(type_name) -> list of field names to read
+                    '_records_per_page', # approximate amount of records per request
+                    '_max_pending',      # maximum amount of ranges to read ahead
+                    '_local',            # thread local storage, keeps a connection per thread
+                    '_pool',             # our ThreadPool
+                    '_order',            # type_name -> index in the type names we were given
+                    '_ranges',           # type_name -> AsyncResult of the list of id ranges to read
+                    '_tasks',            # iterator of (type_name, id_range) tuples, in order
+                    '_pending',          # deque of (type_name, id_range, AsyncResult) tuples, in order
+                    '_dropped'           # set of names of types whose ranges are not read anymore
+                )
+
+    def __init__(self, new_connection, type_names, fields, jobs, records_per_page = 500, ranges_per_job = 2):
+        """Initialize this instance, and start reading right away
+        @param new_connection a function f() -> connection, which is called once in each thread
+        @param type_names the names of all types that will be requested, in order
+        @param fields a function f(type_name) -> list of field names to read
+        @param jobs the amount of threads, and thus the amount of requests in flight
+        @param records_per_page the approximate amount of records to read with each request
+        @param ranges_per_job the amount of id ranges to read ahead per job"""
+        self._new_connection = new_connection
+        self._fields = fields
+        self._records_per_page = records_per_page
+        self._max_pending = max(1, jobs * ranges_per_job)
+        self._local = threading.local()
+        self._pool = ThreadPool(jobs)
+        self._order = dict((type_name, index) for index, type_name in enumerate(type_names))
+        self._ranges = dict((type_name, self._pool.apply_async(self._id_ranges, (type_name, )))
+                            for type_name in type_names)
+        self._tasks = self._iter_tasks(list(type_names))
+        self._pending = deque()
+        self._dropped = set()
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _connection(self):
+        """@return the connection of the current thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._new_connection()
+        # end create connection on first use
+        return connection
+
+    def _id_ranges(self, type_name):
+        """@return a list of (first_id, last_id) tuples which cover all entities of the given type"""
+        connection = self._connection()
+        count = connection.summarize(type_name, list(), [{'field' : 'id', 'type' : 'record_count'}])
+        count = count['summaries']['id']
+        if not count:
+            return list()
+        # end handle empty types
+        first = connection.find_one(type_name, list(), ['id'], _id_order)
+        last = connection.find_one(type_name, list(), ['id'], [{'field_name' : 'id', 'direction' : 'desc'}])
+        if first is None or last is None:
+            return list()
+        # end handle entities that vanished
+
+        first, last = first['id'], last['id']
+        num_ranges = max(1, -(-count // self._records_per_page))
+        step = max(1, -(-(last - first + 1) // num_ranges))
+        return [(start, min(start + step - 1, last)) for start in xrange(first, last + 1, step)]
+
+    def _read(self, type_name, id_range):
+        """@return a list of the first records_per_page entities of the given type within the given id range, 
+        ordered by id"""
+        return self._connection().find(type_name, [['id', 'between', list(id_range)]], self._fields(type_name),
+                                       _id_order, limit=self._records_per_page)
+
+    def _iter_tasks(self, type_names):
+        """@return an iterator over (type_name, id_range) tuples, in the order we will need them"""
+        for type_name in type_names:
+            if type_name in self._dropped:
+                continue
+            # end skip dropped types
+            try:
+                id_ranges = self._ranges[type_name].get()
+            except Exception:
+                # the error belongs to the type, and is raised once it is read, see _iter_type()
+                continue
+            # end handle types we can't read
+            for id_range in id_ranges:
+                if type_name in self._dropped:
+                    break
+                # end handle types dropped while we were reading them
+                yield type_name, id_range
+            # end for each range
+        # end for each type
+
+    def _drop(self, type_name):
+        """Don't read any more ranges of the given type, and forget the ones we read already"""
+        self._order.pop(type_name, None)
+        self._dropped.add(type_name)
+        pending = [item for item in self._pending if item[0] != type_name]
+        self._pending.clear()
+        self._pending.extend(pending)
+
+    def _fill(self):
+        """Start reading ranges until we have enough of them in flight"""
+        pending = self._pending
+        while len(pending) < self._max_pending:
+            try:
+                type_name, id_range = next(self._tasks)
+            except StopIteration:
+                break
+            # end handle no more tasks
+            pending.append((type_name, id_range, self._pool.apply_async(self._read, (type_name, id_range))))
+        # end while we can read more
+
+    def _iter_type(self, type_name):
+        """@return an iterator over all entities of the given type, in order of their id
+        @throws the error we encountered when reading the type's id ranges"""
+        index = self._order.pop(type_name)
+        self._ranges[type_name].get()
+        pending = self._pending
+        while True:
+            self._fill()
+            if not pending:
+                break
+            # end handle no more ranges
+            pending_type, id_range, result = pending[0]
+            if pending_type != type_name:
+                if self._order.get(pending_type, -1) > index:
+                    break
+                # end handle ranges of types we will need later
+                # discard ranges of types which were skipped
+                self._drop(pending_type)
+                continue
+            # end handle other types
+            pending.popleft()
+            records = result.get()
+            if len(records) == self._records_per_page and records[-1]['id'] < id_range[1]:
+                # the range has more records than a request returns - read the rest of it next
+                rest = (records[-1]['id'] + 1, id_range[1])
+                pending.appendleft((type_name, rest, self._pool.apply_async(self._read, (type_name, rest))))
+            # end handle clustered ids
+            for record in records:
+                yield record
+            # end for each record
+        # end while there are ranges
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def __call__(self, type_name, after_id = None):
+        """@return an iterator over all entities of the given type, in order of their id
+        @param after_id if not None, only entities with a larger id are returned. They are read page by page"""
+        if type_name not in self._order or after_id is not None:
+            self._drop(type_name)
+            return iter_entities(self._connection(), type_name, self._fields(type_name), self._records_per_page,
+                                 after_id)
+        # end handle types we didn't plan to read
+        return self._iter_type(type_name)
+
+    def close(self):
+        """Stop all threads. Must be called once we are done, as our threads keep us alive
+        @return self"""
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            pool.terminate()
+            self._pool = None
+        # end handle pool
+        return self
+
+    ## -- End Interface -- @}
+
+# end class ParallelFetcher
@@ -0,0 +1,612 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.filters
+@brief Utilities to deal with shotgun filter and order expressions
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = ['FilterCondition', 'FilterGroup', 'normalize_filters', 'FilterEvaluator', 'filter_records',
+           'normalize_order', 'sort_records']
+
+import re
+from datetime import (datetime,
+                      date,
+                      timedelta,
+                      tzinfo)
+
+
+# -------------------------
+## @name Constants
+# @{
+
+## Maps all logical operators we know to the one used in normalized FilterGroups
+logical_operator_map = {
+    'all' : 'all',
+    'and' : 'all',
+    'any' : 'any',
+    'or' : 'any',
+}
+
+## Maps negated relations to the relation they negate
+negated_relation_map = {
+    'is_not' : 'is',
+    'not_in' : 'in',
+    'not_contains' : 'contains',
+    'not_between' : 'between',
+    'not_in_last' : 'in_last',
+    'not_in_next' : 'in_next',
+    'type_is_not' : 'type_is',
+    'name_not_contains' : 'name_contains',
+}
+
+## Separates the parts of a deep-link path, like 'project.Project.name'
+PATH_SEPARATOR = '.'
+
+## -- End Constants -- @}
+
+
+# ==============================================================================
+## @name Value Utilities
+# ------------------------------------------------------------------------------
+## @{
+
+class _UTC(tzinfo):
+    """A minimal UTC timezone"""
+    __slots__ = ()
+
+    def utcoffset(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return 'UTC'
+
+    def dst(self, dt):
+        return timedelta(0)
+
+# end class _UTC
+
+utc = _UTC()
+
+
+def _to_utc_datetime(value):
+    """@return a naive datetime in UTC from the given datetime or string, like '2008-06-11 08:48:54+02:00'"""
+    if isinstance(value, basestring):
+        dt = datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+        offset = value[19:]
+        if offset and offset not in ('Z', 'UTC'):
+            sign = offset[0] == '-' and -1 or 1
+            hours, minutes = offset[1:].split(':')
+            dt -= sign * timedelta(hours=int(hours), minutes=int(minutes))
+        # end handle offset
+        return dt
+    # end handle strings
+    if value.tzinfo is not None:
+        value = value.astimezone(utc).replace(tzinfo=None)
+    # end make naive
+    return value
+
+
+def _to_date(value):
+    """@return a date object from the given date, datetime or string, like '2008-06-11'"""
+    if isinstance(value, basestring):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+## Matches strings that look like shotgun dates, like '2008-06-11'
+_date_regex = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+## Matches strings that look like shotgun date-times, like '2008-06-11 08:48:54+02:00'
+_date_time_regex = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
+
+def _comparable(value):
+    """@return the given value in a form that can be compared to other values of the same field, no matter
+    how it was stored. Date-times become naive UTC datetimes, date strings become dates, and text becomes
+    unicode"""
+    if isinstance(value, datetime):
+        return _to_utc_datetime(value)
+    elif isinstance(value, str):
+        value = value.decode('utf-8')
+    # end handle type
+    if isinstance(value, unicode):
+        if _date_time_regex.match(value):
+            return _to_utc_datetime(value)
+        elif _date_regex.match(value):
+            return _to_date(value)
+        # end handle dates in strings
+    # end handle strings
+    return value
+
+
+def _shift(now, amount, unit):
+    """@return now shifted by the given amount of units, which may be negative
+    @param unit one of 'HOUR', 'DAY', 'WEEK', 'MONTH', 'YEAR'
+    @throws ValueError for unknown units"""
+    unit = unit.upper().rstrip('S')
+    if unit == 'HOUR':
+        return now + timedelta(hours=amount)
+    elif unit == 'DAY':
+        return now + timedelta(days=amount)
+    elif unit == 'WEEK':
+        return now + timedelta(weeks=amount)
+    elif unit in ('MONTH', 'YEAR'):
+        months = amount * (unit == 'YEAR' and 12 or 1)
+        year, month = divmod(now.month - 1 + months, 12)
+        year += now.year
+        month += 1
+        # clamp the day to the length of the target month
+        day = now.day
+        while True:
+            try:
+                return now.replace(year=year, month=month, day=day)
+            except ValueError:
+                day -= 1
+            # end handle invalid days
+        # end while day is invalid
+    # end handle unit
+    raise ValueError("Unknown time unit: %r" % (unit,))
+
+
+def _calendar_key(value, unit):
+    """@return a key which is equal for all dates or datetimes within the same calendar unit
+    @param unit one of 'day', 'week', 'month', 'year'"""
+    if unit == 'day':
+        return (value.year, value.month, value.day)
+    elif unit == 'week':
+        return value.isocalendar()[:2]
+    elif unit == 'month':
+        return (value.year, value.month)
+    return value.year
+
+## -- End Value Utilities -- @}
+
+
+class FilterCondition(object):
+    """A single condition, like ['code', 'is', 'foo'], which compares the value of a field with the given values"""
+    __slots__ = (
+                    'path',     # field name, like 'code', or a deep-link path like 'project.Project.name'
+                    'relation', # the relation, like 'is' or 'in'
+                    'values'    # a list of values to compare with. Relations like 'is' just use the first one
+                )
+
+    def __init__(self, path, relation, values):
+        self.path = path
+        self.relation = relation
+        self.values = values
+
+    def __repr__(self):
+        return "FilterCondition(%r, %r, %r)" % (self.path, self.relation, self.values)
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def value(self):
+        """@return the first of our values, or None if there is no value"""
+        if not self.values:
+            return None
+        return self.values[0]
+
+    ## -- End Interface -- @}
+
+# end class FilterCondition
+
+
+class FilterGroup(object):
+    """A group of conditions or groups, combined with a logical operator"""
+    __slots__ = (
+                    'operator', # either 'all' or 'any'
+                    'filters'   # a list of FilterCondition or FilterGroup instances
+                )
+
+    def __init__(self, operator, filters):
+        self.operator = operator
+        self.filters = filters
+
+    def __repr__(self):
+        return "FilterGroup(%r, %r)" % (self.operator, self.filters)
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def field_names(self):
+        """@return a set of the names of all fields used in our conditions, recursively. For deep-link paths,
+        only the field on the entity itself is returned"""
+        out = set()
+        for sg_filter in self.filters:
+            if isinstance(sg_filter, FilterGroup):
+                out |= sg_filter.field_names()
+            else:
+                out.add(sg_filter.path.split(PATH_SEPARATOR)[0])
+            # end handle filter type
+        # end for each filter
+        return out
+
+    ## -- End Interface -- @}
+
+# end class FilterGroup
+
+
+# ==============================================================================
+## @name Normalization
+# ------------------------------------------------------------------------------
+## @{
+
+def _normalize_operator(operator):
+    """@return the normalized version of the given logical operator
+    @throws ValueError if it is unknown"""
+    try:
+        return logical_operator_map[operator]
+    except KeyError:
+        raise ValueError("Unknown logical operator: %r" % (operator,))
+    # end convert exception
+
+
+def _normalize_filter(sg_filter):
+    """@return a FilterCondition or FilterGroup from the given filter in any of the formats supported by
+    shotgun"""
+    if isinstance(sg_filter, dict):
+        if 'path' in sg_filter:
+            return FilterCondition(sg_filter['path'], sg_filter['relation'], list(sg_filter.get('values', list())))
+        # end handle single condition
+
+        operator = sg_filter.get('filter_operator', sg_filter.get('logical_operator'))
+        if operator is None:
+            raise ValueError("Filter dicts need a 'filter_operator' or 'logical_operator': %r" % (sg_filter,))
+        # end check operator
+        filters = sg_filter.get('filters', sg_filter.get('conditions'))
+        if filters is None:
+            raise ValueError("Filter dicts need 'filters' or 'conditions': %r" % (sg_filter,))
+        # end check filters
+        return FilterGroup(_normalize_operator(operator), [_normalize_filter(f) for f in filters])
+    # end handle dicts
+
+    if not isinstance(sg_filter, (tuple, list)) or len(sg_filter) < 2:
+        raise ValueError("Invalid filter: %r" % (sg_filter,))
+    # end check format
+
+    # Same as the shotgun API does it: ['id', 'in', 1, 2] equals ['id', 'in', [1, 2]]
+    values = list(sg_filter[2:])
+    if len(values) == 1 and isinstance(values[0], (tuple, list)):
+        values = list(values[0])
+    # end unpack value lists
+    return FilterCondition(sg_filter[0], sg_filter[1], values)
+
+
+def normalize_filters(filters, filter_operator = 'all'):
+    """@return a FilterGroup representing the given shotgun filters
+    @param filters a list of filters, as passed to IShotgunConnection.find(), or a dict with a
+    'filter_operator' or 'logical_operator' and a list of 'filters' or 'conditions'. Nesting is supported.
+    @param filter_operator the logical operator to combine the given filters list with
+    @throws ValueError if the filters are malformed"""
+    if isinstance(filters, dict):
+        group = _normalize_filter(filters)
+        if isinstance(group, FilterCondition):
+            group = FilterGroup('all', [group])
+        # end wrap single conditions
+        return group
+    # end handle dicts
+    return FilterGroup(_normalize_operator(filter_operator), [_normalize_filter(f) for f in filters])
+
+## -- End Normalization -- @}
+
+
+class FilterEvaluator(object):
+    """Evaluates normalized shotgun filters against records in memory, implementing the semantics of the shotgun 
+    server as closely as possible.
+
+    Conditions are compiled into closures once, so that matching many records is as fast as possible.
+    Deep-link paths, like 'project.Project.name', are resolved using a function to look up linked records.
+
+    @note text comparisons using 'is' are case-sensitive, the ones using 'contains' or similar are not.
+    @note date-times are compared in UTC, calendar relations like 'in_calendar_day' use UTC as well"""
+    __slots__ = (
+                    '_predicate',       # f(record) -> bool
+                    '_resolve_link',    # f(link_dict, field_name) -> value of field in linked record
+                    '_now',             # datetime of the time at which the evaluator was created, in UTC
+                )
+
+    def __init__(self, group, resolve_link = None, now = None):
+        """Initialize this instance
+        @param group a FilterGroup, as returned by normalize_filters()
+        @param resolve_link a function f(link_dict, field_name) -> value returning the value of the given field 
+        in the entity the given link points to, or None if it is unknown. If None, deep-link paths cannot be 
+        evaluated and will never match.
+        @param now a naive datetime in UTC at which relative relations like 'in_last' are anchored. 
+        Defaults to the current time
+        @throws ValueError if a relation or value is not understood"""
+        self._resolve_link = resolve_link
+        self._now = now or datetime.utcnow()
+        self._predicate = self._compile(group)
+
+    # -------------------------
+    ## @name Compilation
+    # @{
+
+    def _compile(self, node):
+        """@return a function f(record) -> bool for the given node"""
+        if isinstance(node, FilterGroup):
+            predicates = [self._compile(f) for f in node.filters]
+            if node.operator == 'all':
+                return lambda record: all(p(record) for p in predicates)
+            # Shotgun treats an empty 'any' group as no constraint
+            if not predicates:
+                return lambda record: True
+            return lambda record: any(p(record) for p in predicates)
+        # end handle groups
+        return self._compile_condition(node)
+
+    def _compile_condition(self, condition):
+        """@return a function f(record) -> bool for the given condition"""
+        relation = condition.relation
+        negate = relation in negated_relation_map
+        relation = negated_relation_map.get(relation, relation)
+        matcher = self._matcher(relation, condition.values)
+        get_values = self._value_getter(condition.path)
+
+        if negate:
+            return lambda record: not any(matcher(v) for v in get_values(record))
+        return lambda record: any(matcher(v) for v in get_values(record))
+
+    def _value_getter(self, path):
+        """@return a function f(record) -> [value, ...] retrieving all values of the given path in a record.
+        Simple fields yield a single value, deep-link paths one value per linked entity"""
+        tokens = path.split(PATH_SEPARATOR)
+        field_name = tokens[0]
+        if len(tokens) == 1:
+            return lambda record: [record.get(field_name)]
+        # end handle simple fields
+
+        if len(tokens) % 2 == 0:
+            raise ValueError("Invalid deep-link path: %r" % (path,))
+        # end verify format
+        hops = zip(tokens[1::2], tokens[2::2])
+        resolve_link = self._resolve_link
+
+        def get_values(record):
+            values = [record.get(field_name)]
+            for type_name, link_field in hops:
+                next_values = list()
+                for value in values:
+                    links = isinstance(value, (list, tuple)) and value or [value]
+                    for link in links:
+                        if not isinstance(link, dict) or link.get('type') != type_name or resolve_link is None:
+                            continue
+                        # end skip links of other types
+                        next_values.append(resolve_link(link, link_field))
+                    # end for each link
+                # end for each value
+                values = next_values
+            # end for each hop
+            # no linked entity means no value
+            return values or [None]
+        # end utility
+        return get_values
+
+    def _matcher(self, relation, values):
+        """@return a function f(value) -> bool which returns True if the given field value matches the 
+        given non-negated relation and values
+        @throws ValueError if the relation is unknown"""
+        first = None
+        if values:
+            first = values[0]
+        # end get first value
+
+        if relation in ('is', 'in'):
+            if relation == 'is':
+                values = [first]
+            # end handle single value
+            keys = [self._key(v) for v in values]
+            def match(value):
+                if isinstance(value, (list, tuple)):
+                    if not value:
+                        return None in keys
+                    return any(self._key(item) in keys for item in value)
+                # end handle multiple values
+                return self._key(value) in keys
+            return match
+        elif relation in ('less_than', 'greater_than', 'between'):
+            if relation == 'between':
+                if len(values) != 2:
+                    raise ValueError("'between' needs exactly two values, got %r" % (values,))
+                # end check values
+                low, high = [_comparable(v) for v in values]
+                compare = lambda v: low <= v <= high
+            elif relation == 'less_than':
+                first = _comparable(first)
+                compare = lambda v: v < first
+            else:
+                first = _comparable(first)
+                compare = lambda v: v > first
+            # end handle comparison
+            def match(value):
+                if value is None:
+                    return False
+                try:
+                    return compare(_comparable(value))
+                except TypeError:
+                    return False
+                # end handle incompatible types
+            return match
+        elif relation in ('contains', 'starts_with', 'ends_with'):
+            return self._text_matcher(relation, first, lambda v: v)
+        elif relation in ('name_contains', 'name_starts_with', 'name_ends_with', 'name_is'):
+            name_relation = relation[len('name_'):]
+            if name_relation == 'is':
+                return lambda link: isinstance(link, dict) and link.get('name') == first
+            return self._text_matcher(name_relation, first, lambda link: isinstance(link, dict) and link.get('name') or None)
+        elif relation == 'type_is':
+            return lambda link: isinstance(link, dict) and link.get('type') == first
+        elif relation in ('in_last', 'in_next'):
+            if len(values) != 2:
+                raise ValueError("'%s' needs an amount and a unit, got %r" % (relation, values))
+            # end check values
+            amount, unit = values
+            if relation == 'in_last':
+                low, high = _shift(self._now, -int(amount), unit), self._now
+            else:
+                low, high = self._now, _shift(self._now, int(amount), unit)
+            # end handle direction
+            return self._date_range_matcher(low, high)
+        elif relation.startswith('in_calendar_'):
+            unit = relation[len('in_calendar_'):]
+            if unit not in ('day', 'week', 'month', 'year'):
+                raise ValueError("Unknown relation: %r" % (relation,))
+            # end check unit
+            offset = int(first or 0)
+            if unit == 'day':
+                anchor = _shift(self._now, offset, 'DAY')
+            elif unit == 'week':
+                anchor = _shift(self._now, offset, 'WEEK')
+            elif unit == 'month':
+                anchor = _shift(self._now, offset, 'MONTH')
+            else:
+                anchor = _shift(self._now, offset, 'YEAR')
+            # end handle unit
+            key = _calendar_key(anchor, unit)
+            def match(value):
+                value = _comparable(value)
+                if not isinstance(value, date):
+                    return False
+                return _calendar_key(value, unit) == key
+            return match
+        # end handle relation
+        raise ValueError("Unknown relation: %r" % (relation,))
+
+    def _text_matcher(self, relation, text, get_text):
+        """@return a matcher for the given case-insensitive text relation
+        @param get_text f(value) -> text or None"""
+        if text is None:
+            raise ValueError("'%s' needs a text to compare with" % relation)
+        # end check value
+        text = _comparable(unicode(text)).lower()
+        if relation == 'contains':
+            compare = lambda v: text in v
+        elif relation == 'starts_with':
+            compare = lambda v: v.startswith(text)
+        else:
+            compare = lambda v: v.endswith(text)
+        # end handle relation
+        def match(value):
+            if isinstance(value, (list, tuple)):
+                return any(match(item) for item in value)
+            # end handle multiple values
+            value = get_text(value)
+            if not isinstance(value, basestring):
+                return False
+            # end ignore non-text
+            return compare(_comparable(value).lower())
+        return match
+
+    def _date_range_matcher(self, low, high):
+        """@return a matcher for dates or datetimes within the given range, inclusive"""
+        low_date, high_date = low.date(), high.date()
+        def match(value):
+            value = _comparable(value)
+            if isinstance(value, datetime):
+                return low <= value <= high
+            elif isinstance(value, date):
+                return low_date <= value <= high_date
+            return False
+        return match
+
+    @classmethod
+    def _key(cls, value):
+        """@return a hashable key for the given value, which is equal for values shotgun considers equal"""
+        if isinstance(value, dict):
+            return (value.get('type'), value.get('id'))
+        elif isinstance(value, list):
+            return tuple(cls._key(v) for v in value)
+        value = _comparable(value)
+        if isinstance(value, unicode):
+            return value
+        try:
+            hash(value)
+        except TypeError:
+            return repr(value)
+        # end handle unhashable values
+        return value
+
+    ## -- End Compilation -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def matches(self, record):
+        """@return True if the given record matches our filters
+        @param record a dict as returned by shotgun"""
+        return self._predicate(record)
+
+    ## -- End Interface -- @}
+
+# end class FilterEvaluator
+
+
+def filter_records(records, filters, filter_operator = 'all', resolve_link = None):
+    """@return a list of all records matching the given filters
+    @param records an iterable of records, as returned by shotgun
+    @param filters and filter_operator see normalize_filters()
+    @param resolve_link see FilterEvaluator
+    @throws ValueError if the filters are not understood"""
+    matches = FilterEvaluator(normalize_filters(filters, filter_operator), resolve_link).matches
+    return [record for record in records if matches(record)]
+
+
+# ==============================================================================
+## @name Ordering
+# ------------------------------------------------------------------------------
+## @{
+
+def normalize_order(order):
+    """@return a list of (field_name, descending) tuples from the given shotgun order specification. 
+    'id' is always part of it, as last resort, to make the order deterministic.
+    @param order a list of dicts like {'field_name' : 'code', 'direction' : 'desc'}, as passed to 
+    IShotgunConnection.find(), or None
+    @throws ValueError if the specification is malformed or uses deep-link paths"""
+    out = list()
+    for item in order or list():
+        field_name = item.get('field_name', item.get('column'))
+        if not field_name or PATH_SEPARATOR in field_name:
+            raise ValueError("Invalid or unsupported order: %r" % (item,))
+        # end check field
+        direction = item.get('direction', 'asc')
+        if direction not in ('asc', 'desc'):
+            raise ValueError("Invalid order direction: %r" % (direction,))
+        # end check direction
+        out.append((field_name, direction == 'desc'))
+    # end for each item
+
+    if 'id' not in [item[0] for item in out]:
+        out.append(('id', False))
+    # end assure deterministic order
+    return out
+
+
+def _sort_key(value):
+    """@return a key to sort values of a field by, similar to how shotgun does it. Links are sorted by name"""
+    if isinstance(value, dict):
+        value = value.get('name')
+    elif isinstance(value, list):
+        return [_sort_key(v) for v in value]
+    # end handle links
+    return _comparable(value)
+
+
+def sort_records(records, order):
+    """Sort the given records in place
+    @param records a list of records, as returned by shotgun
+    @param order a normalized order specification, see normalize_order()
+    @return the records list
+    @note None is sorted before all other values"""
+    # as sorting is stable, we can sort by the least significant field first
+    for field_name, descending in reversed(order):
+        records.sort(key = lambda record: _sort_key(record.get(field_name)), reverse = descending)
+    # end for each field
+    return records
+
+## -- End Ordering -- @}
@@ -28,6 +28,12 @@ class IShotgunConnection(Interface):
     def find(self, entity_type, filters, fields, order=list(), filter_operator='all', limit=0, retired_only=False, page=0):
         pass
     
+    @abstractmethod
+    def iter_find(self, entity_type, filters, fields, order=list(), filter_operator='all', limit=0):
+        """@return an iterator over the records find() would return, which are read lazily, so only a few of 
+        them are in memory at a time
+        @note not part of the shotgun API"""
+    
     @abstractmethod
     def find_one(self, entity_type, filters, fields=['id'], order=list(), filter_operator='all'):
         pass
@@ -36,6 +42,11 @@ class IShotgunConnection(Interface):
     def summarize(self, entity_type, filters, summary_fields, filter_operator='all', grouping=list()):
         pass
     
+    @abstractmethod
+    def count(self, entity_type, filters, filter_operator='all'):
+        """@return the amount of entities matching the given filters, without reading them
+        @note not part of the shotgun API"""
+    
     @abstractmethod
     def create(self, entity_type, data, return_fields=list()):
         pass
@@ -0,0 +1,377 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.journal
+@brief A durable journal of shotgun writes, which are sent in the background
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = ['WriteJournal']
+
+import time
+import sqlite3
+import httplib
+import cPickle
+import logging
+import xmlrpclib
+import threading
+
+
+log = logging.getLogger('bshotgun.journal')
+
+
+# -------------------------
+## @name Constants
+# @{
+
+## State of journal entries which were not yet sent
+STATE_PENDING = 'pending'
+
+## State of journal entries which shotgun rejected
+STATE_CONFLICT = 'conflict'
+
+## Request types shotgun's batch() supports. All others are sent one by one
+batch_request_types = ('create', 'update', 'delete')
+
+## Errors which don't mean shotgun rejected a write, but that it couldn't be reached. Writes are retried.
+## shotgun_api3 raises a ProtocolError for HTTP errors, like 503 while shotgun is down for maintenance
+transient_errors = (EnvironmentError, httplib.HTTPException, xmlrpclib.ProtocolError)
+
+## -- End Constants -- @}
+
+
+class WriteJournal(object):
+    """Keeps shotgun writes in an sqlite database, and sends them to shotgun in a background thread.
+
+    Writes are sent in order. Consecutive create, update and delete requests are combined into batch() calls,
+    and updates of the same entity are merged into one if nothing else happened to it in between.
+
+    If shotgun can't be reached, writes stay in the journal and are retried later, even after the program
+    was restarted. If shotgun rejects a write, it is kept as conflict, which can be queried with conflicts(),
+    and is passed to the conflict handler, if there is one.
+
+    Use it with ProxyShotgunConnection.set_write_journal(), and close() it once you are done, as our writer
+    thread keeps us alive"""
+    __slots__ = (
+                    '_path',             # path to our sqlite database
+                    '_new_connection',   # f() -> shotgun connection to send writes with
+                    '_db',               # our sqlite connection
+                    '_lock',             # serializes access to _db
+                    '_condition',        # signals new writes, flush requests and progress
+                    '_thread',           # our writer thread, or None if it isn't running
+                    '_stop',             # if True, the writer thread stops
+                    '_flush_requested',  # if True, the writer sends without waiting for flush_interval
+                    '_conflict_handler', # f(request, error) called for each rejected write, or None
+                    '_error',            # the last transient error, or None
+                    '_attempts'          # amount of times the writer tried to send writes
+                )
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## Seconds to wait for more writes before sending them, which allows to combine them
+    flush_interval = 1.0
+
+    ## Seconds to wait before trying again if shotgun couldn't be reached
+    retry_interval = 10.0
+
+    ## Maximum amount of requests per batch() call
+    max_batch_size = 100
+
+    ## -- End Configuration -- @}
+
+    def __init__(self, path, new_connection):
+        """Initialize this instance, and send writes left from previous runs
+        @param path path to the sqlite database to keep writes in, which is created if needed
+        @param new_connection a function f() -> connection returning a shotgun connection to send writes
+        with, which must not use a journal itself. It is called in our writer thread"""
+        self._path = path
+        self._new_connection = new_connection
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS journal (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "state TEXT NOT NULL, request BLOB NOT NULL, error TEXT, time REAL)")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stop = False
+        self._flush_requested = False
+        self._conflict_handler = None
+        self._error = None
+        self._attempts = 0
+        if self.pending():
+            self._start()
+        # end send previous writes
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _execute(self, statement, args = ()):
+        """@return all rows of the given statement, which is committed right away"""
+        with self._lock:
+            rows = self._db.execute(statement, args).fetchall()
+            self._db.commit()
+        # end with lock
+        return rows
+
+    def _start(self):
+        """Start our writer thread, if it doesn't run yet"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            # end handle running thread
+            self._stop = False
+            self._thread = threading.Thread(target = self._run, name = 'bshotgun.journal')
+            self._thread.daemon = True
+            self._thread.start()
+        # end with condition
+
+    def _pending_entries(self):
+        """@return a list of (entry_id, request) tuples of up to max_batch_size pending writes, in order"""
+        rows = self._execute("SELECT id, request FROM journal WHERE state = ? ORDER BY id LIMIT ?",
+                             (STATE_PENDING, self.max_batch_size))
+        return [(entry_id, cPickle.loads(str(request))) for entry_id, request in rows]
+
+    @classmethod
+    def _coalesce(cls, entries):
+        """@return a list of (request, entry_ids) tuples, with consecutive updates of the same entity merged
+        @param entries a list of (entry_id, request) tuples"""
+        out = list()
+        updates = dict()
+        for entry_id, request in entries:
+            key = (request.get('entity_type'), request.get('entity_id'))
+            if request['request_type'] == 'update':
+                index = updates.get(key)
+                if index is not None:
+                    out[index][0]['data'].update(request['data'])
+                    out[index][1].append(entry_id)
+                    continue
+                # end merge updates
+                updates[key] = len(out)
+            else:
+                updates.pop(key, None)
+            # end handle updates
+            out.append((request, [entry_id]))
+        # end for each entry
+        return out
+
+    def _send_request(self, connection, request):
+        """@return the result of the given request, sent on its own"""
+        if request['request_type'] in batch_request_types:
+            return connection.batch([request])[0]
+        args = [request[name] for name in ('entity_type', 'entity_id') if name in request]
+        return getattr(connection, request['request_type'])(*args)
+
+    def _remove(self, entry_ids):
+        """Remove the given entries from the journal"""
+        self._execute("DELETE FROM journal WHERE id IN (%s)" % ','.join('?' * len(entry_ids)), entry_ids)
+
+    def _conflict(self, request, entry_ids, error):
+        """Mark the given entries as rejected by shotgun, and report them"""
+        self._execute("UPDATE journal SET state = ?, error = ?, time = ? WHERE id IN (%s)"
+                      % ','.join('?' * len(entry_ids)), [STATE_CONFLICT, str(error), time.time()] + entry_ids)
+        log.error("Shotgun rejected %r: %s", request, error)
+        if self._conflict_handler is not None:
+            self._conflict_handler(request, error)
+        # end call handler
+
+    def _send(self, connection):
+        """Send the next pending writes
+        @return True if there was something to send
+        @throws any of transient_errors if shotgun couldn't be reached"""
+        group = list()
+        def send_group():
+            try:
+                connection.batch([request for request, entry_ids in group])
+            except transient_errors:
+                raise
+            except Exception:
+                # batches succeed or fail as a whole - find the requests which were rejected
+                for request, entry_ids in group:
+                    send_one(request, entry_ids)
+                # end for each request
+            else:
+                self._remove(sum((entry_ids for request, entry_ids in group), list()))
+            # end handle rejected batches
+            del(group[:])
+
+        def send_one(request, entry_ids):
+            try:
+                self._send_request(connection, request)
+            except transient_errors:
+                raise
+            except Exception, err:
+                self._conflict(request, entry_ids, err)
+            else:
+                self._remove(entry_ids)
+            # end handle rejected requests
+        # end utilities
+
+        entries = self._pending_entries()
+        for request, entry_ids in self._coalesce(entries):
+            if request['request_type'] in batch_request_types:
+                group.append((request, entry_ids))
+                continue
+            # end collect batch requests
+            if group:
+                send_group()
+            # end send previous requests first
+            send_one(request, entry_ids)
+        # end for each request
+        if group:
+            send_group()
+        # end send remaining requests
+        return bool(entries)
+
+    def _run(self):
+        """The main loop of our writer thread"""
+        connection = None
+        condition = self._condition
+        while True:
+            with condition:
+                if not self._flush_requested and not self._stop:
+                    condition.wait(self.retry_interval if self._error else self.flush_interval)
+                # end wait for writes to gather
+                self._flush_requested = False
+                if self._stop:
+                    return
+                # end handle stop
+            # end with condition
+            try:
+                if connection is None:
+                    connection = self._new_connection()
+                # end connect on first use
+                while self._send(connection):
+                    with condition:
+                        condition.notify_all()
+                    # end signal progress
+                # end while there are writes
+                self._error = None
+            except transient_errors, err:
+                self._error = err
+                log.warn("Could not send writes to shotgun, will retry in %is: %s", self.retry_interval, err)
+            except Exception, err:
+                # never die, but tell about unexpected errors
+                self._error = err
+                log.error("Failed to send writes to shotgun: %s", err)
+            # end handle errors
+            with condition:
+                self._attempts += 1
+                condition.notify_all()
+            # end signal progress
+        # end loop forever
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def append(self, request):
+        """Add the given write to the journal, to be sent in the background
+        @param request a dict like the ones passed to shotgun's batch(), with 'request_type', 'entity_type', and
+        'entity_id' and 'data' as needed. 'revive' is supported as well
+        @return self"""
+        self._execute("INSERT INTO journal (state, request, time) VALUES (?, ?, ?)",
+                      (STATE_PENDING, sqlite3.Binary(cPickle.dumps(request, 2)), time.time()))
+        self._start()
+        return self
+
+    def pending(self):
+        """@return the amount of writes which were not yet sent"""
+        return self._execute("SELECT COUNT(*) FROM journal WHERE state = ?", (STATE_PENDING, ))[0][0]
+
+    def flush(self):
+        """Send all pending writes now, without waiting for more of them to gather. Doesn't block
+        @return self"""
+        self._start()
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+        # end with condition
+        return self
+
+    def wait(self, timeout = None):
+        """Send all pending writes now, and wait until they were sent or rejected
+        @param timeout if not None, the maximum amount of seconds to wait
+        @return True if there are no pending writes anymore, False if the timeout was reached, or if shotgun
+        couldn't be reached"""
+        deadline = timeout is not None and time.time() + timeout
+        attempts = self._attempts
+        self.flush()
+        while self.pending():
+            remaining = deadline and deadline - time.time()
+            if deadline and remaining <= 0:
+                return False
+            # end handle timeout
+            with self._condition:
+                self._condition.wait(min(remaining, 0.1) if deadline else 0.1)
+            # end with condition
+            if self._attempts != attempts and isinstance(self._error, transient_errors):
+                return False
+            # end handle unreachable shotgun
+        # end while there are writes
+        return True
+
+    def last_error(self):
+        """@return the last error we encountered when sending writes, or None if the last attempt succeeded"""
+        return self._error
+
+    def conflicts(self):
+        """@return a list of dicts with 'id', 'request', 'error' and 'time' of all writes shotgun rejected, in
+        order"""
+        rows = self._execute("SELECT id, request, error, time FROM journal WHERE state = ? ORDER BY id",
+                             (STATE_CONFLICT, ))
+        return [{'id' : entry_id, 'request' : cPickle.loads(str(request)), 'error' : error, 'time' : stamp}
+                for entry_id, request, error, stamp in rows]
+
+    def clear_conflicts(self, entry_ids = None):
+        """Forget about the given conflicts
+        @param entry_ids if None, all conflicts are removed, otherwise a list of 'id's as returned by
+        conflicts()
+        @return self"""
+        if entry_ids is None:
+            self._execute("DELETE FROM journal WHERE state = ?", (STATE_CONFLICT, ))
+        elif entry_ids:
+            self._remove(list(entry_ids))
+        # end handle ids
+        return self
+
+    def conflict_handler(self):
+        """@return the handler set with set_conflict_handler(), or None"""
+        return self._conflict_handler
+
+    def set_conflict_handler(self, handler):
+        """Call the given handler with each write shotgun rejects, in our writer thread
+        @param handler a function f(request, error), or None
+        @return self"""
+        self._conflict_handler = handler
+        return self
+
+    def close(self, flush = True, timeout = None):
+        """Stop our writer thread. Writes which were not sent remain in the journal
+        @param flush if True, pending writes are sent first, see wait()
+        @param timeout the maximum amount of seconds to wait for writes to be sent
+        @return self"""
+        thread = getattr(self, '_thread', None)
+        if thread is None:
+            return self
+        # end handle no thread
+        if flush:
+            self.wait(timeout)
+        # end send pending writes
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        # end with condition
+        if thread is not threading.current_thread():
+            thread.join()
+        # end wait for thread
+        self._thread = None
+        return self
+
+    ## -- End Interface -- @}
+
+# end class WriteJournal
@@ -9,13 +9,23 @@
 __all__ = ['ShotgunBeSubCommand']
 
 import sys
+import time
 
 import bapp
 from butility import (Version,
                       Path)
 from be import BeSubCommand
 from bshotgun import (ProxyShotgunConnection,
-                      SQLProxyShotgunConnection)
+                      SQLProxyShotgunConnection,
+                      LAYOUT_BLOB,
+                      LAYOUT_COLUMNAR,
+                      record_codec_names,
+                      benchmark_record_codecs,
+                      iter_entities,
+                      ParallelFetcher,
+                      EventLogSync,
+                      DeltaRefresh)
+from bshotgun.sync import EVENT_LOG_KEY
 from bshotgun.orm import ShotgunTypeFactory
 from bcmd import CommandlineOverridesMixin
 
@@ -71,6 +81,9 @@ class ShotgunBeSubCommand(CommandlineOverridesMixin, BeSubCommand, bapp.plugin_t
     OP_SCHEMA_CACHE = 'update-schema-cache'
     OP_SQL_CACHE = 'initialize-sql-cache'
     OP_SHOW = 'show'
+    OP_BENCHMARK_CODECS = 'benchmark-codecs'
+    OP_SYNC = 'sync-sql-cache'
+    OP_REFRESH = 'refresh-sql-cache'
     
     ## -- End Configuration -- @}
 
@@ -121,6 +134,107 @@ Mainly used for debugging, and entities with invalid things in them."
                                dest='ignored_type',
                                help=help)
 
+        help = "The layout of the tables to create. '%s' stores each record as serialized blob, '%s' uses one \
+typed column per field, which allows to filter, sort and read individual fields within the database." \
+                % (LAYOUT_BLOB, LAYOUT_COLUMNAR)
+        subparser.add_argument('--layout',
+                               choices=(LAYOUT_BLOB, LAYOUT_COLUMNAR),
+                               default=LAYOUT_BLOB,
+                               dest='layout',
+                               help=help)
+
+        help = "The amount of records to read from shotgun and insert into the database at once. It bounds \
+the amount of memory used, no matter how many records a type has."
+        subparser.add_argument('--chunk-size',
+                               type=int,
+                               default=SQLProxyShotgunConnection.rows_per_insert,
+                               dest='chunk_size',
+                               help=help)
+
+        help = "Continue a previous, interrupted initialization of the database. Types that were loaded \
+completely are skipped, others continue after the last record that was written."
+        subparser.add_argument('--resume',
+                               action='store_true',
+                               default=False,
+                               dest='resume',
+                               help=help)
+
+        help = "The amount of requests to shotgun to have in flight at once. If larger than 1, several types, \
+and ranges of records within large types, are read in parallel, while a single writer fills the database."
+        subparser.add_argument('--jobs',
+                               type=int,
+                               default=1,
+                               dest='jobs',
+                               help=help)
+
+        ################################
+        # SUBCOMMAND: sync-sql-cache ##
+        ##############################
+        description = "apply changes made in shotgun to an SQL cache"
+        help = """Read all events shotgun logged since the last sync, and read the entities they are about
+again to update the SQL cache. The first sync only remembers the latest event."""
+        subparser = factory.add_parser(self.OP_SYNC, description=description, help=help)
+
+        help = "An sqlalchemy URL to an existing SQL cache, e.g. sqlite:///relative-path.sqlite"
+        subparser.add_argument('sqlalchemy-url',
+                               type=str, 
+                               help=help)
+
+        help = "If set, sync again and again, waiting the given amount of seconds in between"
+        subparser.add_argument('--interval',
+                               type=float,
+                               default=0,
+                               dest='interval',
+                               help=help)
+
+        ###################################
+        # SUBCOMMAND: refresh-sql-cache ##
+        #################################
+        description = "apply changes made in shotgun to an SQL cache, without using the event log"
+        help = """Read all records which were updated since the last refresh, and remove the ones which were 
+deleted in shotgun. Use it if the event log can't be used for %s.""" % self.OP_SYNC
+        subparser = factory.add_parser(self.OP_REFRESH, description=description, help=help)
+
+        help = "An sqlalchemy URL to an existing SQL cache, e.g. sqlite:///relative-path.sqlite"
+        subparser.add_argument('sqlalchemy-url',
+                               type=str, 
+                               help=help)
+
+        help = "An entity type to refresh. May be given multiple times. If unset, all types are refreshed"
+        subparser.add_argument('--type',
+                               action='append',
+                               default=list(),
+                               dest='type_names',
+                               help=help)
+
+        ##################################
+        # SUBCOMMAND: benchmark-codecs ##
+        ################################
+        description = "measure record codecs on the data of an SQL cache"
+        help = """Encode and decode all records of an SQL cache with each record codec, and report throughput 
+and size per entity type. Use the results to choose the sql_record_codec kvstore value."""
+        subparser = factory.add_parser(self.OP_BENCHMARK_CODECS, description=description, help=help)
+
+        help = "An sqlalchemy URL to an existing SQL cache, e.g. sqlite:///relative-path.sqlite"
+        subparser.add_argument('sqlalchemy-url',
+                               type=str, 
+                               help=help)
+
+        help = "A codec to measure. May be given multiple times. If unset, all codecs are measured"
+        subparser.add_argument('--codec',
+                               action='append',
+                               choices=record_codec_names(),
+                               default=list(),
+                               dest='codecs',
+                               help=help)
+
+        help = "An entity type to measure. May be given multiple times. If unset, all types are measured"
+        subparser.add_argument('--type',
+                               action='append',
+                               default=list(),
+                               dest='type_names',
+                               help=help)
+
         ######################
         # SUBCOMMAND: show ##
         ####################
@@ -136,6 +250,35 @@ Mainly used for debugging, and entities with invalid things in them."
 
         return self
 
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _benchmark_codecs(self, db, type_names, codecs):
+        """Measure the given codecs with the records of the given types, and write the results to stdout
+        @param db an SQLProxyShotgunConnection
+        @param type_names names of the types to measure, or an empty list to measure all types
+        @param codecs names of the codecs to measure, or an empty list to measure all codecs"""
+        write = sys.stdout.write
+        MB = 1024.0 * 1024.0
+        write("%-24s %-14s %8s %12s %10s %12s %10s %12s %10s\n" % ('type', 'codec', 'records', 'bytes', 
+              'bytes/rec', 'enc rec/s', 'enc MB/s', 'dec rec/s', 'dec MB/s'))
+        for type_name in sorted(type_names or db.type_names()):
+            fields = db.field_names(type_name)
+            records = fields and db.find(type_name, [], fields)
+            if not records:
+                continue
+            # end skip empty types
+            for res in benchmark_record_codecs(records, codecs or None):
+                count, size = res['records'], res['bytes']
+                enc, dec = max(res['encode_time'], 1e-6), max(res['decode_time'], 1e-6)
+                write("%-24s %-14s %8i %12i %10.1f %12.0f %10.2f %12.0f %10.2f\n" % (type_name, res['codec'], 
+                      count, size, float(size) / count, count / enc, size / MB / enc, count / dec, size / MB / dec))
+            # end for each codec
+        # end for each type
+
+    ## -- End Utilities -- @}
+
     def execute(self, args, remaining_args):
         try:
             self.apply_overrides(combined_shotgun_schema, args)
@@ -145,22 +288,80 @@ Mainly used for debugging, and entities with invalid things in them."
             elif args.operation == self.OP_SQL_CACHE:
                 conn = ProxyShotgunConnection()
                 tf = CommandShotgunTypeFactory(ignored_types=args.ignored_type)
-                fetcher = lambda tn: conn.find(tn, list(), tf.schema_by_name(tn).keys())
-                SQLProxyShotgunConnection.init_database(getattr(args, 'sqlalchemy-url'), tf, fetcher)
+                fields = lambda tn: tf.schema_by_name(tn).keys()
+                if args.jobs > 1:
+                    fetcher = ParallelFetcher(ProxyShotgunConnection, tf.type_names(), fields, args.jobs, 
+                                              args.chunk_size)
+                else:
+                    fetcher = lambda tn, after_id=None: iter_entities(conn, tn, fields(tn), args.chunk_size, 
+                                                                      after_id)
+                # end handle parallel reads
+                codec = SQLProxyShotgunConnection().record_codec().name()
+                # changes made while we read are applied by the next sync
+                meta_values = {EVENT_LOG_KEY : str(EventLogSync.latest_event_id(conn))}
+                try:
+                    SQLProxyShotgunConnection.init_database(getattr(args, 'sqlalchemy-url'), tf, fetcher, 
+                                                            args.layout, codec, args.chunk_size, args.resume,
+                                                            meta_values)
+                finally:
+                    if args.jobs > 1:
+                        fetcher.close()
+                    # end stop threads
+                # end assure threads are stopped
+            elif args.operation == self.OP_SYNC:
+                db = SQLProxyShotgunConnection(db_url=getattr(args, 'sqlalchemy-url'))
+                try:
+                    sync = EventLogSync(ProxyShotgunConnection(), db)
+                    while True:
+                        sync.sync()
+                        if not args.interval:
+                            break
+                        # end handle single sync
+                        time.sleep(args.interval)
+                    # end while we should sync
+                finally:
+                    db.close()
+                # end assure connections are closed
+            elif args.operation == self.OP_REFRESH:
+                db = SQLProxyShotgunConnection(db_url=getattr(args, 'sqlalchemy-url'))
+                try:
+                    type_names = args.type_names
+                    if not type_names:
+                        stored = set(db.type_names())
+                        type_names = [tn for tn in ShotgunTypeFactory().type_names() if tn.lower() in stored]
+                    # end handle all types
+                    DeltaRefresh(ProxyShotgunConnection(), db).refresh(type_names)
+                finally:
+                    db.close()
+                # end assure connections are closed
+            elif args.operation == self.OP_BENCHMARK_CODECS:
+                db = SQLProxyShotgunConnection(db_url=getattr(args, 'sqlalchemy-url'))
+                try:
+                    self._benchmark_codecs(db, [tn.lower() for tn in args.type_names], args.codecs)
+                finally:
+                    db.close()
+                # end assure connections are closed
             elif args.operation == self.OP_SHOW:
+                db = None
                 if args.location and is_sqlalchemy_url(args.location):
                     # SQL
                     db = SQLProxyShotgunConnection(db_url=args.location)
-                    fetcher = lambda tn: db.find(tn, [], ['id'])
+                    fetcher = lambda tn: db.iter_find(tn, [], db.field_names(tn))
                     type_names = db.type_names()
                 else:
                     # SHOTGUN
                     conn = ProxyShotgunConnection()
                     fac = ShotgunTypeFactory()
-                    fetcher = lambda tn: conn.find(tn, list(), fac.schema_by_name(tn).keys())
+                    fetcher = lambda tn: conn.iter_find(tn, list(), fac.schema_by_name(tn).keys())
                     type_names = fac.type_names()
                 # end handle supported types
-                TypeStreamer(fetcher, type_names).stream(sys.stdout.write)
+                try:
+                    TypeStreamer(fetcher, type_names).stream(sys.stdout.write)
+                finally:
+                    if db is not None:
+                        db.close()
+                    # end handle SQL
+                # end assure connections are closed
             else:
                 raise NotImplemented(self.operation)
             return self.SUCCESS
@@ -12,6 +12,8 @@ from butility import Path
 from bkvstore import (KeyValueStoreSchema,
                       KeyValueStoreSchemaValidator)
 
+from .serialization import DEFAULT_RECORD_CODEC
+
 
 shotgun_schema = KeyValueStoreSchema('shotgun', {'host' : str,
                                                  'api_script' : str,
@@ -22,7 +24,12 @@ type_factory_schema = KeyValueStoreSchema(shotgun_schema.key(), {'schema_cache_t
 
 sql_shotgun_schema = KeyValueStoreSchemaValidator.merge_schemas(
                         (shotgun_schema,
-                            KeyValueStoreSchema(shotgun_schema.key(), {'sql_cache_url' : str })))
+                            KeyValueStoreSchema(shotgun_schema.key(), {'sql_cache_url' : str,
+                                                                       'sql_record_codec' : DEFAULT_RECORD_CODEC,
+                                                                       # connection pool of the sql cache
+                                                                       'sql_pool_size' : 5,
+                                                                       'sql_max_overflow' : 10,
+                                                                       'sql_pool_recycle' : 3600})))
 
 
 # this one should contain all the keys
@@ -0,0 +1,710 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.serialization
+@brief Codecs to turn shotgun records into binary blobs, and back
+
+Each blob starts with a small header which names the codec that wrote it, which allows blobs of different
+codecs to coexist within one database. Blobs written before there were codecs have no header, and are
+read as well.
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = ['RecordCodec', 'RecordLayout', 'SchemaRecordCodec', 'DictionaryRecordCodec', 'register_record_codec', 'record_codec', 'record_codec_names', 'decode_record',
+           'decode_value', 'benchmark_record_codecs', 'DEFAULT_RECORD_CODEC']
+
+import time
+import marshal
+import zlib
+from datetime import (datetime,
+                      date)
+from cPickle import (dumps,
+                     loads,
+                     HIGHEST_PROTOCOL)
+from zlib import (compress,
+                  decompress)
+
+from .filters import utc
+
+
+# -------------------------
+## @name Constants
+# @{
+
+## First byte of each blob with a header. It is never the first byte of a zlib stream, which is how blobs
+## without header start
+BLOB_MAGIC = '\xb5'
+
+## Version of the header layout, which is the second byte of each blob with a header
+BLOB_HEADER_VERSION = 1
+
+## Amount of bytes in the header of a blob
+BLOB_HEADER_SIZE = 3
+
+## Name of the codec we use if nothing else is configured
+DEFAULT_RECORD_CODEC = 'schema-zdict'
+
+## Keys of links we store positionally, if a link has exactly these
+LINK_KEYS = ('type', 'id', 'name')
+
+## Maximum size of a trained compression dictionary. zlib can't look back further than 32kb, and we leave
+## room for the data itself
+DICTIONARY_SIZE = 30 * 1024
+
+## Tags of the tuples we use to represent values marshal can't handle. Shotgun values never contain tuples
+_DATETIME_TAG = 'dt'
+_DATE_TAG = 'd'
+_PICKLE_TAG = 'p'
+
+## First byte of marshalled tuples
+_MARSHAL_TUPLE = marshal.dumps(tuple())[0]
+
+## -- End Constants -- @}
+
+
+# ==============================================================================
+## @name Marshal Support
+# ------------------------------------------------------------------------------
+## @{
+
+def _to_marshallable(value):
+    """@return the given value, with all parts marshal can't handle converted into tagged tuples"""
+    if value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return value
+    elif isinstance(value, dict):
+        return dict((k, _to_marshallable(v)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return [_to_marshallable(v) for v in value]
+    elif isinstance(value, datetime):
+        aware = value.tzinfo is not None
+        if aware:
+            value = value.astimezone(utc)
+        # end convert to utc
+        return (_DATETIME_TAG, value.year, value.month, value.day, value.hour, value.minute, value.second,
+                value.microsecond, aware)
+    elif isinstance(value, date):
+        return (_DATE_TAG, value.year, value.month, value.day)
+    # end handle type
+    return (_PICKLE_TAG, dumps(value, HIGHEST_PROTOCOL))
+
+
+def _from_marshallable(value):
+    """@return a value formerly converted with _to_marshallable()"""
+    if isinstance(value, tuple):
+        tag = value[0]
+        if tag == _DATETIME_TAG:
+            return datetime(*value[1:8], tzinfo = utc if value[8] else None)
+        elif tag == _DATE_TAG:
+            return date(*value[1:])
+        return loads(value[1])
+    elif isinstance(value, dict):
+        return dict((k, _from_marshallable(v)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return [_from_marshallable(v) for v in value]
+    # end handle type
+    return value
+
+
+def _marshal_dumps(value):
+    """@return value serialized with marshal. Values marshal can't handle are converted and wrapped into a 
+    tuple, which is how _marshal_loads() knows that it has to convert them back"""
+    try:
+        return marshal.dumps(value, 2)
+    except ValueError:
+        return marshal.dumps((_to_marshallable(value), ), 2)
+    # end handle unmarshallable values
+
+
+def _marshal_loads(value_buffer):
+    """@return a value formerly serialized with _marshal_dumps()"""
+    if value_buffer[0] == _MARSHAL_TUPLE:
+        return _from_marshallable(marshal.loads(value_buffer)[0])
+    return marshal.loads(value_buffer)
+
+
+def _pickle_dumps(value):
+    """@return value serialized with cPickle"""
+    return dumps(value, HIGHEST_PROTOCOL)
+
+## -- End Marshal Support -- @}
+
+
+class RecordCodec(object):
+    """Serializes records and single values with a particular serializer and compression level.
+
+    Each value of a record is serialized separately, and kept in a marshalled dict, which allows to decode only
+    the fields that are needed."""
+    __slots__ = (
+                    '_name',   # name of the codec
+                    '_header', # header of all blobs we write
+                    '_dumps',  # f(value) -> string
+                    '_loads',  # f(string) -> value
+                    '_level'   # zlib compression level, or 0 to not compress
+                )
+
+    def __init__(self, name, codec_id, dumps, loads, level):
+        """Initialize this instance
+        @param name a unique name of the codec, used to choose it in the configuration
+        @param codec_id a unique id in the range 1 to 255, which is stored in each blob. It must never change
+        once blobs were written with it
+        @param dumps a function f(value) -> string
+        @param loads a function f(string) -> value, to undo what dumps did
+        @param level zlib compression level, or 0 to store data uncompressed"""
+        assert 0 < codec_id < 256, "Invalid codec id: %i" % codec_id
+        self._name = name
+        self._header = BLOB_MAGIC + chr(BLOB_HEADER_VERSION) + chr(codec_id)
+        self._dumps = dumps
+        self._loads = loads
+        self._level = level
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _pack(self, data):
+        """@return a blob with header from the given serialized data"""
+        if self._level:
+            data = compress(data, self._level)
+        # end handle compression
+        return self._header + data
+
+    def _unpack(self, blob):
+        """@return serialized data from the given blob, which was written by _pack()"""
+        data = blob[BLOB_HEADER_SIZE:]
+        if self._level:
+            return decompress(data)
+        # end handle compression
+        return str(data)
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def name(self):
+        """@return our name"""
+        return self._name
+
+    def codec_id(self):
+        """@return the id we store in each blob"""
+        return ord(self._header[2])
+
+    def uses_layout(self):
+        """@return True if encode() and decode() need a RecordLayout"""
+        return False
+
+    def uses_dictionary(self):
+        """@return True if the RecordLayout needs a compression dictionary, see train_dictionary()"""
+        return False
+
+    def train_dictionary(self, records, layout, max_size = DICTIONARY_SIZE):
+        """Build a compression dictionary from the given records, and set it to the given layout. 
+        Only implemented if uses_dictionary() is True
+        @return the dictionary"""
+        raise NotImplementedError("Codec '%s' doesn't use dictionaries" % self._name)
+
+    def encode(self, record, layout = None):
+        """@return a blob representing the given record
+        @param layout a RecordLayout of the record's type, only used if uses_layout() is True"""
+        dumps = self._dumps
+        return self._pack(marshal.dumps(dict((name, dumps(value)) for name, value in record.iteritems()), 2))
+
+    def decode(self, blob, fields = None, layout = None):
+        """@return a record formerly encoded by encode()
+        @param blob a string or buffer
+        @param fields if not None, an iterable of field names to decode and return, in addition to 'id' and
+        'type'. Unknown fields are ignored
+        @param layout the RecordLayout used by encode(), only used if uses_layout() is True"""
+        loads = self._loads
+        values = marshal.loads(self._unpack(blob))
+        if fields is None:
+            return dict((name, loads(value)) for name, value in values.iteritems())
+        out = dict()
+        for name in fields:
+            if name in values:
+                out[name] = loads(values[name])
+            # end ignore unknown fields
+        # end for each field
+        for name in ('id', 'type'):
+            if name not in out and name in values:
+                out[name] = loads(values[name])
+            # end handle identity
+        # end for each identity field
+        return out
+
+    def encode_value(self, value):
+        """@return a blob representing the given value"""
+        return self._pack(self._dumps(value))
+
+    def decode_value(self, blob):
+        """@return a value formerly encoded by encode_value()"""
+        return self._loads(self._unpack(blob))
+
+    ## -- End Interface -- @}
+
+# end class RecordCodec
+
+
+class RecordLayout(object):
+    """Assigns an ordinal to each field of an entity type, along with its shotgun data type.
+
+    Ordinals never change once they are assigned, new fields are appended. This allows to read records that
+    were written before fields were added."""
+    __slots__ = (
+                    '_type_name', # name of the shotgun type
+                    '_fields',    # list of (field_name, data_type) tuples, in order of their ordinal
+                    '_ordinals',  # field_name -> ordinal
+                    '_changed',   # True if fields were added since we were created
+                    '_dictionary',   # a string of data typical for our records, used as zlib preset dictionary
+                    '_compressors',  # level -> compressor primed with our dictionary
+                    '_decompressor'  # decompressor primed with our dictionary, or None
+                )
+
+    def __init__(self, type_name, fields = ()):
+        """Initialize this instance
+        @param type_name name of the shotgun type, which is set as 'type' of all decoded records
+        @param fields an iterable of (field_name, data_type) tuples, in order of their ordinal"""
+        self._type_name = type_name
+        self._fields = list()
+        self._ordinals = dict()
+        for field_name, data_type in fields:
+            self.add_field(field_name, data_type)
+        # end for each field
+        self._changed = False
+        self.set_dictionary('')
+
+    @classmethod
+    def from_schema(cls, type_name, schema):
+        """@return a new layout with all fields of the given schema, sorted by name
+        @param cls
+        @param schema a schema as obtained by ShotgunTypeFactory.schema_by_name()"""
+        return cls(type_name, ((field_name, schema[field_name].data_type.value) 
+                               for field_name in sorted(schema.keys())))
+
+    @classmethod
+    def from_string(cls, data):
+        """@return a layout formerly serialized with to_string()
+        @param cls"""
+        type_name, fields = marshal.loads(str(data))
+        return cls(type_name, fields)
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def to_string(self):
+        """@return a string representing this layout"""
+        return marshal.dumps((self._type_name, self._fields), 2)
+
+    def type_name(self):
+        """@return name of the shotgun type we describe"""
+        return self._type_name
+
+    def fields(self):
+        """@return a list of (field_name, data_type) tuples, in order of their ordinal. Must not be changed"""
+        return self._fields
+
+    def ordinal(self, field_name):
+        """@return the ordinal of the given field, or None if it is unknown"""
+        return self._ordinals.get(field_name)
+
+    def add_field(self, field_name, data_type):
+        """Add the given field with the next free ordinal, if it is not yet known
+        @return its ordinal"""
+        ordinal = self._ordinals.get(field_name)
+        if ordinal is None:
+            ordinal = self._ordinals[field_name] = len(self._fields)
+            self._fields.append((field_name, data_type))
+            self._changed = True
+        # end handle new fields
+        return ordinal
+
+    def add_value(self, field_name, value):
+        """Add the given field if it is not yet known, and guess its data type from the given value
+        @return its ordinal"""
+        ordinal = self._ordinals.get(field_name)
+        if ordinal is not None:
+            return ordinal
+        # end handle known fields
+        data_type = None
+        if isinstance(value, dict) and 'id' in value:
+            data_type = 'entity'
+        elif isinstance(value, list) and value and isinstance(value[0], dict) and 'id' in value[0]:
+            data_type = 'multi_entity'
+        # end guess link types
+        return self.add_field(field_name, data_type)
+
+    def is_changed(self):
+        """@return True if fields were added since this instance was created"""
+        return self._changed
+
+    def dictionary(self):
+        """@return the compression dictionary of our records, which is empty unless it was set"""
+        return self._dictionary
+
+    def set_dictionary(self, dictionary):
+        """Set the compression dictionary of our records. It must not change once records were compressed
+        with it
+        @param dictionary a string of data which is typical for our records, see 
+        DictionaryRecordCodec.train_dictionary()
+        @return self"""
+        self._dictionary = str(dictionary)
+        self._compressors = dict()
+        self._decompressor = None
+        return self
+
+    def compress(self, data, level):
+        """@return data compressed with zlib, as if our dictionary had been compressed right before it, 
+        which is how preset dictionaries work. The dictionary itself is not part of the output"""
+        compressor = self._compressors.get(level)
+        if compressor is None:
+            compressor = self._compressors[level] = zlib.compressobj(level)
+            compressor.compress(self._dictionary)
+            compressor.flush(zlib.Z_SYNC_FLUSH)
+        # end prime compressor
+        compressor = compressor.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        """@return data formerly compressed with compress()"""
+        if self._decompressor is None:
+            compressor = zlib.compressobj(1)
+            primer = compressor.compress(self._dictionary) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._decompressor = zlib.decompressobj()
+            self._decompressor.decompress(primer)
+        # end prime decompressor
+        decompressor = self._decompressor.copy()
+        return decompressor.decompress(data) + decompressor.flush()
+
+    ## -- End Interface -- @}
+
+# end class RecordLayout
+
+
+def _compact_link(link):
+    """@return a list of the values of the given link, if it has exactly the LINK_KEYS, or the link itself"""
+    if isinstance(link, dict) and len(link) == len(LINK_KEYS) and 'type' in link and 'id' in link and \
+                                                                                        'name' in link:
+        return [link['type'], link['id'], link['name']]
+    return link
+
+
+def _expand_link(link):
+    """@return a link formerly compacted with _compact_link()"""
+    if isinstance(link, list):
+        return dict(zip(LINK_KEYS, link))
+    return link
+
+
+class SchemaRecordCodec(RecordCodec):
+    """Stores records as a bitmap of the fields that are present, and a list of their values in order of
+    their ordinal in a RecordLayout.
+
+    Field names and the 'type' are not stored at all, and links are stored as lists of their values. Single
+    fields are decoded without touching any other value."""
+    __slots__ = ()
+
+    def __init__(self, name, codec_id, level):
+        """Initialize this instance, see RecordCodec.__init__()"""
+        super(SchemaRecordCodec, self).__init__(name, codec_id, _marshal_dumps, _marshal_loads, level)
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def uses_layout(self):
+        return True
+
+    def encode(self, record, layout = None):
+        """@return a blob representing the given record
+        @param layout the RecordLayout of the record's type. Fields it doesn't know yet are added to it,
+        which is when it must be stored again, see RecordLayout.is_changed()"""
+        if layout is None:
+            raise ValueError("Codec '%s' needs a record layout" % self._name)
+        # end check layout
+        return self._pack_record(marshal.dumps(self._serialize(record, layout), 2), layout)
+
+    def decode(self, blob, fields = None, layout = None):
+        """@return a record formerly encoded by encode(), see RecordCodec.decode()
+        @throws ValueError if the blob has fields the layout doesn't know, which may be the ones asked for. 
+        This happens if another process added fields to the layout after it was read"""
+        if layout is None:
+            raise ValueError("Codec '%s' needs a record layout" % self._name)
+        # end check layout
+        bitmap, values = marshal.loads(self._unpack_record(blob, layout))
+        layout_fields = layout.fields()
+        if bitmap >> len(layout_fields) and (fields is None or 
+                                             any(layout.ordinal(name) is None for name in fields)):
+            raise ValueError("Record has fields the layout of '%s' doesn't know" % layout.type_name())
+        # end check for unknown fields
+        if fields is None:
+            ordinals = [ordinal for ordinal in xrange(len(layout_fields)) if bitmap >> ordinal & 1]
+            positions = xrange(len(ordinals))
+        else:
+            ordinals = list()
+            positions = list()
+            for name in set(fields) | set(('id', )):
+                ordinal = layout.ordinal(name)
+                if ordinal is None or not bitmap >> ordinal & 1:
+                    continue
+                # end skip unknown and missing fields
+                ordinals.append(ordinal)
+                # the amount of values stored before ours
+                positions.append(bin(bitmap & ((1 << ordinal) - 1)).count('1'))
+            # end for each field
+        # end handle projection
+
+        loads = self._loads
+        out = {'type' : layout.type_name()}
+        for ordinal, position in zip(ordinals, positions):
+            name, data_type = layout_fields[ordinal]
+            value = loads(values[position])
+            if data_type == 'entity':
+                value = _expand_link(value)
+            elif data_type == 'multi_entity' and isinstance(value, list):
+                value = [_expand_link(link) for link in value]
+            # end handle links
+            out[name] = value
+        # end for each field
+        return out
+
+    ## -- End Interface -- @}
+
+    # -------------------------
+    ## @name Subclass Interface
+    # @{
+
+    def _pack_record(self, data, layout):
+        """@return a blob with header from the given serialized record of the given layout"""
+        return self._pack(data)
+
+    def _unpack_record(self, blob, layout):
+        """@return a serialized record from the given blob, which was written by _pack_record()"""
+        return self._unpack(blob)
+
+    ## -- End Subclass Interface -- @}
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _serialize(self, record, layout):
+        """@return a tuple of (bitmap, values) representing the given record, where values is a list of 
+        serialized values of all fields in the bitmap, in order of their ordinal"""
+        fields = layout.fields()
+        add_value = layout.add_value
+        items = sorted((add_value(name, value), value) for name, value in record.iteritems() if name != 'type')
+        bitmap = 0
+        values = list()
+        dumps = self._dumps
+        for ordinal, value in items:
+            bitmap |= 1 << ordinal
+            data_type = fields[ordinal][1]
+            if data_type == 'entity':
+                value = _compact_link(value)
+            elif data_type == 'multi_entity' and isinstance(value, list):
+                value = [_compact_link(link) for link in value]
+            # end handle links
+            values.append(dumps(value))
+        # end for each value
+        return bitmap, values
+
+    ## -- End Utilities -- @}
+
+# end class SchemaRecordCodec
+
+
+class DictionaryRecordCodec(SchemaRecordCodec):
+    """Stores records like the SchemaRecordCodec, but compresses them with a preset dictionary kept by the 
+    RecordLayout, which is trained from typical records of its type.
+
+    This makes small records compress much better, as they can refer to data seen in other records."""
+    __slots__ = ()
+
+    # -------------------------
+    ## @name Subclass Interface
+    # @{
+
+    def _pack_record(self, data, layout):
+        return self._header + layout.compress(data, self._level)
+
+    def _unpack_record(self, blob, layout):
+        return layout.decompress(blob[BLOB_HEADER_SIZE:])
+
+    ## -- End Subclass Interface -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def uses_dictionary(self):
+        return True
+
+    def train_dictionary(self, records, layout, max_size = DICTIONARY_SIZE):
+        """Build a compression dictionary from values which repeat within the given records, and set it
+        to the given layout
+        @param records a sample of records of the layout's type
+        @param layout the RecordLayout to set the dictionary to. It must not have been used to compress 
+        records yet
+        @param max_size the maximum size of the dictionary in bytes
+        @return the dictionary"""
+        counts = dict()
+        for record in records:
+            for value in self._serialize(record, layout)[1]:
+                counts[value] = counts.get(value, 0) + 1
+            # end for each value
+        # end for each record
+
+        # values seen just once are unlikely to be seen again, and tiny ones don't save anything
+        candidates = sorted(((count * len(value), value) for value, count in counts.iteritems() 
+                                                         if count > 1 and len(value) > 3), reverse = True)
+        chosen = list()
+        size = 0
+        for score, value in candidates:
+            if size + len(value) > max_size:
+                continue
+            # end skip values that don't fit
+            chosen.append(value)
+            size += len(value)
+        # end for each candidate
+
+        # the most valuable data goes last, where it is closest to the data, and cheapest to refer to
+        dictionary = ''.join(reversed(chosen))
+        layout.set_dictionary(dictionary)
+        return dictionary
+
+    ## -- End Interface -- @}
+
+# end class DictionaryRecordCodec
+
+
+# ==============================================================================
+## @name Registry
+# ------------------------------------------------------------------------------
+## @{
+
+## name -> RecordCodec
+_codecs_by_name = dict()
+
+## codec_id -> RecordCodec
+_codecs_by_id = dict()
+
+
+def register_record_codec(codec):
+    """Register the given codec, to make it available by name, and to allow decoding its blobs
+    @param codec a RecordCodec instance, whose name and id must not be used yet
+    @return the codec"""
+    assert codec.name() not in _codecs_by_name, "Codec named '%s' is already registered" % codec.name()
+    assert codec.codec_id() not in _codecs_by_id, "Codec id %i is already in use" % codec.codec_id()
+    _codecs_by_name[codec.name()] = codec
+    _codecs_by_id[codec.codec_id()] = codec
+    return codec
+
+
+def record_codec(name = None):
+    """@return the codec registered under the given name
+    @param name name of the codec, or None to obtain the DEFAULT_RECORD_CODEC
+    @throws ValueError if there is no such codec"""
+    try:
+        return _codecs_by_name[name or DEFAULT_RECORD_CODEC]
+    except KeyError:
+        raise ValueError("Unknown record codec '%s' - choose one of %s" % (name, ', '.join(record_codec_names())))
+    # end convert exception
+
+
+def record_codec_names():
+    """@return a sorted list of names of all registered codecs"""
+    return sorted(_codecs_by_name)
+
+
+def _blob_codec(blob):
+    """@return the codec which wrote the given blob, or None if it has no header"""
+    if blob[0] != BLOB_MAGIC:
+        return None
+    # end handle blobs without header
+    version, codec_id = ord(blob[1]), ord(blob[2])
+    if version != BLOB_HEADER_VERSION or codec_id not in _codecs_by_id:
+        raise ValueError("Cannot decode blob with header version %i and codec id %i" % (version, codec_id))
+    # end check header
+    return _codecs_by_id[codec_id]
+
+
+def decode_record(blob, fields = None, layout = None):
+    """@return a record from the given blob, which may have been written by any registered codec, or as
+    compressed pickle of the whole record, which is what was used before
+    @param blob a string or buffer
+    @param fields see RecordCodec.decode()
+    @param layout the RecordLayout of the record's type, needed to decode blobs of codecs which use layouts
+    @throws ValueError if the blob needs a layout, but none was given"""
+    codec = _blob_codec(blob)
+    if codec is not None:
+        return codec.decode(blob, fields, layout)
+    # end handle blobs with header
+
+    data = loads(decompress(blob))
+    if fields is None:
+        return data
+    return dict((name, data[name]) for name in set(fields) | set(('id', 'type')) if name in data)
+
+
+def decode_value(blob):
+    """@return a value from the given blob, which may have been written by any registered codec, or
+    as compressed pickle, which is what was used before"""
+    codec = _blob_codec(blob)
+    if codec is None:
+        return loads(decompress(blob))
+    return codec.decode_value(blob)
+
+
+register_record_codec(RecordCodec('pickle-zlib9', 1, _pickle_dumps, loads, 9))
+register_record_codec(RecordCodec('pickle-zlib', 2, _pickle_dumps, loads, 1))
+register_record_codec(RecordCodec('pickle', 3, _pickle_dumps, loads, 0))
+register_record_codec(RecordCodec('marshal-zlib', 4, _marshal_dumps, _marshal_loads, 1))
+register_record_codec(RecordCodec('marshal', 5, _marshal_dumps, _marshal_loads, 0))
+register_record_codec(SchemaRecordCodec('schema-zlib', 6, 1))
+register_record_codec(SchemaRecordCodec('schema', 7, 0))
+register_record_codec(DictionaryRecordCodec('schema-zdict', 8, 1))
+
+## -- End Registry -- @}
+
+
+def benchmark_record_codecs(records, names = None, layout = None):
+    """Encode and decode the given records with the given codecs, and measure how long it takes
+    @param records a list of records of a single type
+    @param names names of the codecs to measure, or None to measure all registered ones
+    @param layout the RecordLayout of the records' type. If None, one is made up from the records. Codecs
+    which use dictionaries train theirs from the records
+    @return a list of dicts, one per codec, with 'codec', 'records', 'bytes', 'encode_time' and
+    'decode_time' in seconds"""
+    if layout is None:
+        layout = RecordLayout(records and records[0].get('type'))
+        for record in records:
+            for name, value in record.iteritems():
+                if name != 'type':
+                    layout.add_value(name, value)
+                # end skip type
+            # end for each field
+        # end for each record
+    # end make up layout
+
+    out = list()
+    for name in names or record_codec_names():
+        codec = record_codec(name)
+        if codec.uses_dictionary():
+            codec.train_dictionary(records, layout)
+        # end train dictionary
+        st = time.time()
+        blobs = [codec.encode(record, layout) for record in records]
+        encode_time = time.time() - st
+        st = time.time()
+        for blob in blobs:
+            codec.decode(blob, None, layout)
+        # end for each blob
+        out.append({'codec' : name,
+                    'records' : len(records),
+                    'bytes' : sum(len(blob) for blob in blobs),
+                    'encode_time' : encode_time,
+                    'decode_time' : time.time() - st})
+    # end for each codec
+    return out
@@ -7,15 +7,18 @@
 @author Sebastian Thiel
 @copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
 """
-__all__ = ['SQLProxyShotgunConnection']
+__all__ = ['SQLProxyShotgunConnection', 'LAYOUT_BLOB', 'LAYOUT_COLUMNAR']
 
 import sys
 import time
+import marshal
+import logging
+import threading
+from contextlib import (contextmanager,
+                        closing)
+from itertools import (islice,
+                       chain)
 
-from cPickle import (dumps,
-                     loads)
-from zlib import (compress,
-                  decompress)
 from cStringIO import StringIO
 
 
@@ -24,6 +27,28 @@ from .base import (ProxyMeta,
                    shotgun_schema)
 
 from .schema import sql_shotgun_schema
+from .serialization import (RecordLayout,
+                            record_codec,
+                            decode_record,
+                            decode_value)
+from .summaries import (SummaryGroup,
+                        normalize_summary_fields,
+                        normalize_grouping,
+                        summarize_records,
+                        _percentage)
+from .filters import (FilterGroup,
+                      FilterCondition,
+                      FilterEvaluator,
+                      normalize_filters,
+                      normalize_order,
+                      sort_records,
+                      utc,
+                      _to_utc_datetime,
+                      _to_date)
+from .journal import transient_errors
+
+
+log = logging.getLogger('bshotgun.sql')
 
 # -------------------------
 ## @name SG Monkey Patch
@@ -46,30 +71,839 @@ _apply_sg_patch()
 ## -- End SG Monkey Patch
 
 
+# -------------------------
+## @name Columnar Layout
+# @{
+
+## Tables of this layout store each record as serialized blob in a single 'properties' column
+LAYOUT_BLOB = 'blob'
+
+## Tables of this layout have one typed column per field, and link columns for entity fields
+LAYOUT_COLUMNAR = 'columnar'
+
+## Maps shotgun data types to the names of sqlalchemy types we use to store them in their own column.
+## Data types that are not listed here are stored as serialized value in a binary column, entities are 
+## special as they are split up into link columns
+column_type_map = {
+    'text' : 'UnicodeText',
+    'uuid' : 'UnicodeText',
+    'password' : 'UnicodeText',
+    'footage' : 'UnicodeText',
+    'entity_type' : 'UnicodeText',
+    'image' : 'UnicodeText',
+    'list' : 'UnicodeText',
+    'status_list' : 'UnicodeText',
+    'color' : 'UnicodeText',
+    'pivot_column' : 'UnicodeText',
+    'summary' : 'UnicodeText',
+    'number' : 'Integer',
+    'duration' : 'Integer',
+    'percent' : 'Integer',
+    'float' : 'Float',
+    'checkbox' : 'Boolean',
+    'date' : 'Date',
+    'date_time' : 'DateTime',
+}
+
+## Separates the name of an entity field from the part of the link the column stores
+LINK_COLUMN_SEPARATOR = '__'
+
+## The parts of a link dict which are stored in their own column
+link_column_parts = ('type', 'id', 'name')
+
+
+def link_column_name(field_name, part):
+    """@return name of the column storing the given part of a link in the given entity field"""
+    return field_name + LINK_COLUMN_SEPARATOR + part
+
+
+def _projection(fields):
+    """@return a set of the given field names, along with 'id' and 'type', which are always returned"""
+    out = set(fields)
+    out.update(('id', 'type'))
+    return out
+
+
+def _to_number(value):
+    """@return an integer, or a float if the value has a fraction. Strings are converted"""
+    if isinstance(value, basestring):
+        try:
+            return int(value)
+        except ValueError:
+            value = float(value)
+        # end handle float strings
+    # end handle strings
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _to_unicode(value):
+    """@return the value as unicode object"""
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
+class _ColumnarRecordCodec(object):
+    """Converts shotgun records into rows of a table with columnar layout, and back.
+
+    It is configured only by the columns of the table, which makes it work with reflected tables too"""
+    __slots__ = (
+                    '_fields',       # list of (field_name, kind, column_names) tuples
+                    '_field_map',    # a mapping of field_name -> (kind, column_names)
+                    '_serialize',    # f(value) -> buffer
+                    '_deserialize'   # f(buffer) -> value
+                )
+
+    # -------------------------
+    ## @name Constants
+    # @{
+
+    KIND_LINK = 'link'
+    KIND_BLOB = 'blob'
+    KIND_DATE = 'date'
+    KIND_DATE_TIME = 'date_time'
+    KIND_NUMBER = 'number'
+    KIND_FLOAT = 'float'
+    KIND_BOOLEAN = 'boolean'
+    KIND_TEXT = 'text'
+
+    ## -- End Constants -- @}
+
+    def __init__(self, table, serialize, deserialize):
+        """Initialize this instance from the given table
+        @param table an sqlalchemy table with columnar layout
+        @param serialize a function f(value) -> buffer, for fields stored in binary columns
+        @param deserialize a function f(buffer) -> value, to undo what serialize did"""
+        from sqlalchemy import types
+
+        self._serialize = serialize
+        self._deserialize = deserialize
+        self._fields = list()
+        self._field_map = dict()
+        link_fields = set()
+
+        for column in table.columns:
+            name = column.name
+            if name == 'id':
+                continue
+            # end skip primary key
+
+            field_name, sep, part = name.rpartition(LINK_COLUMN_SEPARATOR)
+            if sep and part in link_column_parts:
+                link_fields.add(field_name)
+                continue
+            # end handle link columns
+
+            ctype = column.type
+            if isinstance(ctype, types.LargeBinary):
+                kind = self.KIND_BLOB
+            elif isinstance(ctype, types.DateTime):
+                kind = self.KIND_DATE_TIME
+            elif isinstance(ctype, types.Date):
+                kind = self.KIND_DATE
+            elif isinstance(ctype, types.Boolean):
+                kind = self.KIND_BOOLEAN
+            elif isinstance(ctype, types.Float):
+                kind = self.KIND_FLOAT
+            elif isinstance(ctype, types.Integer):
+                kind = self.KIND_NUMBER
+            else:
+                kind = self.KIND_TEXT
+            # end handle kind
+            self._fields.append((name, kind, (name,)))
+        # end for each column
+
+        for field_name in sorted(link_fields):
+            column_names = tuple(link_column_name(field_name, part) for part in link_column_parts)
+            self._fields.append((field_name, self.KIND_LINK, column_names))
+        # end for each link field
+
+        for field_name, kind, column_names in self._fields:
+            self._field_map[field_name] = (kind, column_names)
+        # end for each field
+        
+    def _encode(self, kind, value):
+        """@return value converted to be stored in a column of the given kind. Must not be None"""
+        if kind == self.KIND_TEXT:
+            return _to_unicode(value)
+        elif kind == self.KIND_NUMBER:
+            return _to_number(value)
+        elif kind == self.KIND_FLOAT:
+            return float(value)
+        elif kind == self.KIND_BOOLEAN:
+            return bool(value)
+        elif kind == self.KIND_DATE:
+            return _to_date(value)
+        elif kind == self.KIND_DATE_TIME:
+            return _to_utc_datetime(value)
+        elif kind == self.KIND_BLOB:
+            return self._serialize(value)
+        raise AssertionError("unhandled kind: %s" % kind)
+
+    def _decode(self, kind, value):
+        """@return the value as it would be returned by shotgun. Must not be None"""
+        if kind == self.KIND_DATE:
+            return value.isoformat()
+        elif kind == self.KIND_DATE_TIME:
+            return value.replace(tzinfo=utc)
+        elif kind == self.KIND_BLOB:
+            return self._deserialize(value)
+        elif kind == self.KIND_BOOLEAN:
+            return bool(value)
+        return value
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def field_names(self):
+        """@return a list of all field names we can store"""
+        return [f[0] for f in self._fields]
+
+    def field_kind(self, field_name):
+        """@return the kind of the given field, one of our KIND_* constants, or None if it is unknown"""
+        info = self._field_map.get(field_name)
+        if info is None:
+            return None
+        return info[0]
+
+    def encode(self, field_name, value):
+        """@return the given value of the given field converted into the domain of its column, 
+        None stays None. It's useful to make values comparable to what's stored in the database.
+        @throws ValueError if the value cannot be converted
+        @note not applicable to link fields"""
+        if value is None:
+            return value
+        try:
+            return self._encode(self._field_map[field_name][0], value)
+        except (TypeError, AttributeError), err:
+            raise ValueError(str(err))
+        # end convert errors
+
+    def decode(self, field_name, value):
+        """@return the given column value of the given field converted into what shotgun would return.
+        None stays None.
+        @note not applicable to link fields"""
+        if value is None:
+            return value
+        return self._decode(self._field_map[field_name][0], value)
+
+    def column_names(self, field_names=None):
+        """@return list of names of all columns that are needed to read the given fields, without 'id'
+        @param field_names an iterable of field names, or None to obtain the columns for all fields. 
+        Unknown fields will be ignored"""
+        if field_names is None:
+            field_names = self.field_names()
+        # end handle all fields
+        out = list()
+        for field_name in field_names:
+            if field_name in self._field_map:
+                out.extend(self._field_map[field_name][1])
+            # end ignore unknown fields
+        # end for each field
+        return out
+
+    def to_row(self, record):
+        """@return a dict suitable for insertion into our table, created from the given shotgun record
+        @param record a dict as returned by shotgun. Values that have no column are ignored.
+        @throws ValueError if a value could not be converted"""
+        row = {'id' : record['id']}
+        for field_name, kind, column_names in self._fields:
+            value = record.get(field_name)
+            if kind == self.KIND_LINK:
+                for column_name, part in zip(column_names, link_column_parts):
+                    row[column_name] = value.get(part) if value else None
+                # end for each link part
+                continue
+            # end handle links
+
+            if value is not None:
+                try:
+                    value = self._encode(kind, value)
+                except (ValueError, TypeError, AttributeError), err:
+                    raise ValueError("Failed to convert value %r of field '%s' in '%s(%i)': %s" 
+                                     % (value, field_name, record.get('type'), record['id'], err))
+                # end convert errors
+            # end handle value
+            row[field_name] = value
+        # end for each field
+        return row
+
+    def to_record(self, row, entity_type, field_names=None):
+        """@return a record as shotgun would return it from the given row
+        @param row a row, as obtained when selecting column_names(field_names), as well as 'id'
+        @param entity_type the shotgun type name of the record
+        @param field_names the same field names that were passed to column_names(), or None for all fields."""
+        if field_names is None:
+            field_names = self.field_names()
+        # end handle all fields
+
+        record = {'type' : entity_type, 'id' : row['id']}
+        for field_name in field_names:
+            if field_name not in self._field_map:
+                continue
+            # end ignore unknown fields
+            kind, column_names = self._field_map[field_name]
+            if kind == self.KIND_LINK:
+                value = None
+                link_id = row[column_names[1]]
+                if link_id is not None:
+                    value = dict(zip(link_column_parts, (row[cn] for cn in column_names)))
+                # end handle link
+            else:
+                value = row[column_names[0]]
+                if value is not None:
+                    value = self._decode(kind, value)
+                # end handle value
+            # end handle kind
+            record[field_name] = value
+        # end for each field name
+        return record
+
+    ## -- End Interface -- @}
+
+# end class _ColumnarRecordCodec
+
+## -- End Columnar Layout -- @}
+
+
+# -------------------------
+## @name Internal Tables
+# @{
+
+## Prefix of all tables we use for bookkeeping. They don't represent shotgun types
+INTERNAL_TABLE_PREFIX = 'bshotgun_'
+
+## Name of the table which keeps one row per link of all entity and multi-entity fields, to allow filtering 
+## by links without decoding records
+LINKS_TABLE_NAME = INTERNAL_TABLE_PREFIX + 'links'
+
+## Shotgun data types whose values are links to other entities
+link_data_types = ('entity', 'multi_entity')
+
+## Name of the table which keeps information about the database as a whole, as key-value pairs
+META_TABLE_NAME = INTERNAL_TABLE_PREFIX + 'meta'
+
+## Prefix of the keys in the meta table which store the RecordLayout of a table, followed by its name
+LAYOUT_KEY_PREFIX = 'layout:'
+
+## Prefix of the keys in the meta table which store the compression dictionary of a table, followed by its name
+DICTIONARY_KEY_PREFIX = 'dictionary:'
+
+## Prefix of the keys in the meta table which store how far init_database() got with a table, followed by
+## its name. The value is the id of the last record written, or CHECKPOINT_DONE
+CHECKPOINT_KEY_PREFIX = 'checkpoint:'
+
+## Value of a checkpoint of a table which was initialized completely
+CHECKPOINT_DONE = 'done'
+
+## Prefix of the keys in the meta table which store the columns of a table, followed by its name. It allows 
+## to construct the table without reflecting it
+COLUMNS_KEY_PREFIX = 'columns:'
+
+## Names of the sqlalchemy types a column description may have, in the order they are tested
+column_description_types = ('LargeBinary', 'DateTime', 'Date', 'Boolean', 'Float', 'Integer', 'String')
+
+
+def _link_rows(source_type, record, link_fields):
+    """@return a list of rows for the links table, one for each link in the given record
+    @param source_type the name of the table the record is stored in
+    @param link_fields an iterable of names of fields which contain links"""
+    rows = list()
+    for field_name in link_fields:
+        value = record.get(field_name)
+        if isinstance(value, dict):
+            value = [value]
+        elif not isinstance(value, list):
+            continue
+        # end handle single links
+        for link in value:
+            if not isinstance(link, dict) or link.get('id') is None:
+                continue
+            # end skip invalid links
+            rows.append({'source_type' : source_type, 'source_id' : record['id'], 'field' : field_name,
+                         'target_type' : link.get('type'), 'target_id' : link['id']})
+        # end for each link
+    # end for each field
+    return rows
+
+
+class _LayoutConflict(Exception):
+    """Raised within a write transaction if another process stored the RecordLayout of a table after we
+    read it"""
+    __slots__ = ()
+
+# end class _LayoutConflict
+
+## -- End Internal Tables -- @}
+
+
+# -------------------------
+## @name Filter Compilation
+# @{
+
+def _like_pattern(value, prefix, suffix):
+    """@return a pattern for use with LIKE, matching the given value literally, using '\\' as escape character
+    @param prefix and suffix will be put around the escaped value"""
+    value = _to_unicode(value).replace(u'\\', u'\\\\').replace(u'%', u'\\%').replace(u'_', u'\\_')
+    return prefix + value + suffix
+
+
+class _SQLFilterCompiler(object):
+    """Compiles normalized shotgun filters into sqlalchemy expressions for a particular table.
+
+    Conditions which can't be expressed in SQL are skipped, which is indicated by the result not being exact.
+    Tables with blob layout only allow to compile conditions on the 'id' field, and on link fields if there 
+    is a links table."""
+    __slots__ = ('_table', '_codec', '_links', '_link_fields')
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## Maps text relations to the prefix and suffix of the respective LIKE pattern
+    like_relations = {
+        'contains' : (u'%', u'%'),
+        'not_contains' : (u'%', u'%'),
+        'starts_with' : (u'', u'%'),
+        'ends_with' : (u'%', u''),
+    }
+
+    ## -- End Configuration -- @}
+
+    def __init__(self, table, codec, links = None, link_fields = frozenset()):
+        """Initialize this instance
+        @param table the table to compile expressions for
+        @param codec the _ColumnarRecordCodec for the table, or None if it has blob layout
+        @param links the links table, or None if there is none
+        @param link_fields a set of names of fields of our table which have rows in the links table"""
+        self._table = table
+        self._codec = codec
+        self._links = links
+        self._link_fields = link_fields
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _compile_group(self, group):
+        """@return (clause, exact) for the given FilterGroup"""
+        from sqlalchemy import (and_, or_)
+        clauses = list()
+        exact = True
+        for sg_filter in group.filters:
+            clause, filter_exact = self.compile(sg_filter)
+            if clause is None:
+                if group.operator == 'any':
+                    # If one member can match every row, so can the group
+                    return None, filter_exact
+                # end handle unconstrained members
+                exact = exact and filter_exact
+                continue
+            # end handle unsupported filters
+            exact = exact and filter_exact
+            clauses.append(clause)
+        # end for each filter
+
+        if not clauses:
+            return None, exact
+        if len(clauses) == 1:
+            return clauses[0], exact
+        return (group.operator == 'all' and and_ or or_)(*clauses), exact
+
+    def _compile_condition(self, condition):
+        """@return a clause representing the given FilterCondition, or None if it couldn't be compiled"""
+        path = condition.path
+        if path == 'id':
+            return self._compile_scalar(self._table.c.id, condition, _to_number)
+        # end handle id
+        codec = self._codec
+        if path in self._link_fields and (codec is None or codec.field_kind(path) != codec.KIND_LINK):
+            return self._compile_link_index(path, condition)
+        # end handle links without columns
+        if codec is None:
+            return None
+        # end blob tables can't do anything else
+
+        kind = codec.field_kind(path)
+        if kind is None or kind == codec.KIND_BLOB:
+            return None
+        # end handle unsupported fields
+
+        columns = [self._table.c[name] for name in codec.column_names([path])]
+        if kind == codec.KIND_LINK:
+            return self._compile_link(columns, condition)
+        # end handle links
+        encode = lambda v: codec.encode(path, v)
+        return self._compile_scalar(columns[0], condition, encode, kind == codec.KIND_TEXT)
+
+    def _compile_scalar(self, column, condition, encode, is_text = False):
+        """@return a clause to compare the given column according to the given condition, or None
+        @param encode a function to convert filter values into the domain of the column
+        @param is_text if True, the column contains text"""
+        from sqlalchemy import (and_, or_, not_)
+        from sqlalchemy.sql.expression import false
+        relation = condition.relation
+        try:
+            values = [encode(v) if v is not None else v for v in condition.values]
+        except (ValueError, TypeError):
+            return None
+        # end let the caller deal with values we don't understand
+        value = None
+        if values:
+            value = values[0]
+        # end get first value
+
+        if relation == 'is':
+            return column == value
+        elif relation == 'is_not':
+            if value is None:
+                return column != None
+            return or_(column != value, column == None)
+        elif relation in ('in', 'not_in'):
+            non_null = [v for v in values if v is not None]
+            if non_null:
+                clause = column.in_(non_null)
+            else:
+                clause = false()
+            # end handle empty values
+            if len(non_null) != len(values):
+                clause = or_(clause, column == None)
+            # end handle None
+            if relation == 'not_in':
+                clause = not_(clause)
+                if len(non_null) == len(values):
+                    clause = or_(clause, column == None)
+                # end keep rows without value
+            # end handle negation
+            return clause
+        elif value is None:
+            # all remaining relations need a value to compare with
+            return None
+        elif relation == 'less_than':
+            return column < value
+        elif relation == 'greater_than':
+            return column > value
+        elif relation in ('between', 'not_between'):
+            if len(values) != 2 or values[1] is None:
+                return None
+            # end check values
+            if relation == 'between':
+                return and_(column >= values[0], column <= values[1])
+            return or_(column < values[0], column > values[1])
+        elif is_text and relation in self.like_relations:
+            clause = column.ilike(_like_pattern(value, *self.like_relations[relation]), escape='\\')
+            if relation.startswith('not_'):
+                clause = or_(not_(clause), column == None)
+            # end handle negation
+            return clause
+        # end handle relation
+        return None
+
+    def _compile_link(self, columns, condition):
+        """@return a clause to compare the given link columns (type, id, name) according to the given 
+        condition, or None"""
+        from sqlalchemy import (and_, or_, not_)
+        from sqlalchemy.sql.expression import false
+        type_column, id_column, name_column = columns
+        relation = condition.relation
+        values = condition.values
+        value = condition.value()
+
+        def is_link(link):
+            if link is None:
+                return id_column == None
+            return and_(type_column == link['type'], id_column == link['id'])
+        # end utility
+
+        if relation in ('is', 'is_not', 'in', 'not_in'):
+            for link in values:
+                if link is not None and not (isinstance(link, dict) and 'type' in link and 'id' in link):
+                    return None
+                # end verify link
+            # end for each link
+        # end check values
+
+        if relation == 'is':
+            return is_link(value)
+        elif relation == 'is_not':
+            if value is None:
+                return id_column != None
+            return or_(not_(is_link(value)), id_column == None)
+        elif relation == 'in':
+            if not values:
+                return false()
+            return or_(*[is_link(link) for link in values])
+        elif relation == 'not_in':
+            if not values:
+                return not_(false())
+            clause = not_(or_(*[is_link(link) for link in values]))
+            if None not in values:
+                clause = or_(clause, id_column == None)
+            # end keep rows without link
+            return clause
+        elif value is None:
+            return None
+        elif relation == 'type_is':
+            return type_column == value
+        elif relation == 'type_is_not':
+            return or_(type_column != value, type_column == None)
+        elif relation == 'name_is':
+            return name_column == value
+        elif relation in ('name_contains', 'name_not_contains'):
+            clause = name_column.ilike(_like_pattern(value, u'%', u'%'), escape='\\')
+            if relation == 'name_not_contains':
+                clause = or_(not_(clause), name_column == None)
+            # end handle negation
+            return clause
+        # end handle relation
+        return None
+
+    def _compile_link_index(self, field_name, condition):
+        """@return a clause to compare the given entity or multi-entity field according to the given
+        condition, using the links table. None if this isn't possible.
+        @note multi-entity fields are matched if any of their links match"""
+        from sqlalchemy import (and_, or_, not_, select)
+        from sqlalchemy.sql.expression import false
+        relation = condition.relation
+        if relation not in ('is', 'is_not', 'in', 'not_in'):
+            return None
+        # end handle supported relations
+        values = condition.values
+        if relation in ('is', 'is_not'):
+            values = [condition.value()]
+        # end handle single values
+        links = [link for link in values if link is not None]
+        for link in links:
+            if not (isinstance(link, dict) and 'type' in link and 'id' in link):
+                return None
+            # end verify link
+        # end for each link
+
+        index = self._links
+        source = and_(index.c.source_type == self._table.name, index.c.field == field_name)
+        clauses = list()
+        if links:
+            targets = or_(*[and_(index.c.target_type == link['type'], index.c.target_id == link['id']) 
+                            for link in links])
+            clauses.append(self._table.c.id.in_(select([index.c.source_id], and_(source, targets))))
+        # end handle links
+        if len(links) != len(values):
+            # None matches records without any link
+            clauses.append(not_(self._table.c.id.in_(select([index.c.source_id], source))))
+        # end handle None
+
+        if clauses:
+            clause = or_(*clauses)
+        else:
+            clause = false()
+        # end handle empty values
+        if relation in ('is_not', 'not_in'):
+            clause = not_(clause)
+        # end handle negation
+        return clause
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def compile(self, node):
+        """@return (clause, exact) tuple. clause is an sqlalchemy expression representing the given node, 
+        or None if it doesn't constrain the result. If exact is False, the clause could only represent a part
+        of the node's conditions and will yield a superset of the matching rows.
+        @param node a FilterGroup or FilterCondition instance, see normalize_filters()"""
+        if isinstance(node, FilterGroup):
+            return self._compile_group(node)
+        # end handle groups
+        clause = self._compile_condition(node)
+        return clause, clause is not None
+
+    ## -- End Interface -- @}
+
+# end class _SQLFilterCompiler
+
+## -- End Filter Compilation -- @}
+
+
+class _LazyTables(object):
+    """A read-only mapping of table_name -> sqlalchemy Table of all tables in a database, which are constructed
+    when they are first accessed. The names of all tables are read once, when they are first needed"""
+    __slots__ = (
+                    '_meta',   # the MetaData our tables are associated with
+                    '_engine', # the sqlalchemy Engine of the database
+                    '_build',  # f(table_name) -> Table, for tables that exist in the database
+                    '_names',  # a set of the names of all tables in the database, or None
+                    '_lock'    # serializes the construction of tables, which may read other tables
+                )
+
+    def __init__(self, meta, engine, build):
+        """Initialize this instance
+        @param meta an sqlalchemy MetaData instance. Its tables are used as they are
+        @param engine the sqlalchemy Engine to read table names with
+        @param build a function f(table_name) -> Table, which constructs the table of the given name and 
+        associates it with meta"""
+        self._meta = meta
+        self._engine = engine
+        self._build = build
+        self._names = None
+        self._lock = threading.RLock()
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def names(self):
+        """@return a set of the names of all tables"""
+        if self._names is None:
+            self._names = set(self._engine.table_names()) | set(self._meta.tables.keys())
+        # end read names
+        return self._names
+
+    def add(self, table):
+        """Remember the given table, which was just created in the database
+        @return self"""
+        self.names().add(table.name)
+        return self
+
+    def get(self, name, default = None):
+        """@return the table of the given name, or default if there is no such table"""
+        table = self._meta.tables.get(name)
+        if table is not None:
+            return table
+        # end handle constructed tables
+        if name not in self.names():
+            return default
+        # end handle unknown tables
+        with self._lock:
+            table = self._meta.tables.get(name)
+            if table is None:
+                table = self._build(name)
+            # end handle tables built by other threads
+        # end with lock
+        return table
+
+    def keys(self):
+        """@return a list of the names of all tables"""
+        return list(self.names())
+
+    def __getitem__(self, name):
+        table = self.get(name)
+        if table is None:
+            raise KeyError(name)
+        return table
+
+    def __contains__(self, name):
+        return name in self._meta.tables or name in self.names()
+
+    ## -- End Interface -- @}
+
+# end class _LazyTables
+
 
 class SQLProxyShotgunConnection(ProxyShotgunConnection):
     """A database that uses an SQLAlchemy engine to direct all reads to the database.
     
-    Write operations go straight to shotgun. Those are expected to be written back to our database by other 
-    means"""
+    Write operations go straight to shotgun. If they succeed, their results are written into our database
+    right away, which allows to read them back without asking shotgun. Changes made by others are expected to 
+    be written back to our database by other means, like an EventLogSync, which uses store_records() and 
+    remove_records()
+
+    Instances may be shared by threads. Each thread checks out its own connection of our engine's pool, which 
+    can be configured with the sql_pool_* kvstore values, or by passing an engine made with make_engine().
+    Call close() once you are done with an instance, to close the connections of the engine it created"""
     __slots__ = (
-                    '_meta'   # Our SQL engine
+                    '_meta',   # the sqlalchemy MetaData of our tables
+                    '_engine', # Our SQL engine
+                    '_owns_engine', # if True, we created our engine, and dispose it when we are done with it
+                    '_tables', # a _LazyTables instance with all tables of our database
+                    '_local',  # thread local storage, keeps the connection each thread currently uses
+                    '_lock',   # serializes connecting to the database configured in the kvstore, and access to _stale
+                    '_codecs', # a cache of table_name -> _ColumnarRecordCodec instances
+                    '_page_keys', # a cache of (query, page) -> sort key of the last record on the page
+                    '_statements', # a cache of (table_name, query shape) -> compiled statement, see _compiled()
+                    '_link_fields', # a cache of table_name -> set of fields with rows in the links table
+                    '_record_cache', # a RecordCache, or None
+                    '_record_codec', # the RecordCodec to serialize records with
+                    '_layouts',      # a cache of table_name -> RecordLayout, or None if there is none
+                    '_stale'         # set of (entity_type, entity_id) of records whose journaled writes were rejected
                 )
     
     _schema = sql_shotgun_schema
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## Amount of records per page if no limit is given, or if it is larger. The same as in shotgun_api3
+    records_per_page = 500
+
+    ## Amount of rows we fetch at once when iterating query results
+    rows_per_fetch = 1000
+
+    ## Maximum amount of ids we put into a single 'id in' query. Longer lists are read in chunks
+    max_ids_per_query = 500
+
+    ## Maximum amount of page boundaries we remember for keyset pagination
+    max_page_keys = 1000
+
+    ## Amount of times a write is attempted if other processes keep adding fields to the same RecordLayout
+    max_write_attempts = 3
+
+    ## Maximum amount of compiled statements we keep for lookups by id
+    max_statements = 500
+
+    ## Amount of records per type init_database() trains compression dictionaries with, for codecs using them
+    dictionary_sample_size = 1000
+
+    ## Amount of records init_database() inserts at once, which bounds the amount of records in memory
+    rows_per_insert = 1000
+
+    ## Dialects which sort NULL before all other values in ascending order, which is what our keyset 
+    ## pagination assumes. All others will use OFFSET for pagination
+    keyset_dialects = ('sqlite', 'mysql')
+
+    ## -- End Configuration -- @}
     
-    def __init__(self, db_url = None):
+    def __init__(self, db_url = None, record_cache = None, shotgun = None):
         """Initialize this instance with the given database URL
-        If none, it will be set using kwstore data"""
+        If none, it will be set using kwstore data
+        @param record_cache if not None, a RecordCache to keep decoded records in, see set_record_cache()
+        @param shotgun if not None, the shotgun connection to use for writes, and for reads we can't handle.
+        Otherwise it is created from kvstore data when needed"""
+        super(SQLProxyShotgunConnection, self).__init__(shotgun)
+        self._record_cache = record_cache
+        self._lock = threading.Lock()
         self.set_db_url(db_url)
-    
+
     def _set_cache_(self, name):
-        if name == '_meta':
-            # Use kvstore information to get engine URL
-            shotgun = self.settings_value()
-            assert shotgun.sql_cache_url, "No valid sql_cache_url found"
-            self.set_db_url(shotgun.sql_cache_url)
-            
+        if name in ('_meta', '_engine', '_tables', '_local'):
+            with self._lock:
+                try:
+                    # another thread may have connected while we were waiting
+                    object.__getattribute__(self, name)
+                except AttributeError:
+                    # Use kvstore information to get engine URL and pool configuration
+                    shotgun = self.settings_value()
+                    assert shotgun.sql_cache_url, "No valid sql_cache_url found"
+                    self._set_engine(self.make_engine(shotgun.sql_cache_url, shotgun.sql_pool_size, 
+                                                      shotgun.sql_max_overflow, shotgun.sql_pool_recycle), 
+                                     None, True)
+                # end handle connection
+            # end with lock
+        elif name == '_codecs':
+            self._codecs = dict()
+        elif name in ('_page_keys', '_statements', '_link_fields', '_layouts'):
+            setattr(self, name, dict())
+        elif name == '_record_cache':
+            self._record_cache = None
+        elif name == '_stale':
+            self._stale = set()
+        elif name == '_record_codec':
+            self._record_codec = record_codec(self.settings_value().sql_record_codec)
         else:
             super(SQLProxyShotgunConnection, self)._set_cache_(name)
         #end handle engine instantiation
@@ -79,43 +913,312 @@ class SQLProxyShotgunConnection(ProxyShotgunConnection):
     # @{
     
     @classmethod
-    def _make_table(cls, type_name, meta_data):
+    def _make_table(cls, type_name, meta_data, schema = None):
         """@return an SQLAlchemy table schema made to keep data of the given shotgun data type
         @param cls
         @param type_name shotgun typename
         @param meta_data SQLAlchemy meta data object to which to associate the table
+        @param schema if not None, the shotgun schema of the type as obtained by 
+        ShotgunTypeFactory.schema_by_name(). The table will then have a columnar layout. Otherwise all 
+        properties will be stored in a single serialized blob.
         @note table names will be lower case !"""
         from sqlalchemy.schema import (Table, Column)
+        from sqlalchemy import types
         from sqlalchemy.types import (Integer, Binary)
-        return Table(type_name.lower(), meta_data,
-                     Column('id', Integer, primary_key = True),
-                     Column('properties', Binary),
+        if schema is None:
+            return Table(type_name.lower(), meta_data,
+                         Column('id', Integer, primary_key = True),
+                         Column('properties', Binary),
+                        )
+        # end handle blob layout
+
+        columns = [Column('id', Integer, primary_key = True)]
+        for field_name in sorted(schema.keys()):
+            if field_name == 'id':
+                continue
+            # end skip primary key
+            data_type = schema[field_name].data_type.value
+            if data_type == 'entity':
+                columns.append(Column(link_column_name(field_name, 'type'), types.String(64)))
+                columns.append(Column(link_column_name(field_name, 'id'), Integer))
+                columns.append(Column(link_column_name(field_name, 'name'), types.UnicodeText))
+            else:
+                columns.append(Column(field_name, getattr(types, column_type_map.get(data_type, 'Binary'))))
+            # end handle column type
+        # end for each field
+        return Table(type_name.lower(), meta_data, *columns)
+
+    @classmethod
+    def _make_links_table(cls, meta_data):
+        """@return an SQLAlchemy table to keep one row per link of entity and multi-entity fields
+        @param cls
+        @param meta_data SQLAlchemy meta data object to which to associate the table"""
+        from sqlalchemy.schema import (Table, Column, Index)
+        from sqlalchemy.types import (Integer, String)
+        table = Table(LINKS_TABLE_NAME, meta_data,
+                      Column('source_type', String(64), nullable = False),
+                      Column('source_id', Integer, nullable = False),
+                      Column('field', String(128), nullable = False),
+                      Column('target_type', String(64)),
+                      Column('target_id', Integer),
+                     )
+        # covers all link filters, without reading the table itself
+        Index(LINKS_TABLE_NAME + '_target', table.c.source_type, table.c.field, table.c.target_type, 
+              table.c.target_id, table.c.source_id)
+        Index(LINKS_TABLE_NAME + '_source', table.c.source_type, table.c.source_id)
+        return table
+
+    @classmethod
+    def _make_meta_table(cls, meta_data):
+        """@return an SQLAlchemy table to keep information about the database as key-value pairs
+        @param cls
+        @param meta_data SQLAlchemy meta data object to which to associate the table"""
+        from sqlalchemy.schema import (Table, Column)
+        from sqlalchemy.types import (String, Binary)
+        return Table(META_TABLE_NAME, meta_data,
+                     Column('key', String(255), primary_key = True),
+                     Column('value', Binary),
                     )
     
     @classmethod
-    def _make_meta_data(cls, factory):
+    def _make_meta_data(cls, factory, layout = LAYOUT_BLOB):
         """@return an SQLAlchemy MetaData object initialized with our Schema, based on the one of the 
         given factory
         @param cls
-        @param factory instance of type ShotgunTypeFactory"""
+        @param factory instance of type ShotgunTypeFactory
+        @param layout either LAYOUT_BLOB or LAYOUT_COLUMNAR
+        @note the links and meta tables are always part of it"""
         from sqlalchemy.schema import MetaData
+        assert layout in (LAYOUT_BLOB, LAYOUT_COLUMNAR), "Invalid layout: %s" % layout
         md = MetaData()
         for type_name in factory.type_names():
-            cls._make_table(type_name, md)
+            schema = None
+            if layout == LAYOUT_COLUMNAR:
+                schema = factory.schema_by_name(type_name)
+            # end obtain schema
+            cls._make_table(type_name, md, schema)
         # end for each typename to create table for
+        cls._make_links_table(md)
+        cls._make_meta_table(md)
         return md
+
+    @classmethod
+    def _describe_table(cls, table):
+        """@return a string describing the columns of the given table, see _table_from_description()
+        @param cls"""
+        from sqlalchemy import types
+        columns = list()
+        for column in table.columns:
+            ctype = column.type
+            for type_name in column_description_types:
+                if isinstance(ctype, getattr(types, type_name)):
+                    break
+                # end handle type
+            else:
+                type_name = 'LargeBinary'
+            # end for each type
+            length = None
+            if type_name == 'String':
+                length = getattr(ctype, 'length', None)
+                if not length:
+                    type_name = 'UnicodeText'
+                # end handle text without length
+            # end handle strings
+            columns.append((unicode(column.name), type_name, length))
+        # end for each column
+        return marshal.dumps(columns, 2)
+
+    @classmethod
+    def _table_from_description(cls, name, meta_data, description):
+        """@return a new sqlalchemy Table with the given name, and the columns of the given description
+        @param cls
+        @param meta_data SQLAlchemy meta data object to which to associate the table
+        @param description a string as returned by _describe_table()"""
+        from sqlalchemy.schema import (Table, Column)
+        from sqlalchemy import types
+        columns = list()
+        for column_name, type_name, length in marshal.loads(str(description)):
+            ctype = getattr(types, type_name)
+            ctype = length and ctype(length) or ctype()
+            columns.append(Column(column_name, ctype, primary_key = column_name == 'id'))
+        # end for each column
+        return Table(name, meta_data, *columns)
+
+    def _dispose(self):
+        """Close all connections of our engine, if we created it"""
+        try:
+            # don't connect just to find out
+            owns_engine = object.__getattribute__(self, '_owns_engine')
+        except AttributeError:
+            return
+        # end handle no engine
+        if owns_engine:
+            self._engine.dispose()
+            self._owns_engine = False
+        # end handle our engine
+
+    def _set_engine(self, engine, meta, owns_engine):
+        """Use the given engine from now on, and drop all caches of the previous one
+        @param engine an sqlalchemy Engine, or None to connect using kvstore data when needed
+        @param meta the MetaData to keep our tables in, or None to use a new one
+        @param owns_engine if True, we created the engine, and dispose it once it isn't used anymore"""
+        from sqlalchemy.schema import MetaData
+        self._dispose()
+        for attr in ('_meta', '_engine', '_owns_engine', '_tables', '_local', 
+                     '_codecs', '_page_keys', '_statements', '_link_fields', '_layouts'):
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                pass
+            # end ignore missing caches
+        # end clear caches of previous tables
+        if self._record_cache is not None:
+            self._record_cache.invalidate()
+        # end clear records of previous database
+        if engine is None:
+            return
+        # end handle no engine
+
+        if meta is None:
+            # tables are constructed when they are first used, see _build_table()
+            meta = MetaData(engine)
+        # end handle meta data
+        self._meta = meta
+        self._engine = engine
+        self._owns_engine = owns_engine
+        self._tables = _LazyTables(meta, engine, self._build_table)
+        self._local = threading.local()
+
+    @contextmanager
+    def _connect(self):
+        """@return a context manager yielding the connection of the current thread. It is checked out of our 
+        engine's pool when it is first needed, reused by all calls of the same thread, and returned to the pool
+        once none of them uses it anymore. This allows iterators to hold it while other calls are made"""
+        local = self._local
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = self._engine.connect()
+            local.users = 0
+        # end check out connection
+        local.users += 1
+        try:
+            yield connection
+        finally:
+            local.users -= 1
+            if not local.users:
+                local.connection = None
+                connection.close()
+            # end return connection to pool
+        # end handle users
+
+    def _streams_results(self):
+        """@return True if our engine's dialect uses server-side cursors for queries with the stream_results 
+        execution option"""
+        dialect = self._engine.dialect
+        # newer versions of sqlalchemy tell us, older ones implement them for psycopg2 only
+        return getattr(dialect, 'supports_server_side_cursors', dialect.driver == 'psycopg2')
+
+    @contextmanager
+    def _begin(self):
+        """@return a context manager yielding the connection of the current thread, with a transaction which
+        is committed when the context is left, or rolled back on error"""
+        with self._connect() as connection:
+            with connection.begin():
+                yield connection
+            # end with transaction
+        # end with connection
+
+    def _query_rows(self, statement, params = None):
+        """@return a list of all rows returned by the given statement, executed on the connection of the 
+        current thread
+        @param statement an sqlalchemy statement, or a compiled one
+        @param params if not None, a dict with values of the statement's bind parameters"""
+        with self._connect() as connection:
+            if params is None:
+                return connection.execute(statement).fetchall()
+            return connection.execute(statement, params).fetchall()
+        # end with connection
+
+    def _build_table(self, name):
+        """@return the table of the given name, which exists in our database, constructed from the layout of
+        our internal tables, or from the description stored by init_database(). Tables without description 
+        are reflected"""
+        from sqlalchemy.schema import Table
+        if name == META_TABLE_NAME:
+            return self._make_meta_table(self._meta)
+        elif name == LINKS_TABLE_NAME:
+            return self._make_links_table(self._meta)
+        # end handle internal tables
+        description = self.meta_value(COLUMNS_KEY_PREFIX + name)
+        if description is not None:
+            return self._table_from_description(name, self._meta, description)
+        # end handle described tables
+        return Table(name, self._meta, autoload = True, autoload_with = self._engine)
+
+    @classmethod
+    def _table_layout(cls, table):
+        """@return the layout of the given table, either LAYOUT_BLOB or LAYOUT_COLUMNAR"""
+        if len(table.columns) == 2 and 'properties' in table.columns:
+            return LAYOUT_BLOB
+        return LAYOUT_COLUMNAR
+
+    @classmethod
+    def _make_codec(cls, table, record_codec = None):
+        """@return a codec for converting records into rows of the given table, and back, or None if 
+        the table uses the blob layout
+        @param record_codec the RecordCodec to serialize values with, or None to use the default one"""
+        if cls._table_layout(table) == LAYOUT_BLOB:
+            return None
+        serialize = lambda value: cls._serialize_value(value, record_codec)
+        return _ColumnarRecordCodec(table, serialize, cls._deserialize_value)
+
+    def _codec(self, table):
+        """@return a cached codec for the given table, see _make_codec()"""
+        try:
+            return self._codecs[table.name]
+        except KeyError:
+            codec = self._codecs[table.name] = self._make_codec(table)
+            return codec
+        # end handle cache
         
     @classmethod
-    def _serialize_properties(cls, record):
-        """@return string representing the given record in a serialized format"""
-        return compress(dumps(record), 9)
+    def _serialize_value(cls, value, record_codec = None):
+        """@return string representing the given value in a serialized format
+        @param cls
+        @param record_codec the RecordCodec to use, or None to use the default one"""
+        return (record_codec or cls._default_record_codec()).encode_value(value)
+
+    @classmethod
+    def _deserialize_value(cls, value_buffer):
+        """@return a value that was formerly serialized with _serialize_value, by any codec
+        @param cls
+        @param value_buffer a buffer object representing the binary value"""
+        return decode_value(value_buffer)
+
+    @classmethod
+    def _serialize_properties(cls, record, record_codec = None, layout = None):
+        """@return string representing the given record in a serialized format.
+        Each value is serialized separately, which allows to decode only the fields that are needed
+        @param cls
+        @param record_codec the RecordCodec to use, or None to use the default one
+        @param layout the RecordLayout of the table, needed by codecs which use layouts"""
+        return (record_codec or cls._default_record_codec()).encode(record, layout)
         
     @classmethod
-    def _deserialize_properties(cls, properties_buffer):
-        """@return a dict that was formerly serialized with _serialize_properties
+    def _deserialize_properties(cls, properties_buffer, fields = None, layout = None):
+        """@return a dict that was formerly serialized with _serialize_properties, by any codec
         @param cls
-        @param properties_buffer a buffer object representing the binary properties blob"""
-        return loads(decompress(properties_buffer))
+        @param properties_buffer a buffer object representing the binary properties blob
+        @param fields if not None, an iterable of field names to decode and return, in addition to 'id' and 
+        'type'. Unknown fields are ignored
+        @param layout the RecordLayout of the table, needed for blobs of codecs which use layouts"""
+        return decode_record(properties_buffer, fields, layout)
+
+    @classmethod
+    def _default_record_codec(cls):
+        """@return the RecordCodec to use if none is given explicitly
+        @param cls"""
+        return record_codec(None)
         
     ## -- End Schema Handling -- @}
     
@@ -125,51 +1228,276 @@ class SQLProxyShotgunConnection(ProxyShotgunConnection):
     # @{
     
     @classmethod
-    def init_database(cls, engine_url, factory, fetch_entity_data_fun):
+    def _insert_rows(cls, execute, insert, rows, links_insert, links):
+        """Insert the given rows and link rows, if there are any
+        @param cls
+        @return the amount of rows inserted, not counting links"""
+        # multi-insert for a major speedup !
+        if rows:
+            execute(insert, rows)
+        # end insert rows
+        if links:
+            execute(links_insert, links)
+        # end insert links
+        return len(rows)
+
+    @classmethod
+    def _read_meta_value(cls, execute, meta_table, key):
+        """@return the value stored under the given key in the given meta table, as string, or None if there 
+        is none
+        @param cls
+        @param execute a function to execute sqlalchemy statements with"""
+        import sqlalchemy
+        row = execute(sqlalchemy.select([meta_table.c.value], meta_table.c.key == key)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return str(row[0])
+
+    @classmethod
+    def _write_meta_value(cls, execute, meta_table, key, value):
+        """Store the given value under the given key in the given meta table, replacing the previous one
+        @param cls
+        @param execute a function to execute sqlalchemy statements with"""
+        execute(meta_table.delete(meta_table.c.key == key))
+        execute(meta_table.insert(), {'key' : key, 'value' : value})
+
+    @classmethod
+    def _replace_meta_value(cls, execute, meta_table, key, previous_value, value):
+        """Store the given value under the given key in the given meta table, if the value stored there is 
+        still the given previous one
+        @param cls
+        @param execute a function to execute sqlalchemy statements with
+        @param previous_value the value we read before, or None if there was none
+        @return True if the value was stored, False if someone else stored another value in the meantime"""
+        from sqlalchemy.exc import IntegrityError
+        import sqlalchemy
+        update = meta_table.update().values(value = value)
+        if previous_value is None:
+            if execute(update.where(sqlalchemy.and_(meta_table.c.key == key, 
+                                                    meta_table.c.value == None))).rowcount == 1:
+                return True
+            # end handle empty value
+            try:
+                execute(meta_table.insert(), {'key' : key, 'value' : value})
+            except IntegrityError:
+                return False
+            # end handle concurrent inserts
+            return True
+        # end handle new values
+        return execute(update.where(sqlalchemy.and_(meta_table.c.key == key, 
+                                                    meta_table.c.value == previous_value))).rowcount == 1
+
+    @classmethod
+    def _read_layout(cls, execute, meta_table, table_name):
+        """@return a tuple of (layout, data) of the RecordLayout stored for the given table, along with its 
+        compression dictionary, and the string it was read from. Both are None if there is none
+        @param cls
+        @param execute a function to execute sqlalchemy statements with"""
+        data = cls._read_meta_value(execute, meta_table, LAYOUT_KEY_PREFIX + table_name)
+        if data is None:
+            return None, None
+        # end handle no layout
+        layout = RecordLayout.from_string(data)
+        layout.set_dictionary(cls._read_meta_value(execute, meta_table, DICTIONARY_KEY_PREFIX + table_name) or '')
+        return layout, data
+
+    @classmethod
+    def _load_table(cls, connection, meta, table, type_name, schema, entities, record_codec, chunk_size, 
+                         after_id):
+        """Insert the given entities into the given table in chunks, and checkpoint each of them
+        @param cls
+        @param connection the connection to run all statements on
+        @param meta the sqlalchemy MetaData with all our tables
+        @param entities an iterable of records to insert. Records with an id smaller or equal to after_id are 
+        skipped
+        @param record_codec the RecordCodec to serialize records with
+        @param after_id the id after which to continue a previous, interrupted load, or None
+        @return the amount of records inserted"""
+        execute = connection.execute
+        meta_table = meta.tables[META_TABLE_NAME]
+        links_insert = meta.tables[LINKS_TABLE_NAME].insert()
+        insert = table.insert()
+        codec = cls._make_codec(table, record_codec)
+        link_fields = [name for name in schema.keys() if schema[name].data_type.value in link_data_types]
+
+        layout = RecordLayout.from_schema(type_name, schema)
+        dictionary = cls._read_meta_value(execute, meta_table, DICTIONARY_KEY_PREFIX + table.name)
+        data = cls._read_meta_value(execute, meta_table, LAYOUT_KEY_PREFIX + table.name)
+        if data is not None:
+            # keep the ordinals and dictionary of records written previously
+            layout = RecordLayout.from_string(data)
+            for field_name, data_type in RecordLayout.from_schema(type_name, schema).fields():
+                layout.add_field(field_name, data_type)
+            # end for each field which may be new
+        # end handle existing layout
+
+        entities = iter(entities)
+        sample = list(islice(entities, cls.dictionary_sample_size))
+        if codec is None and dictionary is None and record_codec.uses_dictionary():
+            dictionary = record_codec.train_dictionary(sample, layout)
+            cls._write_meta_value(execute, meta_table, DICTIONARY_KEY_PREFIX + table.name, dictionary)
+        # end train dictionary
+        layout.set_dictionary(dictionary or '')
+
+        st = time.time()
+        count = 0
+        last_id = after_id
+        ordered = True
+        rows = list()
+        links = list()
+
+        def flush():
+            with connection.begin() as trans:
+                inserted = cls._insert_rows(execute, insert, rows, links_insert, links)
+                if codec is None:
+                    cls._write_meta_value(execute, meta_table, LAYOUT_KEY_PREFIX + table.name, layout.to_string())
+                # end store layout, which may have changed while serializing
+                # without order, we can't tell which records are missing, and have to start over
+                cls._write_meta_value(execute, meta_table, CHECKPOINT_KEY_PREFIX + table.name, 
+                                      str(last_id) if ordered and last_id is not None else '')
+                trans.commit()
+            # end with transaction
+            return inserted
+        # end utility
+
+        for record in chain(sample, entities):
+            rid = record['id']
+            if after_id is not None and rid <= after_id:
+                continue
+            # end skip records we have
+            if last_id is not None and rid <= last_id:
+                ordered = False
+            # end check order
+            last_id = rid
+            if codec is None:
+                rows.append({'id' : rid, 'properties' : record_codec.encode(record, layout)})
+            else:
+                rows.append(codec.to_row(record))
+            # end handle layout
+            links.extend(_link_rows(table.name, record, link_fields))
+            if len(rows) >= chunk_size:
+                count += flush()
+                rows, links = list(), list()
+                sys.stderr.write("Inserted %i '%s' records so far (%.0f records/s)\n" 
+                                 % (count, type_name, count / max(time.time() - st, 1e-6)))
+            # end insert chunk
+        # end for each record
+        del(sample)
+        count += flush()
+        cls._write_meta_value(execute, meta_table, CHECKPOINT_KEY_PREFIX + table.name, CHECKPOINT_DONE)
+        elapsed = time.time() - st
+        sys.stderr.write("Inserted %i '%s' records into %s in %fs (%.0f records/s)\n" 
+                         % (count, type_name, connection.engine.url, elapsed, count / max(elapsed, 1e-6)))
+        return count
+
+    @classmethod
+    def init_database(cls, engine_url, factory, fetch_entity_data_fun, layout = LAYOUT_BLOB, codec = None,
+                           chunk_size = None, resume = False, meta_values = None):
         """Intiialze the database at the given engine_url based on entity schema data obtainable from the 
         given factory.
+        Records are consumed one at a time and inserted in chunks, while the progress is written to stderr.
+        Each chunk is committed along with a checkpoint, which allows to resume an interrupted initialization.
         @param cls
-        @param engine_url an sqlalchemy engine URL to an EMPTY database
+        @param engine_url an sqlalchemy engine URL to an EMPTY database, unless resume is True
         @param factory a ShotgunTypeFactory instance
-        @param fetch_entity_data_fun a function f(type_name) -> [entity_dict, ...] returning 
-        whatever the shotgun API would return when querying all entities of a given type.
+        @param fetch_entity_data_fun a function f(type_name) -> iter([entity_dict, ...]) returning 
+        whatever the shotgun API would return when querying all entities of a given type. It may be a 
+        generator, to keep only a few records in memory at a time.
+        When resuming a type which was loaded partially, it is called as f(type_name, after_id), and should 
+        return only entities with a larger id. If entities are returned in order of their id, a partially 
+        loaded type continues after the last checkpoint, otherwise it is loaded again from scratch.
+        @param layout the layout of the tables to create, either LAYOUT_BLOB or LAYOUT_COLUMNAR. The latter
+        allows to filter, sort and read individual fields within the database.
+        @param codec name of the RecordCodec to serialize records and values with, or None to use the default
+        one. Its blobs are readable by all instances, no matter which codec they use
+        @param chunk_size amount of records to insert at once, or None to use rows_per_insert
+        @param resume if True, the database may contain the result of a previous, interrupted call. Types which
+        were loaded completely are skipped, and partially loaded types continue after their last checkpoint.
+        The layout must be the same as before
+        @param meta_values if not None, a dict of key -> value to store in the meta table before anything is 
+        loaded, see set_meta_value(). Keys which exist already, as stored by an interrupted call, are kept
         @return a new instance of ourselves initialized to use the given engine_url to fetch data from"""
         import sqlalchemy
         from sqlalchemy.schema import MetaData
         engine = sqlalchemy.create_engine(engine_url)
-        existing_meta_data = MetaData(engine, reflect = True)
-        if existing_meta_data.tables:
+        existing_meta_data = MetaData()
+        existing_meta_data.reflect(bind = engine)
+        if existing_meta_data.tables and not (resume and META_TABLE_NAME in existing_meta_data.tables):
             raise AssertionError("Database at '%s' was not empty" % engine_url)
         # end verify  empty database
         
-        meta = cls._make_meta_data(factory)
+        meta = cls._make_meta_data(factory, layout)
+        for name, existing_table in existing_meta_data.tables.iteritems():
+            if name in meta.tables and cls._table_layout(existing_table) != cls._table_layout(meta.tables[name]):
+                raise AssertionError("Table '%s' at '%s' doesn't have the '%s' layout" % (name, engine_url, layout))
+            # end verify layout
+        # end for each existing table
         meta.bind = engine
-        meta.create_all()
+        # all statements run on one connection, which also runs the transactions of _load_table()
+        with engine.connect() as connection:
+            cls._init_tables(connection, meta, factory, fetch_entity_data_fun, codec, chunk_size, resume, 
+                             meta_values)
+        # end with connection
+        return cls(meta)
+
+    @classmethod
+    def _init_tables(cls, connection, meta, factory, fetch_entity_data_fun, codec, chunk_size, resume, 
+                          meta_values):
+        """Create all tables of the given meta data, and fill them, see init_database()
+        @param cls
+        @param connection the connection to run all statements on"""
+        import sqlalchemy
+        execute = connection.execute
+        meta.create_all(bind = connection)
+        with connection.begin():
+            for type_name in factory.type_names():
+                table = meta.tables[type_name.lower()]
+                cls._write_meta_value(execute, meta.tables[META_TABLE_NAME], COLUMNS_KEY_PREFIX + table.name, 
+                                      cls._describe_table(table))
+            # end for each type
+        # end with transaction
         
         # now, for each table we have, query all data and fill it in
-        connection = engine.connect()
-        execute = engine.connect().execute
-        serialize = cls._serialize_properties
+        record_codec_instance = record_codec(codec)
+        chunk_size = chunk_size or cls.rows_per_insert
+        meta_table = meta.tables[META_TABLE_NAME]
+        links = meta.tables[LINKS_TABLE_NAME]
+        for key, value in (meta_values or dict()).iteritems():
+            if cls._read_meta_value(execute, meta_table, key) is None:
+                cls._write_meta_value(execute, meta_table, key, value)
+            # end keep existing values
+        # end for each meta value
         
         for type_name in factory.type_names():
-            insert = meta.tables[type_name.lower()].insert()
-            with connection.begin() as trans:
-                records = list()
-                records_append = records.append
-                rid = 0
-                for rid, record in enumerate(fetch_entity_data_fun(type_name)):
-                    records_append({'id' : record['id'], 'properties' : serialize(record)})
-                # end for each record
-                # multi-insert for a major speedup !
-                st = time.time()
-                execute(insert, records)
-                trans.commit()
-                sys.stderr.write("Inserted %i '%s' records into %s in %fs\n" % (rid, type_name, engine_url, time.time() - st))
-                # end for each type
-            # end with transaction
+            table = meta.tables[type_name.lower()]
+            after_id = None
+            if resume:
+                checkpoint = cls._read_meta_value(execute, meta_table, CHECKPOINT_KEY_PREFIX + table.name)
+                if checkpoint == CHECKPOINT_DONE:
+                    sys.stderr.write("Skipping '%s', which was loaded completely\n" % type_name)
+                    continue
+                # end skip finished types
+                after_id = int(checkpoint) if checkpoint else None
+                # drop everything written after the last checkpoint
+                id_clause = table.c.id > after_id if after_id is not None else None
+                link_clause = links.c.source_type == table.name
+                if after_id is not None:
+                    link_clause = sqlalchemy.and_(link_clause, links.c.source_id > after_id)
+                # end handle partially loaded types
+                execute(table.delete(id_clause))
+                execute(links.delete(link_clause))
+            # end handle resume
+
+            if after_id is None:
+                entities = fetch_entity_data_fun(type_name)
+            else:
+                sys.stderr.write("Resuming '%s' after id %i\n" % (type_name, after_id))
+                entities = fetch_entity_data_fun(type_name, after_id)
+            # end handle partially loaded types
+            cls._load_table(connection, meta, table, type_name, factory.schema_by_name(type_name), entities,
+                            record_codec_instance, chunk_size, after_id)
         # end for each shotgun_type/table
-        
-        return cls(meta)
+
     ## -- End Initialization -- @}
     
     
@@ -181,33 +1509,1048 @@ class SQLProxyShotgunConnection(ProxyShotgunConnection):
         """Set this instance to connect to the given database
         @param db_url An SQL alchemy compatible database URL, or None, in which case we will drop the existing
         database connection and re-connect using kvstore data when needed.
-        It can also be an SQLAlchemy.MetaData instance, which will be used directly
+        It can also be an sqlalchemy Engine, or a bound sqlalchemy MetaData instance, which will be used 
+        directly. Engines we create ourselves use the default pool of make_engine(), use it to configure another one
         @return this instance"""
         from sqlalchemy.schema import MetaData
+        from sqlalchemy.engine import Engine
         if not db_url:
-            try:
-                del(self._meta)
-            except AttributeError:
-                pass
-            # end ignore no engine
+            self._set_engine(None, None, False)
+        elif isinstance(db_url, MetaData):
+            assert db_url.bind is not None, "MetaData must be bound to an engine"
+            self._set_engine(db_url.bind, db_url, False)
+        elif isinstance(db_url, Engine):
+            self._set_engine(db_url, None, False)
         else:
-            # Connect right away and obtain schema from database itself
-            if isinstance(db_url, MetaData):
-                meta = db_url
-            else:
-                meta = MetaData(db_url, reflect = True)
-            self._meta = meta
+            self._set_engine(self.make_engine(db_url), None, True)
         # end handle mode of operation
-        
+        return self
+
+    @classmethod
+    def make_engine(cls, db_url, pool_size = None, max_overflow = None, pool_recycle = None):
+        """@return a new sqlalchemy Engine for the given database URL, with a pool of the given configuration.
+        Use it with set_db_url() if the default pool doesn't fit.
+        @param cls
+        @param pool_size the amount of connections the pool keeps open, or None for sqlalchemy's default
+        @param max_overflow the amount of connections opened in addition to pool_size if all of them are in 
+        use, or None for sqlalchemy's default
+        @param pool_recycle the amount of seconds after which connections are opened again, or None to keep 
+        them open
+        @note the pool configuration is ignored for in-memory sqlite databases, which keep one connection per 
+        thread. Connections to sqlite files are pooled as well, instead of being opened for each query, which 
+        keeps the statements sqlite prepared"""
+        import sqlalchemy
+        from sqlalchemy.pool import QueuePool
+        from sqlalchemy.engine.url import make_url
+        url = make_url(db_url)
+        options = dict()
+        if url.drivername.split('+')[0] == 'sqlite':
+            if url.database in (None, '', ':memory:'):
+                return sqlalchemy.create_engine(url)
+            # end handle pools without configuration
+            # connections are used by one thread at a time, but not always by the one which opened them
+            options['poolclass'] = QueuePool
+            options['connect_args'] = {'check_same_thread' : False}
+        # end handle sqlite
+        for name, value in (('pool_size', pool_size), ('max_overflow', max_overflow), 
+                            ('pool_recycle', pool_recycle)):
+            if value is not None:
+                options[name] = value
+            # end handle defaults
+        # end for each option
+        return sqlalchemy.create_engine(url, **options)
+
+    def engine(self):
+        """@return the sqlalchemy Engine we use"""
+        return self._engine
+
+    def close(self):
+        """Close all connections of our engine, if we created it. Engines passed to set_db_url() are left alone.
+        @return this instance
+        @note instances are not closed when they are deleted, as they wouldn't be collected with a __del__ 
+        method"""
+        self._dispose()
         return self
 
     def type_names(self):
         """@return a list of names of all store entity types"""
-        return self._meta.tables.keys()
+        return [name for name in self._tables.keys() if not name.startswith(INTERNAL_TABLE_PREFIX)]
+
+    def record_codec(self):
+        """@return the RecordCodec we serialize records with, as configured in the sql_record_codec kvstore
+        value. Records of all codecs can be read, no matter which one is configured
+        @throws ValueError if the configured codec is unknown"""
+        return self._record_codec
+
+    def record_cache(self):
+        """@return the RecordCache we use to keep decoded records, or None if there is none"""
+        return self._record_cache
+
+    def set_record_cache(self, record_cache):
+        """Use the given cache to keep decoded records, which are then served without querying the database.
+        It is used for find() and find_one() calls which filter by 'id' only, without an order.
+        @param record_cache a RecordCache instance, or None to disable caching
+        @return this instance"""
+        self._record_cache = record_cache
+        return self
+
+    def set_write_journal(self, journal):
+        """@see ProxyShotgunConnection.set_write_journal()
+        @note our database is changed right away, as if shotgun accepted the writes. Records whose writes 
+        shotgun rejects are read from shotgun again before our next query. Our handler is installed as the 
+        journal's conflict handler, and calls the one it had before"""
+        super(SQLProxyShotgunConnection, self).set_write_journal(journal)
+        if journal is None:
+            return self
+        # end handle no journal
+
+        previous_handler = journal.conflict_handler()
+        def mark_stale(request, error):
+            if request.get('entity_id') is not None:
+                with self._lock:
+                    self._stale.add((request['entity_type'], request['entity_id']))
+                # end with lock
+            # end handle requests with entity
+            if previous_handler is not None:
+                previous_handler(request, error)
+            # end call previous handler
+        # end handler
+        journal.set_conflict_handler(mark_stale)
+        return self
+
+    def invalidate_records(self, entity_type = None, entity_ids = None):
+        """Drop the given records from our caches, which must be called if they are changed in the database
+        @param entity_type the type of the records, or None to drop all records
+        @param entity_ids an iterable of ids, or None to drop all records of the given type
+        @return this instance"""
+        if self._record_cache is not None:
+            if entity_type is not None:
+                entity_type = entity_type.lower()
+            # end handle type
+            self._record_cache.invalidate(entity_type, entity_ids)
+        # end handle record cache
+        self._page_keys.clear()
+        return self
+
+    def meta_value(self, key):
+        """@return the value stored under the given key in our meta table, as string, or None if there is 
+        none, or if there is no meta table"""
+        table = self._tables.get(META_TABLE_NAME)
+        if table is None:
+            return None
+        # end handle databases without meta table
+        with self._connect() as connection:
+            return self._read_meta_value(connection.execute, table, key)
+        # end with connection
+
+    def set_meta_value(self, key, value):
+        """Store the given value under the given key in our meta table, which is created if needed
+        @param key a string of up to 255 characters. Keys used internally have a prefix followed by a colon
+        @param value a string
+        @return this instance"""
+        with self._begin() as connection:
+            self._write_meta_value(connection.execute, self._meta_table(), key, value)
+        # end with transaction
+        return self
+
+    def store_records(self, entity_type, records):
+        """Write the given records into our database, replacing the ones with the same id, along with their
+        links. Use it to keep the database in sync with shotgun.
+        @param entity_type the shotgun type name of the records
+        @param records an iterable of complete records, like the ones shotgun returns when reading all 
+        field_names(). Fields they don't have are empty afterwards
+        @return this instance"""
+        return self._write_changes([(entity_type, list(records), list())])
+
+    def remove_records(self, entity_type, entity_ids):
+        """Delete the records with the given ids from our database, along with their links. Use it to keep 
+        the database in sync with shotgun, after records were deleted or retired.
+        @param entity_type the shotgun type name of the records
+        @param entity_ids an iterable of ids. Unknown ones are ignored
+        @return this instance"""
+        return self._write_changes([(entity_type, list(), list(entity_ids))])
+
+    def field_names(self, entity_type):
+        """@return a list of names of all fields stored for the given entity type, suitable to be used as
+        fields argument for find()
+        @param entity_type the shotgun type name, or one of our type_names()
+        @note for tables with blob layout, we assume all records have the same fields, which is the case if 
+        they were stored by init_database()"""
+        import sqlalchemy
+        table = self._tables[entity_type.lower()]
+        codec = self._codec(table)
+        if codec is not None:
+            return codec.field_names()
+        # end handle columnar layout
+
+        rows = self._query_rows(sqlalchemy.select([table.c.properties], table.c.properties != None, limit=1))
+        if not rows:
+            return list()
+        return self._decode_properties(table, rows[0][0], None).keys()
     
     ## -- End Interface -- @}
     
     
+    # -------------------------
+    ## @name Query Utilities
+    # @{
+
+    def _record_layout(self, table):
+        """@return the cached RecordLayout of the given table, or None if there is none"""
+        try:
+            return self._layouts[table.name]
+        except KeyError:
+            layout = None
+            meta_table = self._tables.get(META_TABLE_NAME)
+            if meta_table is not None:
+                with self._connect() as connection:
+                    layout = self._read_layout(connection.execute, meta_table, table.name)[0]
+                # end with connection
+            # end handle databases without meta table
+            self._layouts[table.name] = layout
+            return layout
+        # end handle cache
+
+    def _decode_properties(self, table, properties_buffer, fields):
+        """@return a record decoded from the given properties blob of the given table, see 
+        _deserialize_properties(). If the blob has fields our cached RecordLayout doesn't know, another 
+        process added them, and the layout is read again"""
+        layout = self._record_layout(table)
+        try:
+            return self._deserialize_properties(properties_buffer, fields, layout)
+        except ValueError:
+            if layout is None:
+                raise
+            # end handle codecs without layout
+            self._layouts.pop(table.name, None)
+            return self._deserialize_properties(properties_buffer, fields, self._record_layout(table))
+        # end handle outdated layouts
+
+    def _compile_filters(self, table, group):
+        """@return (whereclause, exact) tuple to filter the given table according to the given FilterGroup.
+        whereclause may be None if there are no constraints, exact is False if the whereclause doesn't 
+        represent all conditions of the group, and thus matches more records than it should"""
+        links = self._tables.get(LINKS_TABLE_NAME)
+        link_fields = frozenset()
+        if links is not None:
+            link_fields = self._table_link_fields(table)
+        # end handle links
+        return _SQLFilterCompiler(table, self._codec(table), links, link_fields).compile(group)
+
+    def _table_link_fields(self, table):
+        """@return a cached set of names of all fields of the given table which have rows in the links table"""
+        import sqlalchemy
+        try:
+            return self._link_fields[table.name]
+        except KeyError:
+            links = self._tables[LINKS_TABLE_NAME]
+            query = sqlalchemy.select([links.c.field], links.c.source_type == table.name, distinct = True)
+            fields = self._link_fields[table.name] = frozenset(row[0] for row in self._query_rows(query))
+            return fields
+        # end handle cache
+
+    def _meta_table(self):
+        """@return our meta table, which is created if it doesn't exist yet"""
+        table = self._tables.get(META_TABLE_NAME)
+        if table is None:
+            table = self._make_meta_table(self._meta)
+            with self._connect() as connection:
+                table.create(connection, checkfirst = True)
+            # end with connection
+            self._tables.add(table)
+        # end handle databases without meta table
+        return table
+
+    def _record_link_fields(self, table, records, layout):
+        """@return a set of names of the fields of the given records which keep links, and thus have rows in 
+        the links table. Fields the given RecordLayout doesn't know are identified by their values
+        @param layout the RecordLayout of the table, or None"""
+        fields = set(self._table_link_fields(table))
+        guess = RecordLayout(table.name)
+        for field_name, data_type in (layout.fields() if layout is not None else ()):
+            guess.add_field(field_name, data_type)
+        # end for each known field
+        for record in records:
+            for field_name, value in record.iteritems():
+                if value is not None:
+                    guess.add_value(field_name, value)
+                # end skip empty values, which tell nothing
+            # end for each field
+        # end for each record
+        fields.update(field_name for field_name, data_type in guess.fields() if data_type in link_data_types)
+        return fields
+
+    def _record_rows(self, table, entity_type, records, layout):
+        """@return a tuple of (rows, link_rows) to store the given records in the given table and in the links
+        table
+        @param layout the RecordLayout to encode records with if our record codec uses layouts, or None. 
+        Fields it doesn't know are added to it"""
+        codec = self._codec(table)
+        if codec is None:
+            record_codec = self._record_codec
+            rows = [{'id' : record['id'], 'properties' : record_codec.encode(record, layout)} for record in records]
+        else:
+            rows = [codec.to_row(record) for record in records]
+        # end handle layout
+
+        link_rows = list()
+        if records and LINKS_TABLE_NAME in self._tables:
+            link_fields = self._record_link_fields(table, records, layout or self._record_layout(table))
+            for record in records:
+                link_rows.extend(_link_rows(table.name, record, link_fields))
+            # end for each record
+        # end handle links
+        return rows, link_rows
+
+    def _write_changes(self, changes):
+        """Apply the given changes to our database, in a single transaction, and in order
+        @param changes a list of (entity_type, records, entity_ids) tuples. records is a list of complete
+        records to store, entity_ids a list of ids of records to remove. Types we don't store are ignored
+        @return this instance"""
+        changes = [change for change in changes if change[0].lower() in self._tables and 
+                                                   (change[1] or change[2])]
+        if not changes:
+            return self
+        # end handle nothing to do
+
+        prepared = [(self._tables[change[0].lower()], ) + change for change in changes]
+        uses_layout = self._record_codec.uses_layout() and \
+                      any(self._codec(table) is None and records for table, _, records, _ in prepared)
+        meta_table = uses_layout and self._meta_table()
+        links = self._tables.get(LINKS_TABLE_NAME)
+        links_insert = links is not None and links.insert()
+
+        # Records are encoded with the layouts stored in the database, which are read and written in the 
+        # same transaction. Fields records add to them are kept only if the transaction is committed
+        for attempt in xrange(self.max_write_attempts):
+            layouts = dict()
+            try:
+                with self._begin() as connection:
+                    execute = connection.execute
+                    for table, entity_type, records, entity_ids in prepared:
+                        layout = None
+                        if uses_layout and self._codec(table) is None:
+                            if table.name not in layouts:
+                                layout, data = self._read_layout(execute, meta_table, table.name)
+                                layouts[table.name] = (layout or RecordLayout(entity_type), data)
+                            # end read layout
+                            layout = layouts[table.name][0]
+                        # end handle layout
+                        rows, link_rows = self._record_rows(table, entity_type, records, layout)
+                        self._delete_rows(execute, table, entity_ids + [record['id'] for record in records])
+                        self._insert_rows(execute, table.insert(), rows, links_insert, link_rows)
+                    # end for each change
+                    for table_name, (layout, data) in layouts.iteritems():
+                        if layout.is_changed() and not self._replace_meta_value(execute, meta_table, 
+                                                        LAYOUT_KEY_PREFIX + table_name, data, layout.to_string()):
+                            raise _LayoutConflict()
+                        # end handle concurrent writers
+                    # end for each layout to store
+                # end with transaction
+            except _LayoutConflict:
+                if attempt + 1 == self.max_write_attempts:
+                    raise AssertionError("Failed to write records as other processes kept changing their layout")
+                # end give up eventually
+                continue
+            # end handle conflicts
+            break
+        # end for each attempt
+
+        for table_name, (layout, data) in layouts.iteritems():
+            self._layouts[table_name] = layout
+        # end for each layout we know to be stored
+
+        for entity_type, records, entity_ids in changes:
+            self._link_fields.pop(entity_type.lower(), None)
+            self.invalidate_records(entity_type, entity_ids + [record['id'] for record in records])
+        # end for each change
+        return self
+
+    def _refresh_stale(self):
+        """Read all records whose journaled writes shotgun rejected from shotgun again, and write them into 
+        our database. Records which don't exist anymore are removed.
+        If that fails, the records are read again before the next query. If shotgun can't be reached, queries 
+        are still answered by our database.
+        @note called in the thread which queries us, as our shotgun connection is not thread-safe
+        @return this instance"""
+        with self._lock:
+            if not self._stale:
+                return self
+            # end handle nothing to do
+            stale, self._stale = self._stale, set()
+        # end with lock
+
+        ids_by_type = dict()
+        for entity_type, entity_id in stale:
+            if self._is_stored(entity_type):
+                ids_by_type.setdefault(entity_type, set()).add(entity_id)
+            # end handle types we store
+        # end for each stale record
+
+        try:
+            changes = list()
+            for entity_type, entity_ids in ids_by_type.iteritems():
+                records = super(SQLProxyShotgunConnection, self).find(entity_type, 
+                                                                      [['id', 'in', list(entity_ids)]],
+                                                                      self.field_names(entity_type))
+                changes.append((entity_type, records, list(entity_ids - set(record['id'] for record in records))))
+            # end for each type
+            self._write_changes(changes)
+        except Exception, err:
+            with self._lock:
+                self._stale.update(stale)
+            # end with lock
+            if not isinstance(err, transient_errors):
+                raise
+            # end handle unexpected errors
+            log.warn("Could not read %i records whose writes shotgun rejected, will retry: %s", len(stale), err)
+        # end keep stale records until they are written
+        return self
+
+    def _is_stored(self, entity_type):
+        """@return True if we have a table for records of the given type"""
+        return entity_type.lower() in self._tables
+
+    @classmethod
+    def _create_fields(cls, fields, return_fields):
+        """@return a list of fields to return when creating records, which are all fields we store, and the 
+        given return fields"""
+        return sorted(set(fields) | set(return_fields or list()))
+
+    @classmethod
+    def _created_record(cls, record, data, return_fields):
+        """@return the given created record with only the fields shotgun returns if return_fields are asked
+        for, which are all of data and the return_fields, as well as 'id' and 'type'"""
+        fields = _projection(list(data.keys()) + list(return_fields or list()))
+        return dict((field_name, value) for field_name, value in record.iteritems() if field_name in fields)
+
+    def _updated_record(self, entity_type, entity_id, data, result, pending):
+        """@return the complete record of the given type and id after the given update, or None if we don't 
+        have it
+        @param data the data of the update
+        @param result the result of the update, usually a dict with the updated values
+        @param pending a dict of (table_name, id) -> record of records which were changed, but not yet written,
+        which is updated with the returned record"""
+        if not self._is_stored(entity_type):
+            return None
+        # end handle types we don't store
+        key = (entity_type.lower(), entity_id)
+        record = pending.get(key)
+        if record is None:
+            record = self.find_one(entity_type, [('id', 'is', entity_id)], self.field_names(entity_type))
+            if record is None:
+                return None
+            # end handle unknown records
+        # end read record
+        record = dict(record)
+        record.update(data)
+        if isinstance(result, dict):
+            record.update(result)
+        # end handle values as returned by shotgun
+        pending[key] = record
+        return record
+
+    def _delete_rows(self, execute, table, entity_ids):
+        """Delete the rows with the given ids from the given table, along with their links, in chunks of
+        max_ids_per_query
+        @param execute a function to execute sqlalchemy statements with
+        @param entity_ids a list of ids"""
+        import sqlalchemy
+        links = self._tables.get(LINKS_TABLE_NAME)
+        for start in xrange(0, len(entity_ids), self.max_ids_per_query):
+            ids = entity_ids[start:start + self.max_ids_per_query]
+            execute(table.delete(table.c.id.in_(ids)))
+            if links is not None:
+                execute(links.delete(sqlalchemy.and_(links.c.source_type == table.name, 
+                                                     links.c.source_id.in_(ids))))
+            # end handle links
+        # end for each chunk of ids
+
+    def _order_columns(self, table, order):
+        """@return a list of (column, descending) tuples to sort the given table by, or None if the given order 
+        can't be expressed in SQL
+        @param order a normalized order specification, see normalize_order()"""
+        codec = self._codec(table)
+        out = list()
+        for field_name, descending in order:
+            if field_name == 'id':
+                column = table.c.id
+            elif codec is None:
+                return None
+            else:
+                kind = codec.field_kind(field_name)
+                if kind == codec.KIND_LINK:
+                    # shotgun sorts links by their display name
+                    column = table.c[link_column_name(field_name, 'name')]
+                elif kind in (None, codec.KIND_BLOB):
+                    return None
+                else:
+                    column = table.c[field_name]
+                # end handle kind
+            # end handle field
+            out.append((column, descending))
+        # end for each field
+        return out
+
+    @classmethod
+    def _order_by(cls, order_columns):
+        """@return a list of sqlalchemy ORDER BY clauses for the given (column, descending) tuples"""
+        return [column.desc() if descending else column.asc() for column, descending in order_columns]
+
+    @classmethod
+    def _keyset_clause(cls, order_columns, key):
+        """@return a where clause matching all rows sorting after the row with the given key
+        @param order_columns as returned by _order_columns()
+        @param key a tuple of values of all order columns, of the last row of the previous page
+        @note assumes NULL sorts before all other values, see keyset_dialects"""
+        import sqlalchemy
+        alternatives = list()
+        for index, ((column, descending), value) in enumerate(zip(order_columns, key)):
+            if value is None:
+                after = sqlalchemy.false() if descending else column.isnot(None)
+            elif descending:
+                after = sqlalchemy.or_(column < value, column.is_(None))
+            else:
+                after = column > value
+            # end handle direction and NULL
+            equal = [c.is_(None) if v is None else c == v for (c, _), v in zip(order_columns, key[:index])]
+            alternatives.append(sqlalchemy.and_(*(equal + [after])))
+        # end for each column
+        return sqlalchemy.or_(*alternatives)
+
+    @classmethod
+    def _query_key(cls, table, whereclause, order_columns, limit):
+        """@return a hashable key identifying the given query, independently of the page"""
+        where_key = None
+        if whereclause is not None:
+            where_key = (unicode(whereclause), repr(sorted(whereclause.compile().params.items())))
+        # end handle where clause
+        return (table.name, where_key, tuple((column.name, descending) for column, descending in order_columns),
+                limit)
+
+    def _select_page(self, entity_type, table, fields, whereclause, order_columns, limit, page):
+        """@return a list of records of the given page, using keyset pagination if the previous page was 
+        queried before, which is much faster than skipping all previous rows.
+        @param order_columns as returned by _order_columns()
+        @param limit the amount of records per page, or 0 for all of them
+        @param page the 1-based page to return, or 0 if there is no paging
+        @note the sort key of the last record of each page is read along with the records, and remembered 
+        per instance. Pages whose predecessor wasn't read by this instance yet, and all pages of dialects 
+        which are not in keyset_dialects, are read with OFFSET"""
+        import sqlalchemy
+        order_by = self._order_by(order_columns)
+        if not page:
+            return self._select_records(entity_type, table, fields, whereclause, limit or None, order_by)
+        # end handle no paging
+
+        use_keys = self._engine.dialect.name in self.keyset_dialects
+        query_key = self._query_key(table, whereclause, order_columns, limit)
+        offset = (page - 1) * limit
+        key = use_keys and self._page_keys.get((query_key, page - 1))
+        if key:
+            offset = None
+            clause = self._keyset_clause(order_columns, key)
+            if whereclause is not None:
+                clause = sqlalchemy.and_(whereclause, clause)
+            # end combine with filters
+        else:
+            clause = whereclause
+        # end handle keyset
+
+        if not use_keys:
+            return self._select_records(entity_type, table, fields, clause, limit, order_by, offset or None)
+        # end handle dialects without keyset pagination
+
+        key_columns = [column for column, descending in order_columns]
+        rows = list(self._iter_records(entity_type, table, fields, clause, limit, order_by, offset or None,
+                                       key_columns))
+        if len(rows) == limit:
+            if len(self._page_keys) >= self.max_page_keys:
+                self._page_keys.clear()
+            # end keep memory bounded
+            self._page_keys[(query_key, page)] = rows[-1][1]
+        # end remember where this page ends
+        return [record for record, row_key in rows]
+
+    def _make_link_resolver(self):
+        """@return a function f(link, field_name) -> value, which reads the value of the given field from the
+        record the given link points to, or None if it doesn't exist in our database. Records are read only once
+        per resolver"""
+        records = dict()
+        def resolve_link(link, field_name):
+            key = (link['type'], link['id'])
+            if key not in records:
+                table = self._tables.get(key[0].lower())
+                record = None
+                if table is not None:
+                    res = self._select_records(key[0], table, None, table.c.id == key[1])
+                    record = res and res[0] or None
+                # end handle known types
+                records[key] = record
+            # end read record
+            record = records[key]
+            if record is None:
+                return None
+            return record.get(field_name)
+        # end utility
+        return resolve_link
+
+    def _iter_records(self, entity_type, table, fields, whereclause = None, limit = None, order_by = None, 
+                            offset = None, key_columns = None):
+        """@return an iterator over records read from the given table. Rows are fetched in chunks of 
+        rows_per_fetch, so only a few of them are in memory at a time.
+        @param entity_type the shotgun type name of the records
+        @param table the table to read from
+        @param fields list of field names to read, or None to read all of them. 'id' and 'type' are always 
+        returned
+        @param whereclause an optional sqlalchemy expression to filter rows with
+        @param limit if not None, the maximum amount of records to return
+        @param order_by if not None, a list of sqlalchemy ORDER BY clauses
+        @param offset if not None, the amount of rows to skip
+        @param key_columns if not None, a list of columns whose values are read along with each record, which 
+        are yielded as (record, key) tuples, where key is a tuple of the column values"""
+        import sqlalchemy
+        codec = self._codec(table)
+        if codec is None:
+            columns = [table.c.properties]
+            decode = self._decode_properties
+            convert = lambda row: decode(table, row[0], fields)
+            whereclause = sqlalchemy.and_(*[c for c in (whereclause, table.c.properties != None) if c is not None])
+        else:
+            columns = [table.c.id] + [table.c[name] for name in codec.column_names(fields)]
+            convert = lambda row: codec.to_record(row, entity_type, fields)
+        # end handle layout
+        if key_columns:
+            # labels keep them apart from the same columns the record is read from
+            key_labels = ['_key_%i' % index for index in xrange(len(key_columns))]
+            columns = columns + [column.label(label) for column, label in zip(key_columns, key_labels)]
+            convert_record = convert
+            convert = lambda row: (convert_record(row), tuple(row[label] for label in key_labels))
+        # end handle keys
+
+        query = sqlalchemy.select(columns, whereclause, limit=limit, order_by=order_by, offset=offset)
+        if self._streams_results():
+            # server-side cursors keep fetchmany() from getting buffered rows. They block their connection until 
+            # all rows were read, which is why they get one of their own. Unlike the connection of the current 
+            # thread, it doesn't see writes of transactions the thread didn't commit yet
+            connect = lambda: closing(self._engine.connect())
+            query = query.execution_options(stream_results=True)
+        else:
+            connect = self._connect
+        # end handle server-side cursors
+        with connect() as connection:
+            result = connection.execute(query)
+            while True:
+                rows = result.fetchmany(self.rows_per_fetch)
+                if not rows:
+                    break
+                # end handle end of results
+                for row in rows:
+                    yield convert(row)
+                # end for each row
+            # end while there are rows
+        # end with connection
+
+    def _select_records(self, *args, **kwargs):
+        """@return a list of records read from the given table
+        @note see _iter_records() for the arguments"""
+        return list(self._iter_records(*args, **kwargs))
+
+    def _compiled(self, key, make_statement):
+        """@return the cached compiled statement of the given key, which is created with make_statement() and
+        compiled for our engine's dialect if it isn't cached yet. Execute it with the values of its bind 
+        parameters
+        @param key a hashable key identifying the table and the shape of the statement
+        @param make_statement f() -> sqlalchemy statement using bind parameters for all values"""
+        try:
+            return self._statements[key]
+        except KeyError:
+            compiled = make_statement().compile(dialect=self._engine.dialect)
+            if len(self._statements) >= self.max_statements:
+                self._statements.clear()
+            # end keep memory bounded
+            self._statements[key] = compiled
+            return compiled
+        # end handle cache
+
+    def _select_ids(self, entity_type, table, fields, ids):
+        """@return a list of the records of the given table with the given ids, in no particular order, using 
+        a compiled statement. The amount of ids is rounded up to the next power of two by repeating the last 
+        one, which keeps the amount of statements small
+        @param fields see _iter_records()
+        @param ids a non-empty list of at most max_ids_per_query ids"""
+        import sqlalchemy
+        size = 1
+        while size < len(ids):
+            size *= 2
+        # end find amount of parameters
+        size = min(size, max(self.max_ids_per_query, len(ids)))
+        names = ['id_%i' % index for index in xrange(size)]
+
+        codec = self._codec(table)
+        if codec is None:
+            columns = [table.c.properties]
+            decode = self._decode_properties
+            convert = lambda row: decode(table, row[0], fields)
+            key = (table.name, None, size)
+        else:
+            column_names = codec.column_names(fields)
+            columns = [table.c.id] + [table.c[name] for name in column_names]
+            convert = lambda row: codec.to_record(row, entity_type, fields)
+            key = (table.name, tuple(column_names), size)
+        # end handle layout
+
+        def make_statement():
+            whereclause = table.c.id.in_([sqlalchemy.bindparam(name) for name in names])
+            if codec is None:
+                whereclause = sqlalchemy.and_(whereclause, table.c.properties != None)
+            # end skip records without properties
+            return sqlalchemy.select(columns, whereclause)
+        # end utility
+
+        compiled = self._compiled(key, make_statement)
+        params = dict(zip(names, ids + ids[-1:] * (size - len(ids))))
+        return [convert(row) for row in self._query_rows(compiled, params)]
+
+    def _find(self, entity_type, group, fields, order, limit, page):
+        """@return a list of records matching the given arguments, or None if we can't handle them
+        @param group a normalized FilterGroup
+        @param order a normalized order, see normalize_order()
+        @param limit the maximum amount of records, which is the page size if page is not 0
+        @param page the 1-based page to return, or 0"""
+        table = self._tables[entity_type.lower()]
+        whereclause, exact = self._compile_filters(table, group)
+        order_columns = self._order_columns(table, order)
+        if exact and order_columns is not None:
+            return self._select_page(entity_type, table, fields, whereclause, order_columns, limit, page)
+        # end handle pure SQL queries
+
+        # Evaluate everything else in memory
+        matches = lambda record: True
+        if not exact:
+            try:
+                matches = FilterEvaluator(group, self._make_link_resolver()).matches
+            except ValueError:
+                return None
+            # end handle filters we don't understand
+        # end handle filters
+
+        offset = page > 0 and (page - 1) * limit or 0
+        end = limit and offset + limit or None
+        order_by = None
+        extra_fields = group.field_names()
+        if order_columns is None:
+            extra_fields |= set(field_name for field_name, descending in order)
+        else:
+            order_by = self._order_by(order_columns)
+        # end handle order
+        extra_fields -= set(fields) | set(('id', 'type'))
+
+        records = list()
+        for record in self._select_records(entity_type, table, list(fields) + list(extra_fields), whereclause, 
+                                           order_by=order_by):
+            if not matches(record):
+                continue
+            # end skip mismatches
+            records.append(record)
+            if order_by is not None and len(records) == end:
+                break
+            # end stop once we have enough
+        # end for each candidate
+
+        if order_by is None:
+            sort_records(records, order)
+        # end sort in memory
+        records = records[offset:end]
+
+        if extra_fields:
+            for record in records:
+                for field_name in extra_fields:
+                    record.pop(field_name, None)
+                # end for each field to remove
+            # end for each record
+        # end don't return what wasn't asked for
+        return records
+
+    def _iter_matches(self, entity_type, table, fields, whereclause, order_columns, limit, group, matches):
+        """@return an iterator over the records of the given table which match the given where clause, and
+        the given matches function, if it is not None. Records are streamed from the database
+        @param order_columns as returned by _order_columns()
+        @param group the normalized FilterGroup matches() evaluates"""
+        order_by = self._order_by(order_columns)
+        if matches is None:
+            for record in self._iter_records(entity_type, table, fields, whereclause, limit or None, order_by):
+                yield record
+            # end for each record
+            return
+        # end handle pure SQL queries
+
+        extra_fields = group.field_names() - set(fields) - set(('id', 'type'))
+        count = 0
+        for record in self._iter_records(entity_type, table, list(fields) + list(extra_fields), whereclause,
+                                         order_by=order_by):
+            if not matches(record):
+                continue
+            # end skip mismatches
+            for field_name in extra_fields:
+                record.pop(field_name, None)
+            # end for each field to remove
+            yield record
+            count += 1
+            if count == limit:
+                break
+            # end stop once we have enough
+        # end for each candidate
+
+    @classmethod
+    def _id_list_condition(cls, group):
+        """@return the 'id in' or 'id is' condition which constrains all records of the given group, or None 
+        if there is no such condition"""
+        if group.operator != 'all':
+            return None
+        # end handle any
+        for sg_filter in group.filters:
+            if isinstance(sg_filter, FilterCondition) and sg_filter.path == 'id' and \
+               sg_filter.relation in ('in', 'is'):
+                return sg_filter
+            # end check condition
+        # end for each filter
+        return None
+
+    def _find_ids(self, entity_type, group, condition, fields, order, limit, page):
+        """@return a list of records like _find(), for a group which is constrained by the given 'id in' 
+        or 'id is' condition. Ids are read in chunks of at most max_ids_per_query.
+        If there are no other conditions and no order, records are served from our record cache, if we have
+        one.
+        @param order a normalized order, or None to return records in the order of the condition's ids"""
+        values = condition.values
+        if condition.relation == 'is':
+            values = [rid for rid in [condition.value()] if rid is not None]
+        # end handle single ids
+        ids = list()
+        seen = set()
+        for rid in values:
+            if rid not in seen:
+                seen.add(rid)
+                ids.append(rid)
+            # end skip duplicates
+        # end for each id
+
+        extra_fields = set()
+        if order:
+            extra_fields = set(field_name for field_name, descending in order) - set(fields) - set(('id', 'type'))
+        # end handle order fields
+        read_fields = list(fields) + list(extra_fields)
+        others = [sg_filter for sg_filter in group.filters if sg_filter is not condition]
+
+        records = dict()
+        missing = ids
+        cache = self._record_cache
+        cache_type = entity_type.lower()
+        if cache is None or others or order:
+            cache = None
+        else:
+            missing = list()
+            for rid in ids:
+                record = cache.get(cache_type, rid, fields)
+                if record is None:
+                    missing.append(rid)
+                else:
+                    records[rid] = record
+                # end handle cache misses
+            # end for each id
+        # end handle record cache
+
+        table = self._tables[cache_type]
+        for start in xrange(0, len(missing), self.max_ids_per_query):
+            chunk_ids = missing[start:start + self.max_ids_per_query]
+            if not others:
+                # plain lookups by id use a compiled statement
+                res = self._select_ids(entity_type, table, read_fields, chunk_ids)
+            else:
+                chunk = FilterGroup(group.operator, others + [FilterCondition('id', 'in', chunk_ids)])
+                res = self._find(entity_type, chunk, read_fields, normalize_order(None), 0, 0)
+            # end handle other conditions
+            if res is None:
+                return None
+            # end handle unsupported queries
+            for record in res:
+                records[record['id']] = record
+                if cache is not None:
+                    cache.put(cache_type, record)
+                # end keep record
+            # end for each record
+        # end for each chunk
+
+        if order:
+            records = sort_records(records.values(), order)
+        else:
+            records = [records[rid] for rid in ids if rid in records]
+        # end handle order
+
+        offset = page > 0 and (page - 1) * limit or 0
+        records = records[offset:limit and offset + limit or None]
+        for record in records:
+            for field_name in extra_fields:
+                record.pop(field_name, None)
+            # end for each field to remove
+        # end for each record
+        return records
+
+    def _summary_column(self, table, field_name):
+        """@return (columns, kind) tuple of the columns storing the given field, and its kind. None if the
+        field isn't stored in its own columns. Links have (type, id, name) columns, everything else just one.
+        kind is one of the _ColumnarRecordCodec.KIND_* constants"""
+        codec = self._codec(table)
+        if field_name == 'id':
+            return [table.c.id], _ColumnarRecordCodec.KIND_NUMBER
+        elif codec is None:
+            return None
+        # end handle blobs
+        kind = codec.field_kind(field_name)
+        if kind is None or kind == codec.KIND_BLOB:
+            return None
+        # end handle unsupported fields
+        return [table.c[name] for name in codec.column_names([field_name])], kind
+
+    def _summary_aggregate(self, table, field_name, summary_type, summary_value):
+        """@return an sqlalchemy aggregate expression to compute the given summary, or None if this isn't 
+        possible. record_count and unchecked summaries are computed from the amount of records"""
+        import sqlalchemy
+        from sqlalchemy import func
+        if summary_type == 'record_count':
+            return sqlalchemy.null()
+        # end handle record count
+        info = self._summary_column(table, field_name)
+        if info is None:
+            return None
+        # end handle unsupported fields
+        columns, kind = info
+        column = columns[0]
+        if kind == _ColumnarRecordCodec.KIND_LINK:
+            if summary_type != 'count':
+                return None
+            # end handle links
+            column = columns[1]
+        # end handle links
+
+        if summary_type == 'count':
+            if kind == _ColumnarRecordCodec.KIND_TEXT:
+                # empty strings don't count, like in memory
+                column = sqlalchemy.case([(column == '', sqlalchemy.null())], else_=column)
+            # end handle text
+            return func.count(column)
+        elif summary_type in ('sum', 'average'):
+            if kind not in (_ColumnarRecordCodec.KIND_NUMBER, _ColumnarRecordCodec.KIND_FLOAT):
+                return None
+            # end handle non-numbers
+            return func.sum(column) if summary_type == 'sum' else func.avg(column)
+        elif summary_type in ('minimum', 'maximum'):
+            return (func.min if summary_type == 'minimum' else func.max)(column, type_=column.type)
+        elif summary_type in ('checked', 'unchecked'):
+            if kind != _ColumnarRecordCodec.KIND_BOOLEAN:
+                return None
+            # end handle non-booleans
+            return func.sum(sqlalchemy.case([(column == True, 1)], else_=0))
+        # end handle type
+
+        # percentages
+        if summary_value is None:
+            matches = column == None
+        else:
+            try:
+                if field_name == 'id':
+                    value = _to_number(summary_value)
+                else:
+                    value = self._codec(table).encode(field_name, summary_value)
+                # end handle id
+            except (ValueError, TypeError):
+                return None
+            # end handle unsupported values
+            matches = column == value
+        # end handle value
+        return func.sum(sqlalchemy.case([(matches, 1)], else_=0))
+
+    def _summarize_sql(self, table, whereclause, summary_fields, grouping):
+        """@return a dict as returned by summarize(), computed with SQL aggregates and GROUP BY, or None if 
+        not all summaries and groupings are on fields with their own columns
+        @param summary_fields normalized summary fields
+        @param grouping normalized grouping"""
+        import sqlalchemy
+        from sqlalchemy import func
+        aggregates = list()
+        for field_name, summary_type, summary_value in summary_fields:
+            aggregate = self._summary_aggregate(table, field_name, summary_type, summary_value)
+            if aggregate is None:
+                return None
+            # end handle unsupported summaries
+            aggregates.append(aggregate)
+        # end for each summary
+
+        group_columns = list()
+        for field_name, descending in grouping:
+            info = self._summary_column(table, field_name)
+            if info is None:
+                return None
+            # end handle unsupported groups
+            group_columns.append(info)
+        # end for each grouping level
+
+        codec = self._codec(table)
+        def group_value(field_name, kind, values):
+            if kind == _ColumnarRecordCodec.KIND_LINK:
+                if values[1] is None:
+                    return None
+                return dict(zip(link_column_parts, values))
+            elif field_name == 'id':
+                return values[0]
+            return codec.decode(field_name, values[0])
+        # end utility
+
+        root = SummaryGroup(summary_fields)
+        # one query per level, as summaries of parent groups can't be computed from the ones of their children
+        for level in xrange(len(grouping) + 1):
+            columns = list()
+            for columns_of_field, kind in group_columns[:level]:
+                columns.extend(columns_of_field)
+            # end for each group column
+            # the table must be named, as record counts alone don't refer to any of its columns
+            query = sqlalchemy.select(columns + [func.count()] + aggregates, whereclause, 
+                                      group_by=columns or None).select_from(table)
+            for row in self._query_rows(query):
+                row = list(row)
+                group = root
+                index = 0
+                for (field_name, descending), (columns_of_field, kind) in zip(grouping[:level], 
+                                                                              group_columns[:level]):
+                    group = group.group(group_value(field_name, kind, row[index:index + len(columns_of_field)]))
+                    index += len(columns_of_field)
+                # end for each group value
+                record_count = row[index]
+                summaries = dict()
+                for (field_name, summary_type, summary_value), value in zip(summary_fields, row[index + 1:]):
+                    if summary_type == 'record_count':
+                        value = record_count
+                    elif summary_type in ('count', 'sum', 'checked'):
+                        value = value or 0
+                    elif summary_type == 'unchecked':
+                        value = record_count - (value or 0)
+                    elif summary_type == 'average':
+                        value = value if value is None else float(value)
+                    elif summary_type in ('percentage', 'status_percentage'):
+                        value = _percentage(value or 0, record_count)
+                    elif field_name != 'id' and value is not None:
+                        value = codec.decode(field_name, value)
+                    # end handle type
+                    summaries[field_name] = value
+                # end for each summary
+                group.set_summaries(summaries)
+            # end for each row
+        # end for each level
+        return root.result(grouping)
+
+    ## -- End Query Utilities -- @}
+
     # -------------------------
     ## @name Shotgun Interface Overrides
     # @{
@@ -215,48 +2558,81 @@ class SQLProxyShotgunConnection(ProxyShotgunConnection):
     def find(self, entity_type, filters, fields, order = list(), filter_operator = "all", limit = 0, 
                        retired_only = False, page = 0):
         """@see https://github.com/shotgunsoftware/python-api/wiki/Reference:-Methods#wiki-find
-        @note this implementation will only work for ID based filters or an empty filter. If we can't reproduce
-        what our arguments demand, we will just pass the call on to our base class.
-        @note will always return *all* fields that are known to the schema, assuming that user's who don't want
-        that don't use it anyway."""
-        import sqlalchemy
-        # dict filters = nested expression
+        @note filters are translated into SQL where possible. Tables with blob layout can only be filtered by 
+        'id', tables with columnar layout support most relations on all fields that are not serialized. 
+        All other conditions are evaluated in memory, on the records preselected by the database. Deep-link 
+        paths are resolved using the records in our database.
+        If we can't reproduce what our arguments demand, we will just pass the call on to our base class.
+        @note order and page are handled like shotgun does it, with a page size of limit. Ordering happens in
+        SQL if possible, in memory otherwise. Subsequent pages of SQL queries use keyset pagination.
+        @note only the given fields are decoded and returned, in addition to 'id' and 'type'.
+        @note if filtered by a list of ids without explicit order, records are returned in the order of the
+        given ids, and missing ids are skipped. Large id lists are read in chunks of max_ids_per_query.
+        @note lookups by id only are served from our record cache, if set, see set_record_cache()"""
         return_super = lambda: super(SQLProxyShotgunConnection, self).find(entity_type, filters, fields, order,
                                                                 filter_operator, limit, retired_only, page)
-        if len(filters) > 1 or isinstance(filters, dict) or not fields or order or \
-            filter_operator != 'all' or retired_only or page > 0:
+        self._refresh_stale()
+        if not fields or retired_only:
             return return_super()
         # end bail out with super class call
+
+        try:
+            group = normalize_filters(filters, filter_operator)
+            order_spec = normalize_order(order)
+        except ValueError:
+            # shotgun will tell the caller what's wrong
+            return return_super()
+        # end handle invalid filters
         
-        # check the filter - the only thing we can do is all ids or one id
-        if filters:
-            # FETCH ONE
-            ############
-            if len(filters) > 1:
-                return return_super()
-            # end multi-filtering isn't supported
+        if page > 0 and (not limit or limit > self.records_per_page):
+            limit = self.records_per_page
+        # end handle page size
 
-            field, op, id_to_find = filters[0]
-            if field != 'id' or op != 'is':
-                return return_super()
-            # end handle filters
-            # find one with ID
-            tbl = self._meta.tables[entity_type.lower()]
-            res = sqlalchemy.select([tbl.c.properties], tbl.c.id == id_to_find).execute().fetchall()
-            if not res:
-                return list()
-            assert len(res) == 1
-            res = [self._deserialize_properties(res[0][0])]
+        condition = self._id_list_condition(group)
+        if condition is not None and (not order or len(condition.values) > self.max_ids_per_query):
+            records = self._find_ids(entity_type, group, condition, fields, order and order_spec, limit, page)
         else:
-            # FETCH ALL
-            #############
-            if not limit:
-                limit = None
-            # end convert limit
-            result = sqlalchemy.select([self._meta.tables[entity_type.lower()].c.properties], limit=limit).execute().fetchall()
-            res = [self._deserialize_properties(row[0]) for row in result if row[0] is not None]
-        # end handle filters term
-        return res
+            records = self._find(entity_type, group, fields, order_spec, limit, page)
+        # end handle id lists
+
+        if records is None:
+            return return_super()
+        return records
+        
+    def iter_find(self, entity_type, filters, fields, order = list(), filter_operator = 'all', limit = 0):
+        """@return an iterator over the records find() would return for the given arguments.
+        @note records are streamed from the database in chunks of rows_per_fetch if the order can be handled 
+        by SQL, while filters SQL can't handle are evaluated on each record. Lookups by id and orders by fields 
+        without a column are served by find(). Queries we can't handle are paged through shotgun"""
+        return_super = lambda: super(SQLProxyShotgunConnection, self).iter_find(entity_type, filters, fields,
+                                                                                order, filter_operator, limit)
+        self._refresh_stale()
+        table = self._tables.get(entity_type.lower())
+        if not fields or table is None:
+            return return_super()
+        # end bail out with super class call
+
+        try:
+            group = normalize_filters(filters, filter_operator)
+            order_columns = self._order_columns(table, normalize_order(order))
+        except ValueError:
+            return return_super()
+        # end handle invalid filters
+
+        if order_columns is None or self._id_list_condition(group) is not None:
+            return iter(self.find(entity_type, filters, fields, order, filter_operator, limit))
+        # end handle queries which need all records in memory
+
+        whereclause, exact = self._compile_filters(table, group)
+        matches = None
+        if not exact:
+            try:
+                matches = FilterEvaluator(group, self._make_link_resolver()).matches
+            except ValueError:
+                return return_super()
+            # end handle filters we don't understand
+        # end handle filters
+        return self._iter_matches(entity_type, table, fields, whereclause, order_columns, limit, group, matches)
         
     def find_one(self, entity_type, filters, fields = ['id'], order = list(), filter_operator = 'all'):
         """@see https://github.com/shotgunsoftware/python-api/wiki/Reference:-Methods#wiki-find_one
@@ -267,6 +2643,177 @@ class SQLProxyShotgunConnection(ProxyShotgunConnection):
         if not res:
             return None
         return res[0]
+
+    def summarize(self, entity_type, filters, summary_fields, filter_operator = 'all', grouping = list()):
+        """@see https://github.com/shotgunsoftware/python-api/wiki/Reference:-Methods#wiki-summarize
+        @note summaries are computed with SQL aggregates and GROUP BY if filters, summaries and groupings only
+        use fields that have their own columns. Otherwise, records are streamed from the database and 
+        summarized in memory. If we can't reproduce what our arguments demand, we will just pass the call on 
+        to our base class.
+        @note supported summary types are record_count, count, sum, average, minimum (min, earliest), 
+        maximum (max, latest), percentage, status_percentage, checked and unchecked. Groupings must be 
+        'exact'."""
+        return_super = lambda: super(SQLProxyShotgunConnection, self).summarize(entity_type, filters, 
+                                                                    summary_fields, filter_operator, grouping)
+        self._refresh_stale()
+        try:
+            group = normalize_filters(filters, filter_operator or 'all')
+            summaries = normalize_summary_fields(summary_fields)
+            groups = normalize_grouping(grouping)
+        except ValueError:
+            return return_super()
+        # end handle unsupported arguments
+
+        table = self._tables[entity_type.lower()]
+        whereclause, exact = self._compile_filters(table, group)
+        if exact:
+            result = self._summarize_sql(table, whereclause, summaries, groups)
+            if result is not None:
+                return result
+            # end handle SQL summaries
+        # end handle pure SQL queries
+
+        matches = lambda record: True
+        if not exact:
+            try:
+                matches = FilterEvaluator(group, self._make_link_resolver()).matches
+            except ValueError:
+                return return_super()
+            # end handle filters we don't understand
+        # end handle filters
+
+        fields = set(field_name for field_name, summary_type, summary_value in summaries)
+        fields.update(field_name for field_name, descending in groups)
+        fields.update(group.field_names())
+        records = self._iter_records(entity_type, table, list(fields), whereclause)
+        try:
+            return summarize_records((record for record in records if matches(record)), summary_fields, grouping)
+        except ValueError:
+            return return_super()
+        # end handle unsupported groups
+        
+    def count(self, entity_type, filters, filter_operator = 'all'):
+        """@return the amount of records matching the given filters
+        @note answered with SELECT COUNT(*) if the filters can be handled by SQL. Otherwise only the fields 
+        the filters use are read, and evaluated in memory. If we can't handle the filters, shotgun counts"""
+        import sqlalchemy
+        from sqlalchemy import func
+        return_super = lambda: super(SQLProxyShotgunConnection, self).count(entity_type, filters, filter_operator)
+        self._refresh_stale()
+        table = self._tables.get(entity_type.lower())
+        if table is None:
+            return return_super()
+        # end handle types we don't store
+
+        try:
+            group = normalize_filters(filters, filter_operator or 'all')
+        except ValueError:
+            return return_super()
+        # end handle invalid filters
+
+        whereclause, exact = self._compile_filters(table, group)
+        if exact:
+            if self._codec(table) is None:
+                whereclause = sqlalchemy.and_(*[c for c in (whereclause, table.c.properties != None) 
+                                                if c is not None])
+            # end skip rows without record, like find() does
+            return self._query_rows(sqlalchemy.select([func.count()], whereclause).select_from(table))[0][0]
+        # end handle pure SQL queries
+
+        try:
+            matches = FilterEvaluator(group, self._make_link_resolver()).matches
+        except ValueError:
+            return return_super()
+        # end handle filters we don't understand
+        records = self._iter_records(entity_type, table, list(group.field_names()), whereclause)
+        return sum(1 for record in records if matches(record))
+
+    def create(self, entity_type, data, return_fields = list()):
+        """@see https://github.com/shotgunsoftware/python-api/wiki/Reference:-Methods#wiki-create
+        @note the new record is returned with all fields we store, in the same request, and written into our
+        database right away. Only the fields shotgun would return are returned"""
+        if not self._is_stored(entity_type) or self._active_batch() is not None:
+            return super(SQLProxyShotgunConnection, self).create(entity_type, data, return_fields)
+        # end handle types we don't store, and calls which are written once batch() sends them
+        fields = self.field_names(entity_type)
+        record = super(SQLProxyShotgunConnection, self).create(entity_type, data, 
+                                                               self._create_fields(fields, return_fields))
+        self._write_changes([(entity_type, [record], list())])
+        return self._created_record(record, data, return_fields)
+
+    def update(self, entity_type, entity_id, data):
+        """@see https://github.com/shotgunsoftware/python-api/wiki/Reference:-Methods#wiki-update
+        @note the changed values are written into our database right away, if we have the record"""
+        if self._active_batch() is not None:
+            return super(SQLProxyShotgunConnection, self).update(entity_type, entity_id, data)
+        # end handle calls which are written once batch() sends them
+        result = super(SQLProxyShotgunConnection, self).update(entity_type, entity_id, data)
+        record = self._updated_record(entity_type, entity_id, data, result, dict())
+        if record is not None:
+            self._write_changes([(entity_type, [record], list())])
+        # end handle known records
+        return result
+
+    def delete(self, entity_type, entity_id):
+        """@see https://github.com/shotgunsoftware/python-api/wiki/Reference:-Methods#wiki-delete
+        @note the record is removed from our database right away"""
+        result = super(SQLProxyShotgunConnection, self).delete(entity_type, entity_id)
+        if result and self._active_batch() is None:
+            self._write_changes([(entity_type, list(), [entity_id])])
+        # end handle retired records
+        return result
+
+    def revive(self, entity_type, entity_id):
+        """@see https://github.com/shotgunsoftware/python-api/wiki/Reference:-Methods#wiki-revive
+        @note the record is read from shotgun, and written into our database right away. If we have a write 
+        journal, it sends the revive first. If shotgun can't be reached, the record is added by the next sync"""
+        result = super(SQLProxyShotgunConnection, self).revive(entity_type, entity_id)
+        if result and self._is_stored(entity_type) and (self._journal is None or self._journal.wait()):
+            record = super(SQLProxyShotgunConnection, self).find_one(entity_type, [['id', 'is', entity_id]], 
+                                                                     self.field_names(entity_type))
+            self._write_changes([(entity_type, [record] if record else list(), list())])
+        # end handle revived records
+        return result
+
+    def batch(self, requests):
+        """@see https://github.com/shotgunsoftware/python-api/wiki/Reference:-Methods#wiki-batch
+        @note the result of each request is written into our database right away, in a single transaction.
+        Records are created like create() does it"""
+        sent = list()
+        for request in requests:
+            if request['request_type'] == 'create' and self._is_stored(request['entity_type']):
+                request = dict(request)
+                request['return_fields'] = self._create_fields(self.field_names(request['entity_type']), 
+                                                               request.get('return_fields'))
+            # end read created records completely
+            sent.append(request)
+        # end for each request
+        results = super(SQLProxyShotgunConnection, self).batch(sent)
+
+        changes = list()
+        pending = dict()
+        for index, (request, result) in enumerate(zip(requests, results)):
+            entity_type = request['entity_type']
+            request_type = request['request_type']
+            if not self._is_stored(entity_type):
+                continue
+            # end skip types we don't store
+            if request_type == 'create':
+                pending[(entity_type.lower(), result['id'])] = result
+                changes.append((entity_type, [result], list()))
+                results[index] = self._created_record(result, request['data'], request.get('return_fields'))
+            elif request_type == 'update':
+                record = self._updated_record(entity_type, request['entity_id'], request['data'], result, pending)
+                if record is not None:
+                    changes.append((entity_type, [record], list()))
+                # end handle known records
+            elif request_type == 'delete' and result:
+                pending.pop((entity_type.lower(), request['entity_id']), None)
+                changes.append((entity_type, list(), [request['entity_id']]))
+            # end handle request type
+        # end for each result
+        self._write_changes(changes)
+        return results
         
     ## -- End Shotgun Interface Overrides -- @}
     
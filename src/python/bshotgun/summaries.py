@@ -0,0 +1,283 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.summaries
+@brief Utilities to compute shotgun summaries, as returned by IShotgunConnection.summarize(), in memory
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = ['normalize_summary_fields', 'normalize_grouping', 'SummaryGroup', 'summarize_records']
+
+from .filters import (_comparable,
+                      _sort_key)
+
+
+# -------------------------
+## @name Constants
+# @{
+
+## All summary types we support
+summary_types = ('record_count', 'count', 'sum', 'average', 'minimum', 'maximum',
+                 'percentage', 'status_percentage', 'checked', 'unchecked')
+
+## Maps alternative names of summary types to the ones in summary_types
+summary_type_aliases = {
+    'min' : 'minimum',
+    'max' : 'maximum',
+    'earliest' : 'minimum',
+    'latest' : 'maximum',
+}
+
+## Summary types which need a 'value' to compare field values with
+valued_summary_types = ('percentage', 'status_percentage')
+
+## Grouping types we support
+grouping_types = ('exact', )
+
+## -- End Constants -- @}
+
+
+# ==============================================================================
+## @name Normalization
+# ------------------------------------------------------------------------------
+## @{
+
+def normalize_summary_fields(summary_fields):
+    """@return a list of (field_name, summary_type, value) tuples from the given summary fields
+    @param summary_fields a list of dicts like {'field' : 'id', 'type' : 'count'}, as passed to
+    IShotgunConnection.summarize(). Percentages also need a 'value'
+    @throws ValueError if a summary is malformed or of an unsupported type"""
+    out = list()
+    for item in summary_fields:
+        field_name = item.get('field')
+        summary_type = summary_type_aliases.get(item.get('type'), item.get('type'))
+        if not field_name or summary_type not in summary_types:
+            raise ValueError("Invalid or unsupported summary: %r" % (item,))
+        # end check summary
+        if summary_type in valued_summary_types and 'value' not in item:
+            raise ValueError("Summary needs a 'value': %r" % (item,))
+        # end check value
+        out.append((field_name, summary_type, item.get('value')))
+    # end for each item
+    return out
+
+
+def normalize_grouping(grouping):
+    """@return a list of (field_name, descending) tuples from the given grouping
+    @param grouping a list of dicts like {'field' : 'sg_status_list', 'type' : 'exact', 'direction' : 'asc'},
+    or None
+    @throws ValueError if a grouping is malformed or of an unsupported type"""
+    out = list()
+    for item in grouping or list():
+        field_name = item.get('field')
+        direction = item.get('direction', 'asc')
+        if not field_name or item.get('type', 'exact') not in grouping_types or direction not in ('asc', 'desc'):
+            raise ValueError("Invalid or unsupported grouping: %r" % (item,))
+        # end check grouping
+        out.append((field_name, direction == 'desc'))
+    # end for each item
+    return out
+
+## -- End Normalization -- @}
+
+
+def _value_key(value):
+    """@return a key for the given value, which is equal for values shotgun considers equal"""
+    if isinstance(value, dict):
+        return (value.get('type'), value.get('id'))
+    elif isinstance(value, list):
+        return tuple(_value_key(v) for v in value)
+    # end handle links
+    return _comparable(value)
+
+
+def _percentage(count, record_count):
+    """@return count in percent of record_count, as integer"""
+    if not record_count:
+        return 0
+    return int(round(100.0 * count / record_count))
+
+
+class SummaryGroup(object):
+    """Accumulates the summaries of a group of records, and keeps its sub-groups.
+
+    Summaries can either be computed from records passed to add(), or be set directly with set_summaries(),
+    if they were computed elsewhere, like in a database."""
+    __slots__ = (
+                    '_summary_fields', # normalized summary fields
+                    '_value',          # the value of the field we group by
+                    '_record_count',   # amount of records we have seen
+                    '_states',         # per-summary state, in order of _summary_fields
+                    '_summaries',      # summaries set from the outside, or None
+                    '_groups'          # group_key -> SummaryGroup
+                )
+
+    def __init__(self, summary_fields, value = None):
+        """Initialize this instance
+        @param summary_fields normalized summary fields, see normalize_summary_fields()
+        @param value the value of the field this group represents"""
+        self._summary_fields = summary_fields
+        self._value = value
+        self._record_count = 0
+        self._states = [None] * len(summary_fields)
+        self._summaries = None
+        self._groups = dict()
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    @classmethod
+    def _accumulate(cls, summary_type, summary_value, state, value):
+        """@return the new state of a summary of the given type, after seeing the given value"""
+        if summary_type in ('count', 'sum', 'average', 'checked', 'percentage', 'status_percentage'):
+            count, total = state or (0, 0)
+            if summary_type == 'count':
+                count += value is not None and value != [] and value != ''
+            elif summary_type in ('sum', 'average'):
+                if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                    count += 1
+                    total += value
+                # end handle numbers
+            elif summary_type == 'checked':
+                count += value is True
+            else:
+                count += _value_key(value) == _value_key(summary_value)
+            # end handle type
+            return count, total
+        # end handle counters
+
+        # minimum and maximum
+        if value is None:
+            return state
+        # end ignore empty values
+        key = _sort_key(value)
+        if state is None or (summary_type == 'minimum' and key < state[0]) or \
+                            (summary_type == 'maximum' and key > state[0]):
+            return key, value
+        # end handle new extreme
+        return state
+
+    def _summary(self, summary_type, state):
+        """@return the final value of a summary of the given type with the given state"""
+        if summary_type == 'record_count':
+            return self._record_count
+        elif summary_type in ('minimum', 'maximum'):
+            return state and state[1]
+        # end handle non-counters
+        count, total = state or (0, 0)
+        if summary_type in ('count', 'checked'):
+            return count
+        elif summary_type == 'unchecked':
+            return self._record_count - self._summary('checked', state)
+        elif summary_type == 'sum':
+            return total
+        elif summary_type == 'average':
+            if not count:
+                return None
+            return float(total) / count
+        return _percentage(count, self._record_count)
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def add(self, record):
+        """Accumulate the given record into our summaries
+        @return self"""
+        self._record_count += 1
+        states = self._states
+        accumulate = self._accumulate
+        for index, (field_name, summary_type, summary_value) in enumerate(self._summary_fields):
+            if summary_type == 'record_count':
+                continue
+            # end skip counters
+            if summary_type == 'unchecked':
+                summary_type = 'checked'
+            # end unchecked is computed from checked
+            states[index] = accumulate(summary_type, summary_value, states[index], record.get(field_name))
+        # end for each summary
+        return self
+
+    def set_summaries(self, summaries):
+        """Set our summaries to the given ones, instead of computing them from records
+        @param summaries a dict of field_name -> summary value
+        @return self"""
+        self._summaries = summaries
+        return self
+
+    def group(self, value):
+        """@return the sub-group for the given value, which is created if needed
+        @throws ValueError if the value cannot be grouped by"""
+        if isinstance(value, list):
+            raise ValueError("Cannot group by multi-entity or list fields")
+        # end handle lists
+        key = _value_key(value)
+        try:
+            return self._groups[key]
+        except KeyError:
+            group = self._groups[key] = type(self)(self._summary_fields, value)
+            return group
+        # end handle new groups
+
+    def summaries(self):
+        """@return a dict of field_name -> summary value"""
+        if self._summaries is not None:
+            return self._summaries
+        # end handle summaries set from the outside
+        return dict((field_name, self._summary(summary_type, state))
+                    for (field_name, summary_type, value), state in zip(self._summary_fields, self._states))
+
+    def result(self, grouping):
+        """@return a dict as returned by IShotgunConnection.summarize(), with 'summaries' and 'groups'
+        @param grouping the normalized grouping which was used to fill our sub-groups"""
+        return {'summaries' : self.summaries(), 'groups' : self._group_results(grouping)}
+
+    def _group_results(self, grouping):
+        """@return a list of dicts, one per sub-group, sorted according to the given grouping"""
+        if not grouping:
+            return list()
+        # end handle leafs
+        groups = sorted(self._groups.values(), key = lambda group: _sort_key(group._value),
+                        reverse = grouping[0][1])
+        out = list()
+        for group in groups:
+            value = group._value
+            name = value
+            if isinstance(value, dict):
+                name = value.get('name')
+            # end handle links
+            if name is None:
+                name = ''
+            # end handle empty groups
+            result = {'group_name' : name, 'group_value' : value, 'summaries' : group.summaries()}
+            if len(grouping) > 1:
+                result['groups'] = group._group_results(grouping[1:])
+            # end handle nested groups
+            out.append(result)
+        # end for each group
+        return out
+
+    ## -- End Interface -- @}
+
+# end class SummaryGroup
+
+
+def summarize_records(records, summary_fields, grouping = None):
+    """@return a dict as returned by IShotgunConnection.summarize(), computed from the given records
+    @param records an iterable of records, which need all fields used in summary_fields and grouping.
+    It is consumed only once, records are not kept.
+    @param summary_fields and grouping see IShotgunConnection.summarize()
+    @throws ValueError if summaries or groupings are not supported"""
+    summary_fields = normalize_summary_fields(summary_fields)
+    grouping = normalize_grouping(grouping)
+    root = SummaryGroup(summary_fields)
+    for record in records:
+        group = root.add(record)
+        for field_name, descending in grouping:
+            group = group.group(record.get(field_name)).add(record)
+        # end for each grouping level
+    # end for each record
+    return root.result(grouping)
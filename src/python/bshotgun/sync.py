@@ -0,0 +1,422 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.sync
+@brief Utilities to keep an SQL cache in sync with shotgun, by following its event log, or by asking for 
+records which were updated recently
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = ['EventLogSync', 'DeltaRefresh', 'parse_event', 'EVENT_NEW', 'EVENT_CHANGE', 'EVENT_RETIREMENT', 
+           'EVENT_REVIVAL']
+
+import sys
+from datetime import timedelta
+from collections import OrderedDict
+
+from .fetch import iter_entities
+from .filters import (utc,
+                      _comparable)
+
+
+# -------------------------
+## @name Constants
+# @{
+
+## Name of the shotgun type keeping all events
+EVENT_LOG_TYPE = 'EventLogEntry'
+
+## Key in the meta table of the SQL cache which stores the id of the last event that was applied
+EVENT_LOG_KEY = 'sync:event_log_id'
+
+## Key in the meta table of the SQL cache which stores the ids of events below the high-water mark which were
+## not seen yet, separated by spaces
+EVENT_LOG_GAPS_KEY = 'sync:event_log_gaps'
+
+## Prefix of the keys in the meta table of the SQL cache which store the latest 'updated_at' value of the 
+## records of a table, followed by its name
+UPDATED_AT_KEY_PREFIX = 'sync:updated_at:'
+
+## Format of the 'updated_at' values we store, always in UTC
+UPDATED_AT_FORMAT = '%Y-%m-%d %H:%M:%SZ'
+
+## Fields of event log entries we need to know which entity changed
+event_fields = ['id', 'event_type', 'entity', 'meta', 'attribute_name']
+
+## Actions of events, which are the last part of their event_type, like 'Shotgun_Shot_Change'
+EVENT_NEW = 'New'
+EVENT_CHANGE = 'Change'
+EVENT_RETIREMENT = 'Retirement'
+EVENT_REVIVAL = 'Revival'
+
+## Actions of events after which an entity exists, and must be read again
+refresh_actions = (EVENT_NEW, EVENT_CHANGE, EVENT_REVIVAL)
+
+## -- End Constants -- @}
+
+
+def parse_event(event):
+    """@return a tuple of (entity_type, entity_id, action) of the entity the given event is about, or None if
+    it is not about an entity of shotgun, like events of the API or of applications
+    @param event an EventLogEntry record with at least the fields 'event_type', 'entity' and 'meta'"""
+    parts = (event.get('event_type') or '').split('_')
+    if len(parts) < 3 or parts[0] != 'Shotgun' or parts[-1] not in refresh_actions + (EVENT_RETIREMENT, ):
+        return None
+    # end handle unrelated events
+    entity_type = '_'.join(parts[1:-1])
+
+    # retired entities are not linked anymore, but the meta data still knows them
+    meta = event.get('meta') or dict()
+    entity_id = meta.get('entity_id')
+    if entity_id is None:
+        entity = event.get('entity') or dict()
+        entity_id = entity.get('id')
+    # end handle entity
+    if entity_id is None:
+        return None
+    # end handle events without entity
+    return meta.get('entity_type') or entity_type, entity_id, parts[-1]
+
+
+class EventLogSync(object):
+    """Applies all changes shotgun recorded in its event log to an SQL cache.
+
+    Events newer than a high-water mark, which is kept in the SQL cache, are read page by page. All entities
+    they are about are read again with batched 'id in' queries, and written into the SQL cache. Retired
+    entities, and the ones which can't be read anymore, are removed.
+
+    Events get their id when they are created, but may be committed out of order. Ids below the mark which 
+    weren't seen are remembered as gaps, and events filling them are applied by one of the next syncs, as 
+    long as they are within overlap_events of the mark. Events which were applied already are skipped.
+
+    This way, keeping the cache up to date costs only a few requests per sync(), depending on the amount of
+    changes, instead of reading everything again."""
+    __slots__ = (
+                    '_source',  # the shotgun connection to read events and entities from
+                    '_target'   # the SQLProxyShotgunConnection to write changes to
+                )
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## Amount of events we read with each request
+    events_per_page = 500
+
+    ## Maximum amount of ids we put into a single 'id in' query when reading changed entities
+    ids_per_query = 500
+
+    ## Amount of event ids below the high-water mark in which we look for events that were committed late
+    overlap_events = 100
+
+    ## -- End Configuration -- @}
+
+    def __init__(self, source, target):
+        """Initialize this instance
+        @param source a shotgun connection, like a ProxyShotgunConnection
+        @param target an SQLProxyShotgunConnection whose database was initialized from source"""
+        self._source = source
+        self._target = target
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _read_events(self, after_id):
+        """@return a list of up to events_per_page events with an id larger than the given one, by id"""
+        return self._source.find(EVENT_LOG_TYPE, [['id', 'greater_than', after_id]], event_fields,
+                                 [{'field_name' : 'id', 'direction' : 'asc'}], limit=self.events_per_page)
+
+    def _gaps(self):
+        """@return a set of ids of events below the high-water mark which were not seen yet"""
+        value = self._target.meta_value(EVENT_LOG_GAPS_KEY)
+        return set(int(event_id) for event_id in (value or '').split())
+
+    def _changes(self, events):
+        """@return an OrderedDict of type_name -> OrderedDict(entity_id -> exists) of all entities of types we
+        store which the given events are about. exists is False if the entity was retired by the last event
+        about it"""
+        type_names = dict((type_name.lower(), type_name) for type_name in self._target.type_names())
+        out = OrderedDict()
+        for event in events:
+            info = parse_event(event)
+            if info is None:
+                continue
+            # end skip unrelated events
+            entity_type, entity_id, action = info
+            if entity_type.lower() not in type_names:
+                continue
+            # end skip types we don't store
+            out.setdefault(entity_type, OrderedDict())[entity_id] = action in refresh_actions
+        # end for each event
+        return out
+
+    def _apply(self, entity_type, changes, stats):
+        """Read all existing entities of the given changes from shotgun, and write them into our target.
+        All others are removed from it.
+        @param changes an OrderedDict of entity_id -> exists
+        @param stats a dict of statistics to update"""
+        target = self._target
+        fields = target.field_names(entity_type)
+        ids = [entity_id for entity_id, exists in changes.iteritems() if exists]
+        removed = set(entity_id for entity_id, exists in changes.iteritems() if not exists)
+        for start in xrange(0, len(ids), self.ids_per_query):
+            chunk = ids[start:start + self.ids_per_query]
+            records = self._source.find(entity_type, [['id', 'in', chunk]], fields)
+            stats['requests'] += 1
+            target.store_records(entity_type, records)
+            stats['stored'] += len(records)
+            # entities which changed, but were retired or deleted since
+            removed.update(set(chunk) - set(record['id'] for record in records))
+        # end for each chunk of ids
+        target.remove_records(entity_type, removed)
+        stats['removed'] += len(removed)
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    @classmethod
+    def latest_event_id(cls, connection):
+        """@return the id of the latest event in the event log of the given shotgun connection, or 0 if there
+        is none
+        @param cls
+        @param connection a shotgun connection"""
+        event = connection.find_one(EVENT_LOG_TYPE, list(), ['id'], [{'field_name' : 'id', 'direction' : 'desc'}])
+        return event['id'] if event else 0
+
+    def high_water_mark(self):
+        """@return the id of the last event which was applied to our target, or None if it was never
+        synchronized"""
+        value = self._target.meta_value(EVENT_LOG_KEY)
+        return int(value) if value else None
+
+    def mark(self, event_id = None):
+        """Set the high-water mark of our target, which makes the next sync() apply only newer events.
+        Use it right before the SQL cache is initialized, to be sure changes made while reading are applied.
+        @param event_id the id of the last event the target is known to contain, or None to use the
+        latest event
+        @return the id that was set"""
+        if event_id is None:
+            event_id = self.latest_event_id(self._source)
+        # end handle latest event
+        self._target.set_meta_value(EVENT_LOG_GAPS_KEY, '')
+        self._target.set_meta_value(EVENT_LOG_KEY, str(event_id))
+        return event_id
+
+    def sync(self, max_events = None):
+        """Apply all events newer than the high-water mark to our target, and move the mark forward.
+        The mark is stored after each page of events, which makes an interrupted sync continue where it left
+        off. If there was no mark, it is set to the latest event, without applying anything.
+        Events below the mark which weren't seen by previous syncs are applied as well.
+        @param max_events if not None, the maximum amount of events to apply. The remaining ones are applied
+        with the next call
+        @return a dict with the amount of 'events' read, 'stored' and 'removed' entities, and of 'requests'
+        made to shotgun"""
+        stats = {'events' : 0, 'stored' : 0, 'removed' : 0, 'requests' : 0}
+        last_id = self.high_water_mark()
+        if last_id is None:
+            self.mark()
+            stats['requests'] += 1
+            return stats
+        # end handle first sync
+
+        gaps = self._gaps()
+        after_id = min(gaps) - 1 if gaps else last_id
+        while max_events is None or stats['events'] < max_events:
+            page = self._read_events(after_id)
+            stats['requests'] += 1
+            if not page:
+                break
+            # end handle no more events
+            after_id = page[-1]['id']
+            events = [event for event in page if event['id'] > last_id or event['id'] in gaps]
+            if max_events is not None:
+                events = events[:max_events - stats['events']]
+            # end handle maximum
+            if events:
+                for entity_type, changes in self._changes(events).iteritems():
+                    self._apply(entity_type, changes, stats)
+                # end for each changed type
+                stats['events'] += len(events)
+
+                seen = set(event['id'] for event in events)
+                mark = max(last_id, max(seen))
+                gaps = (gaps - seen) | set(xrange(max(last_id, mark - self.overlap_events) + 1, mark + 1)) - seen
+                gaps = set(event_id for event_id in gaps if event_id > mark - self.overlap_events)
+                # store gaps first - if we are interrupted, the events are just applied again
+                self._target.set_meta_value(EVENT_LOG_GAPS_KEY, ' '.join(str(event_id) for event_id in sorted(gaps)))
+                if mark != last_id:
+                    last_id = mark
+                    self._target.set_meta_value(EVENT_LOG_KEY, str(last_id))
+                # end handle new mark
+            # end handle events to apply
+            if len(page) < self.events_per_page:
+                break
+            # end handle last page
+        # end while there are events
+        if stats['events']:
+            sys.stderr.write("Applied %i events, stored %i and removed %i records with %i requests\n"
+                             % (stats['events'], stats['stored'], stats['removed'], stats['requests']))
+        # end report
+        return stats
+
+    ## -- End Interface -- @}
+
+# end class EventLogSync
+
+
+class DeltaRefresh(object):
+    """Applies all changes made in shotgun to an SQL cache, without using the event log.
+
+    Each type is queried for records with an 'updated_at' value newer than the latest one the SQL cache knows,
+    and those are written into it. Deleted, retired and revived records are found by comparing the amount of 
+    records in shotgun and in the cache, along with the sum of their ids, and only if they differ, by comparing
+    their ids. Changes which leave both the same, like retiring two records while reviving two others whose 
+    ids add up to the same sum, are not found.
+
+    This way, the cost of a refresh depends on the amount of changes, not on the amount of records. Types 
+    without an 'updated_at' field are skipped."""
+    __slots__ = (
+                    '_source',  # the shotgun connection to read entities from
+                    '_target'   # the SQLProxyShotgunConnection to write changes to
+                )
+
+    # -------------------------
+    ## @name Configuration
+    # @{
+
+    ## Amount of records we read with each request
+    records_per_page = 500
+
+    ## Maximum amount of ids we put into a single 'id in' query when reading missing records
+    ids_per_query = 500
+
+    ## Records updated this many seconds before the latest known update are read again. As shotgun stores
+    ## 'updated_at' in seconds, this catches updates made within the same second, after we read
+    overlap_seconds = 1
+
+    ## -- End Configuration -- @}
+
+    def __init__(self, source, target):
+        """Initialize this instance
+        @param source a shotgun connection, like a ProxyShotgunConnection
+        @param target an SQLProxyShotgunConnection whose database was initialized from source"""
+        self._source = source
+        self._target = target
+
+    # -------------------------
+    ## @name Utilities
+    # @{
+
+    def _id_checksum(self, connection, type_name):
+        """@return a tuple of the amount of records of the given type the given connection has, and the sum of 
+        their ids. The type must have an 'updated_at' field"""
+        # summaries are keyed by field, the record count may use any of them
+        res = connection.summarize(type_name, list(), [{'field' : 'updated_at', 'type' : 'record_count'}, 
+                                                       {'field' : 'id', 'type' : 'sum'}])
+        return res['summaries']['updated_at'], res['summaries']['id'] or 0
+
+    def _store(self, type_name, records, latest, stats):
+        """Write the given records into our target, and update stats accordingly
+        @param latest the latest 'updated_at' value known so far as naive UTC datetime, or None
+        @return the latest of the given value and the 'updated_at' values of the given records, or None"""
+        self._target.store_records(type_name, records)
+        stats['stored'] += len(records)
+        values = [_comparable(record['updated_at']) for record in records if record.get('updated_at')]
+        if latest is not None:
+            values.append(latest)
+        # end handle known value
+        return max(values) if values else None
+
+    def _refresh_type(self, type_name, stats):
+        """Read all records of the given type which changed since the last refresh, and remove the ones which
+        were deleted
+        @param stats a dict of statistics to update"""
+        target = self._target
+        fields = target.field_names(type_name)
+        if 'updated_at' not in fields:
+            sys.stderr.write("Skipping '%s', which has no 'updated_at' field\n" % type_name)
+            return
+        # end skip types we can't refresh
+
+        latest = self.high_water_mark(type_name)
+        if latest is None:
+            # the first refresh continues where init_database() left off
+            latest = target.summarize(type_name, list(), [{'field' : 'updated_at', 'type' : 'maximum'}])
+            latest = latest['summaries']['updated_at']
+            latest = latest and _comparable(latest)
+        # end handle first refresh
+        filters = None
+        if latest is not None:
+            since = latest - timedelta(seconds = self.overlap_seconds)
+            filters = [['updated_at', 'greater_than', since.replace(tzinfo = utc)]]
+        # end handle types without values
+
+        records = list()
+        for record in iter_entities(self._source, type_name, fields, self.records_per_page, None, filters):
+            records.append(record)
+            if len(records) == self.records_per_page:
+                stats['requests'] += 1
+                latest = self._store(type_name, records, latest, stats)
+                records = list()
+            # end store page
+        # end for each changed record
+        stats['requests'] += 1
+        latest = self._store(type_name, records, latest, stats)
+
+        # find deleted records, and records which were revived without changing them
+        stats['requests'] += 1
+        if self._id_checksum(self._source, type_name) != self._id_checksum(target, type_name):
+            ids = set()
+            for record in iter_entities(self._source, type_name, ['id'], self.records_per_page):
+                ids.add(record['id'])
+            # end for each existing record
+            stats['requests'] += len(ids) // self.records_per_page + 1
+            cached_ids = set(record['id'] for record in target.find(type_name, list(), ['id']))
+
+            missing = sorted(ids - cached_ids)
+            for start in xrange(0, len(missing), self.ids_per_query):
+                records = self._source.find(type_name, [['id', 'in', missing[start:start + self.ids_per_query]]],
+                                            fields)
+                stats['requests'] += 1
+                latest = self._store(type_name, records, latest, stats)
+            # end for each chunk of missing records
+            removed = cached_ids - ids
+            target.remove_records(type_name, removed)
+            stats['removed'] += len(removed)
+        # end handle different records
+
+        if latest is not None:
+            target.set_meta_value(UPDATED_AT_KEY_PREFIX + type_name.lower(), latest.strftime(UPDATED_AT_FORMAT))
+        # end store high-water mark
+
+    ## -- End Utilities -- @}
+
+    # -------------------------
+    ## @name Interface
+    # @{
+
+    def high_water_mark(self, type_name):
+        """@return the latest 'updated_at' value of the records of the given type as of the last refresh, as
+        naive datetime in UTC, or None if the type was never refreshed"""
+        value = self._target.meta_value(UPDATED_AT_KEY_PREFIX + type_name.lower())
+        return _comparable(unicode(value)) if value else None
+
+    def refresh(self, type_names):
+        """Apply all changes made to records of the given types since the last refresh to our target
+        @param type_names an iterable of shotgun type names, like the ones used to initialize our target
+        @return a dict with the amount of 'stored' and 'removed' records, and of 'requests' made to shotgun"""
+        stats = {'stored' : 0, 'removed' : 0, 'requests' : 0}
+        for type_name in type_names:
+            self._refresh_type(type_name, stats)
+        # end for each type
+        sys.stderr.write("Stored %i and removed %i records with %i requests\n"
+                         % (stats['stored'], stats['removed'], stats['requests']))
+        return stats
+
+    ## -- End Interface -- @}
+
+# end class DeltaRefresh
@@ -7,7 +7,8 @@
 @copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
 """
 __all__ = ['ShotgunTestDatabase', 'ReadOnlyTestSQLProxyShotgunConnection', 'ShotgunTestCase', 
-           'TestShotgunTypeFactory', 'ShotgunConnectionMock']
+           'TestShotgunTypeFactory', 'ProjectShotTypeFactory', 'ShotgunConnectionMock', 'temporary_directory',
+           'temporary_database']
 
 import json
 import marshal
@@ -15,14 +16,23 @@ import time
 import sys
 import os
 import zlib
+import shutil
+import tempfile
 from copy import deepcopy
+from contextlib import contextmanager
 
 
 from butility.tests import TestCase
 from butility import Path
 from bshotgun import (ProxyShotgunConnection,
                       SQLProxyShotgunConnection,
-                      ProxyMeta)
+                      ProxyMeta,
+                      FilterEvaluator,
+                      normalize_filters,
+                      normalize_order,
+                      sort_records,
+                      summarize_records,
+                      LAYOUT_BLOB)
 from bshotgun.orm import ShotgunTypeFactory
 from mock import Mock
 
@@ -35,6 +45,27 @@ def dataset_tree(sample_name):
     return ShotgunTestCase.sample_root(sample_name)
 
 
+@contextmanager
+def temporary_directory():
+    """@return a context manager yielding the path to a new directory, which is removed along with its contents
+    once the context is left"""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        yield tmp_dir
+    finally:
+        shutil.rmtree(tmp_dir)
+    # end cleanup
+
+
+@contextmanager
+def temporary_database(name):
+    """@return a context manager yielding the sqlalchemy URL of a new sqlite database file with the given name,
+    which is removed once the context is left"""
+    with temporary_directory() as tmp_dir:
+        yield 'sqlite:///' + os.path.join(tmp_dir, '%s.sqlite' % name)
+    # end with directory
+
+
 class ShotgunTestCase(TestCase):
     """Base for all bshotgun test cases"""
     __slots__ = ()
@@ -85,6 +116,19 @@ class TestShotgunTypeFactory(ShotgunTypeFactory):
 # end class TestShotgunTypeFactory
 
 
+class ProjectShotTypeFactory(TestShotgunTypeFactory):
+    """A TestShotgunTypeFactory which only provides Projects and Shots, to keep test databases small"""
+    __slots__ = ()
+
+    ## The names of the types we provide
+    TYPE_NAMES = ('Project', 'Shot')
+
+    def type_names(self):
+        return self.TYPE_NAMES
+
+# end class ProjectShotTypeFactory
+
+
 class ShotgunTestDatabase(object):
     """A test database that can be used for testing read-only, but that can be writte in memory.
     Every time a value is queried, it will be deserialized from disk.
@@ -249,15 +293,17 @@ class ReadOnlyProxyMeta(ProxyMeta):
 class ReadOnlyTestSQLProxyShotgunConnection(SQLProxyShotgunConnection):
     """A front-end to the normal SQLProxyShotgunConnection which simply skips writes 
     and helps to auto-generate it's underlying SQL database"""
-    __slots__ = ('_sample_name')
+    __slots__ = ('_sample_name', '_layout')
     __metaclass__ = ReadOnlyProxyMeta
     
     
-    def __init__(self, db_url = None, sample_name=DEFAULT_DB_SAMPLE):
-        """Initialize ourselves, making sure we read from our own database, if needed."""
+    def __init__(self, db_url = None, sample_name=DEFAULT_DB_SAMPLE, layout=LAYOUT_BLOB):
+        """Initialize ourselves, making sure we read from our own database, if needed.
+        @param layout the table layout to use when building the database"""
         # If we don't yet have a test-database, rebuild it automatically
         # Must happen before super class is initialized, as it will create a base file right away
         self._sample_name = sample_name
+        self._layout = layout
         if not self.has_database():
             self.rebuild_database()
         # end handle rebuild on demand
@@ -282,6 +328,8 @@ class ReadOnlyTestSQLProxyShotgunConnection(SQLProxyShotgunConnection):
         
     def _sqlite_rodb_path(self):
         """@return a path to the designated sqlite database"""
+        if self._layout != LAYOUT_BLOB:
+            return ShotgunTestCase.fixture_path('sqlite.%s.%s.db_tmp' % (self._sample_name, self._layout))
         return ShotgunTestCase.fixture_path('sqlite.%s.db_tmp' % self._sample_name)
     
     # -------------------------
@@ -303,7 +351,8 @@ class ReadOnlyTestSQLProxyShotgunConnection(SQLProxyShotgunConnection):
         fac = TestShotgunTypeFactory(sample_name=self._sample_name)
         fetcher = ShotgunTestDatabase().records
         
-        return type(self)(SQLProxyShotgunConnection.init_database(self._sqlite_rodb_url(), fac, fetcher)._meta)
+        meta = SQLProxyShotgunConnection.init_database(self._sqlite_rodb_url(), fac, fetcher, self._layout)._meta
+        return type(self)(meta, sample_name=self._sample_name, layout=self._layout)
     
     ## -- End Test Database Initialization -- @}
 
@@ -316,7 +365,7 @@ class ShotgunConnectionMock(Mock):
     reproduce exceptions as created by the actual implementation
     @note this implementation is based on the sgtk implementation at 
     https://github.com/shotgunsoftware/tk-core/blob/master/tests/python/tank_test/tank_test_base.py#L343"""
-    _slots_ = ('_db', '_schema', '_server_info')
+    _slots_ = ('_db', '_retired', '_schema', '_server_info')
 
     def __init__ (self, *args, **kwargs):
         super(ShotgunConnectionMock, self).__init__(*args, **kwargs)
@@ -345,109 +394,80 @@ class ShotgunConnectionMock(Mock):
         self.set_entities(nd)
         return nd
 
+    def delete(self, entity_type, entity_id):
+        """Retire the given entity
+        @return True if it existed"""
+        entity = self._db.pop((entity_type, entity_id), None)
+        if entity is None:
+            return False
+        # end handle unknown entities
+        self._retired[(entity_type, entity_id)] = entity
+        return True
+
+    def revive(self, entity_type, entity_id):
+        """Revive the given retired entity
+        @return True if it was retired"""
+        entity = self._retired.pop((entity_type, entity_id), None)
+        if entity is None:
+            return False
+        # end handle unknown entities
+        self._db[(entity_type, entity_id)] = entity
+        return True
+
+    def batch(self, requests):
+        """@return a list with the result of each of the given create, update or delete requests"""
+        results = list()
+        for request in requests:
+            request_type = request['request_type']
+            if request_type == 'create':
+                results.append(self.create(request['entity_type'], request['data'], request.get('return_fields')))
+            elif request_type == 'update':
+                self.update(request['entity_type'], request['entity_id'], request['data'])
+                results.append(deepcopy(self._db[(request['entity_type'], request['entity_id'])]))
+            elif request_type == 'delete':
+                results.append(self.delete(request['entity_type'], request['entity_id']))
+            else:
+                raise AssertionError("Invalid request type: %s" % request_type)
+            # end handle request type
+        # end for each request
+        return results
+
     base_url = 'http://nointernet.intern'
 
-    def find_one(self, entity_type, filters, fields=None, *args, **kws):
-        """Version of find_one which only returns values when filtered by id
-        @return all entity information, not filtered by field"""
-        for (type, id), entity in self._db.items():
-            if type != entity_type:
-                continue
-            # now check filters
-            
-            # convert complex into new style
-            if isinstance(filters, dict):
-                new_filters = list()
-                if filters['logical_operator'] != 'and':
-                    raise Exception('unsupported sg mock find_one filter %s' % filters)
-                for c in filters['conditions']:
-                    if c['relation'] != 'is':
-                        raise Exception('Unsupported sg mock find one filter %s' % filters)
-                    field = c['path']
-                    value = c['values'][0]
-                    if len(c['values']) > 1:
-                        raise Exception('Unsupported sg mock find one filter %s' % filters)
-                    new_filters.append( [field, 'is', value])
-                # end for each condition
-                filters = new_filters
-            # end convert dicts to lists
-            
-
-            found = True
-            for f in filters:
-                # assume operator is equals: e.g
-                # filter = ["field", "is", "value"]
-                field = f[0]
-                if f[1] != "is":
-                    raise Exception('Unsupported sg mock find one filter %s' % filters)
-                value = f[2]
-
-                # now search through entity to see if we got it
-                if field in entity and entity[field] == value:
-                    # it is a match! Keep going...
-                    pass
-                else:
-                    # no match!
-                    found = False
-                    break
-                # end 
-            # end for each filter
-                
-            # did we find it?
-            if found:
-                return deepcopy(entity)
-            # end bail out early
-        # end for each piece of entity information
-        
-        # no match
-        return None            
+    def find_one(self, entity_type, filters, fields=None, order=None, filter_operator='all', *args, **kws):
+        """@return the first entity matching the given filters, or None
+        @note all entity information is returned, it is not filtered by field"""
+        res = self.find(entity_type, filters, fields, order, filter_operator, limit=1)
+        return res and res[0] or None
 
-    def find(self, entity_type, filters, *args, **kws):
+    def find(self, entity_type, filters, fields=None, order=None, filter_operator='all', limit=0, 
+             retired_only=False, page=0):
         """@return all matching entries for specified type. 
-        Filters are only partially implemented, which could return too much"""
-        results = [self._db[key] for key in self._db if key[0] == entity_type]
-        
-        # support [['id', 'in', 23, 34]]
-        if isinstance(filters, list) and len(filters) == 1:
-            # we have a [[something]] structure
-            inner_filter = filters[0]
-            if isinstance(inner_filter, list) and \
-               len(inner_filter) > 2 and \
-               inner_filter[0] == 'id' and \
-               inner_filter[1] == 'in':
-                all_items_of_type = [self._db[key] for key in self._db if key[0] == entity_type]
-                ids_to_find = inner_filter[2:]
-                matches = []
-                for i in all_items_of_type:
-                    if i['id'] in ids_to_find:
-                        matches.append(i)
-                
-                # assign to final matches structure
-                results = matches
-        # end handle filter type
-            
-        # support dict style with 'is' relation
-        if isinstance(filters, dict):
-            for sg_filter in filters.get('conditions', list()):
-                if sg_filter['relation'] != 'is':
-                    continue
-                    
-                if sg_filter['values'] == [None] and sg_filter['path'] == 'id':
-                    # always return empty for this
-                    results = list()
-                
-                if isinstance(sg_filter['values'][0], (int, str)):
-                    # only handling simple string and number relations
-                    field_name = sg_filter['path']
-                    # filter only if value exists in mocked data (if field not there don't skip)
-                    results = [result for result in results 
-                                if result.get(field_name, sg_filter['values'][0]) in sg_filter['values']]
-                # end
-            # end for each filter condition
-        # end handle dict filter
+        Filters are evaluated just like shotgun would do it, deep-links are resolved using our database.
+        Order, limit and page are handled like shotgun does it.
+        @note all entity information is returned, it is not filtered by field"""
+        def resolve_link(link, field_name):
+            return self._db.get((link['type'], link['id']), dict()).get(field_name)
+        # end utility
+
+        matches = FilterEvaluator(normalize_filters(filters, filter_operator), resolve_link).matches
+        results = sort_records([entity for key, entity in self._db.items() 
+                                       if key[0] == entity_type and matches(entity)], normalize_order(order))
+        if page > 0:
+            limit = limit or len(results)
+            results = results[(page - 1) * limit:]
+        # end handle page
+        if limit:
+            results = results[:limit]
+        # end handle limit
 
         return deepcopy(results)
 
+    def summarize(self, entity_type, filters, summary_fields, filter_operator='all', grouping=None):
+        """@return summaries of all matching entities, computed like shotgun does it"""
+        return summarize_records(self.find(entity_type, filters, None, None, filter_operator), summary_fields,
+                                 grouping)
+
     def schema_field_read(self, entity_type, field_name):
         """@return the schema info dictionary for the given field of the entity type"""
         schema = self._schema[entity_type]
@@ -523,6 +543,7 @@ class ShotgunConnectionMock(Mock):
         """Clear all data in the database
         @return self"""
         self._db = dict()
+        self._retired = dict()
         self._schema = dict()
         self._server_info = dict(version=(4,3,9))
         return self
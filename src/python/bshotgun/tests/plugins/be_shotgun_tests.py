@@ -188,7 +188,7 @@ class ShotgunTestsBeSubCommand(CommandlineOverridesMixin, BeSubCommand, bapp.plu
                 db = SQLProxyShotgunConnection(db_url=args.source)
 
                 # type-names are lower case for sql tables, so we have to transform the value for comparison
-                args.fetcher = lambda tn: scrambler(db.find(tn, [], ['id']), db.type_names(), transformer = lambda v: v.lower())
+                args.fetcher = lambda tn: scrambler(db.find(tn, [], db.field_names(tn)), db.type_names(), transformer = lambda v: v.lower())
                 args.type_names = db.type_names()
             else:
                 # JSONZ
@@ -8,6 +8,7 @@
 """
 __all__ = []
 
+import threading
 from copy import deepcopy
 from .base import (ShotgunTestCase,
                    ShotgunConnectionMock)
@@ -49,6 +50,9 @@ class TestShotgun(ShotgunTestCase):
 
         assert sg.find_one('Project', [['id', 'is', 1]])
         assert len(sg.find('LocalStorage', list())) == 2
+        assert sg.find('LocalStorage', [['id', 'greater_than', 1]])[0]['id'] == 5
+        assert len(sg.find('LocalStorage', list(), limit=1)) == 1
+        assert sg.find_one('Project', [['id', 'is', 2]]) is None
 
         assert isinstance(sg.server_info, dict)
         assert isinstance(sg.schema_read(), dict)
@@ -65,5 +69,113 @@ class TestShotgun(ShotgunTestCase):
         assert newp is not p and 'id' in newp and 'type' in newp
         assert newp['id'] != p['id']
 
-    
-
+    def test_batching(self):
+        """Verify writes are collected and sent in chunked batch() calls, with results in order"""
+        sg = ShotgunConnectionMock()
+        sg.set_entities([{'type' : 'Shot', 'id' : shot_id, 'code' : 'shot%i' % shot_id} for shot_id in range(1, 6)])
+        batches = list()
+        send_batch = sg.batch
+        def batch(requests):
+            batches.append(len(requests))
+            return send_batch(requests)
+        # end recording batch
+        sg.batch = batch
+
+        conn = ProxyShotgunConnection(sg)
+        with conn.batching(max_size = 3) as writes:
+            for shot_id in range(1, 4):
+                assert conn.update('Shot', shot_id, {'code' : 'fixed'}) is None
+            # end for each shot
+            assert batches == [3], "a full batch is sent right away"
+            with conn.batching() as nested:
+                assert nested is writes
+                assert conn.delete('Shot', 4) is None
+            # end nested context
+            assert batches == [3], "nested contexts don't send anything"
+            conn.create('Shot', {'code' : 'new'}, ['code'])
+        # end batching
+        assert batches == [3, 2]
+        results = writes.results()
+        assert [r['id'] for r in results[:3]] == [1, 2, 3] and results[3] is True
+        assert results[4]['code'] == 'new' and results[4]['id'] not in range(1, 6)
+        assert sg.find_one('Shot', [['id', 'is', 3]])['code'] == 'fixed'
+
+        # unsent writes are dropped on error, and calls go through directly afterwards
+        try:
+            with conn.batching():
+                conn.update('Shot', 5, {'code' : 'dropped'})
+                raise ValueError("failure")
+            # end batching
+        except ValueError:
+            pass
+        # end handle error
+        assert sg.find_one('Shot', [['id', 'is', 5]])['code'] == 'shot5'
+        conn.update('Shot', 5, {'code' : 'direct'})
+        assert sg.find_one('Shot', [['id', 'is', 5]])['code'] == 'direct'
+        assert len(batches) == 2
+
+        # calls which are not collected send the collected ones first
+        with conn.batching() as writes:
+            conn.delete('Shot', 5)
+            assert conn.revive('Shot', 5), "the deletion was sent before"
+            conn.update('Shot', 5, {'code' : 'batched'})
+            results = conn.batch([{'request_type' : 'update', 'entity_type' : 'Shot', 'entity_id' : 5, 
+                                   'data' : {'code' : 'last'}}])
+            assert results[0]['code'] == 'last'
+        # end batching
+        assert batches[2:] == [1, 1, 1]
+        assert writes.results()[0] is True and writes.results()[1]['code'] == 'batched'
+        assert sg.find_one('Shot', [['id', 'is', 5]])['code'] == 'last'
+
+        # calls of other threads are not collected
+        with conn.batching():
+            thread = threading.Thread(target=conn.update, args=('Shot', 1, {'code' : 'threaded'}))
+            thread.start()
+            thread.join()
+            assert sg.find_one('Shot', [['id', 'is', 1]])['code'] == 'threaded'
+        # end batching
+        assert len(batches) == 5
+
+    def test_iter_find(self):
+        """Verify records are read page by page, and are the same find() returns"""
+        sg = ShotgunConnectionMock()
+        sg.set_entities([{'type' : 'Shot', 'id' : shot_id, 'code' : 'shot%i' % (shot_id % 4)} 
+                         for shot_id in range(1, 12)])
+        requests = list()
+        find = sg.find
+        def counting_find(*args, **kwargs):
+            requests.append(args)
+            return find(*args, **kwargs)
+        # end counting find
+        sg.find = counting_find
+
+        conn = ProxyShotgunConnection(sg)
+        by_code = [{'field_name' : 'code', 'direction' : 'desc'}, {'field_name' : 'id'}]
+        records_per_page = ProxyShotgunConnection.records_per_page
+        ProxyShotgunConnection.records_per_page = 3
+        try:
+            for args in ((['code'], ), (['code'], by_code), (['code'], by_code, 'all', 5),
+                         (['code'], [], 'any', 4)):
+                for filters in ([], [['code', 'is', 'shot1']], [['code', 'is', 'shot1'], ['code', 'is', 'shot2']]):
+                    del(requests[:])
+                    records = list(conn.iter_find('Shot', filters, *args))
+                    assert records == find('Shot', filters, *args)
+                    assert len(requests) <= len(records) // 3 + 1
+                # end for each filter
+            # end for each set of arguments
+        finally:
+            ProxyShotgunConnection.records_per_page = records_per_page
+        # end restore page size
+
+    def test_count(self):
+        """Verify entities are counted by shotgun"""
+        sg = ShotgunConnectionMock()
+        sg.set_entities([{'type' : 'Shot', 'id' : shot_id, 'code' : 'shot%i' % (shot_id % 4)} 
+                         for shot_id in range(1, 12)])
+        conn = ProxyShotgunConnection(sg)
+        assert conn.count('Shot', []) == 11
+        assert conn.count('Shot', [['code', 'is', 'shot1']]) == 3
+        assert conn.count('Shot', [['code', 'is', 'shot1'], ['code', 'is', 'shot2']], 'any') == 6
+        assert conn.count('Asset', []) == 0
+
+# end class TestShotgun
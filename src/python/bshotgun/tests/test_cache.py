@@ -0,0 +1,58 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.tests.test_cache
+@brief tests for bshotgun.cache
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = []
+
+from .base import ShotgunTestCase
+
+# test import *
+from bshotgun import *
+
+
+class TestCache(ShotgunTestCase):
+    __slots__ = ()
+
+    def test_record_cache(self):
+        """Verify records are kept in least-recently-used order, within our limits"""
+        cache = RecordCache(max_entries=2)
+        assert cache.get('shot', 1, ['code']) is None and cache.misses == 1
+
+        cache.put('shot', {'id' : 1, 'type' : 'Shot', 'code' : 'a', 'assets' : [{'type' : 'Asset', 'id' : 1}]})
+        rec = cache.get('shot', 1, ['code'])
+        assert rec == {'id' : 1, 'type' : 'Shot', 'code' : 'a'}, "only requested fields are returned"
+        assert cache.get('shot', 1, ['code', 'sg_status_list']) is None, "all fields must be known"
+        cache.put('shot', {'id' : 1, 'sg_status_list' : 'ip'})
+        assert cache.get('shot', 1, ['code', 'sg_status_list'])['sg_status_list'] == 'ip', "fields are merged"
+
+        rec = cache.get('shot', 1, ['assets'])
+        rec['assets'].append(None)
+        assert len(cache.get('shot', 1, ['assets'])['assets']) == 1, "copies are returned"
+
+        cache.put('shot', {'id' : 2})
+        assert cache.get('shot', 1, []) is not None
+        cache.put('asset', {'id' : 1})
+        assert cache.get('shot', 2, []) is None and cache.evictions == 1, "least recently used entries are dropped"
+        assert cache.get('shot', 1, []) is not None
+        stats = cache.stats()
+        assert stats['entries'] == 2 and stats['bytes'] > 0 and stats['hits'] == cache.hits
+
+        assert cache.invalidate('shot', [1, 3]).get('shot', 1, []) is None
+        assert cache.invalidate('asset').stats()['entries'] == 0 and cache.stats()['bytes'] == 0
+
+        cache = RecordCache(max_bytes=1, copy_records=False)
+        rec = {'id' : 1}
+        assert cache.put('shot', rec).get('shot', 1, []) is None, "byte limit is respected"
+        cache = RecordCache(copy_records=False)
+        rec = {'id' : 1, 'type' : 'Shot', 'code' : 'a', 'tags' : [1]}
+        shared = cache.put('shot', rec).get('shot', 1, ['tags'])
+        assert shared == {'id' : 1, 'type' : 'Shot', 'tags' : [1]}, "only requested fields are returned"
+        assert shared['tags'] is rec['tags'], "values may be shared"
+        cache.put('shot', {'id' : 1, 'code' : 'b'})
+        assert rec['code'] == 'a' and 'code' not in shared, "records handed out don't change"
+        assert cache.get('shot', 1, ['code', 'tags'])['code'] == 'b'
+        assert cache.invalidate().stats()['entries'] == 0
@@ -0,0 +1,109 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.tests.test_fetch
+@brief tests for bshotgun.fetch
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = []
+
+import gc
+
+from .base import (ShotgunTestCase,
+                   ShotgunConnectionMock)
+
+# test import *
+from bshotgun import *
+
+
+class TestFetch(ShotgunTestCase):
+    __slots__ = ()
+
+    def test_fetch(self):
+        """Verify entities are read completely and in order, sequentially and in parallel"""
+        sg = ShotgunConnectionMock()
+        counts = {'Shot' : 53, 'Asset' : 0, 'Project' : 3, 'Task' : 20}
+        for type_name, count in counts.iteritems():
+            # leave gaps in the ids, like retired entities do
+            sg.set_entities([{'type' : type_name, 'id' : i * 3 + 1, 'code' : '%s%i' % (type_name, i)}
+                             for i in xrange(count)])
+        # end for each type
+        ids = lambda records: [r['id'] for r in records]
+        expected = lambda type_name: ids(sg.find(type_name, [], ['id'], [{'field_name' : 'id'}]))
+        fields = lambda type_name: ['code']
+
+        for type_name in counts:
+            assert ids(iter_entities(sg, type_name, ['code'], 10)) == expected(type_name)
+        # end for each type
+
+        type_names = ['Shot', 'Asset', 'Project', 'Task']
+        for jobs in (1, 4):
+            fetcher = ParallelFetcher(lambda: sg, type_names, fields, jobs, records_per_page=7)
+            try:
+                for type_name in type_names:
+                    assert ids(fetcher(type_name)) == expected(type_name)
+                # end for each type
+                assert ids(fetcher('Shot')) == expected('Shot'), "types can be read again"
+            finally:
+                fetcher.close()
+            # end assure threads are stopped
+        # end for each amount of jobs
+
+        fetcher = ParallelFetcher(lambda: sg, type_names, fields, 2, records_per_page=7)
+        try:
+            records = list(fetcher('Project'))
+            assert ids(records) == expected('Project'), "types may be skipped"
+            assert records[0]['code'] == 'Project0'
+            assert ids(fetcher('Shot')) == expected('Shot'), "out of order types are read as well"
+        finally:
+            fetcher.close()
+        # end assure threads are stopped
+
+        # types which can't be read fail once they are read, and don't affect the others
+        summarize = sg.summarize
+        def failing_summarize(entity_type, *args, **kwargs):
+            if entity_type == 'Task':
+                raise ValueError("Task is not readable")
+            # end fail for one type
+            return summarize(entity_type, *args, **kwargs)
+        # end failing summarize
+        sg.summarize = failing_summarize
+        fetcher = ParallelFetcher(lambda: sg, type_names, fields, 2, records_per_page=7)
+        try:
+            for type_name in type_names[:-1]:
+                assert ids(fetcher(type_name)) == expected(type_name)
+            # end for each readable type
+            self.failUnlessRaises(ValueError, list, fetcher('Task'))
+        finally:
+            fetcher.close()
+            sg.summarize = summarize
+        # end assure threads are stopped
+
+        # clustered ids are read in requests of bounded size, and resumed types aren't read twice
+        sg.set_entities([{'type' : 'Version', 'id' : vid, 'code' : 'v%i' % vid}
+                         for vid in range(1, 4) + range(1000, 1030)])
+        versions, shots = expected('Version'), expected('Shot')
+        sizes = list()
+        find = sg.find
+        def sized_find(entity_type, filters, *args, **kwargs):
+            records = find(entity_type, filters, *args, **kwargs)
+            if [f for f in filters if f[1] == 'between']:
+                sizes.append(len(records))
+            # end record reads of id ranges
+            return records
+        # end recording find
+        sg.find = sized_find
+        fetcher = ParallelFetcher(lambda: sg, ['Version', 'Shot'], fields, 2, records_per_page=7)
+        try:
+            assert ids(fetcher('Version')) == versions
+            assert max(sizes) <= 7 and len(sizes) > 5
+            after_id = shots[20]
+            assert ids(fetcher('Shot', after_id)) == shots[21:]
+            assert not [item for item in fetcher._pending if item[0] == 'Shot']
+        finally:
+            fetcher.close()
+        # end assure threads are stopped
+        del(fetcher)
+        gc.collect()
+        assert not [item for item in gc.garbage if isinstance(item, ParallelFetcher)]
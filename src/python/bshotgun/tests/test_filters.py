@@ -0,0 +1,106 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.tests.test_filters
+@brief tests for bshotgun.filters
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = []
+
+from .base import ShotgunTestCase
+
+# test import *
+from bshotgun import *
+
+
+class TestFilters(ShotgunTestCase):
+    __slots__ = ()
+
+    def test_normalization(self):
+        """Verify all filter formats end up in the same structure"""
+        group = normalize_filters([['id', 'in', 1, 2], ('code', 'is', 'foo')])
+        assert isinstance(group, FilterGroup) and group.operator == 'all'
+        assert len(group.filters) == 2
+        cond = group.filters[0]
+        assert isinstance(cond, FilterCondition)
+        assert cond.path == 'id' and cond.relation == 'in' and cond.values == [1, 2]
+        assert normalize_filters([['id', 'in', [1, 2]]]).filters[0].values == [1, 2], "value lists are unpacked"
+        assert group.filters[1].value() == 'foo'
+        assert FilterCondition('id', 'is', [0]).value() == 0
+
+        assert normalize_filters(list(), 'or').operator == 'any'
+        self.failUnlessRaises(ValueError, normalize_filters, list(), 'foo')
+        self.failUnlessRaises(ValueError, normalize_filters, [['id']])
+
+        # nested dicts, new and old style
+        group = normalize_filters({'filter_operator' : 'any', 
+                                   'filters' : [['id', 'is', 1], 
+                                                {'logical_operator' : 'and', 
+                                                 'conditions' : [{'path' : 'code', 
+                                                                  'relation' : 'is', 
+                                                                  'values' : ['foo']}]}]})
+        assert group.operator == 'any'
+        nested = group.filters[1]
+        assert isinstance(nested, FilterGroup) and nested.operator == 'all'
+        assert nested.filters[0].path == 'code' and nested.filters[0].values == ['foo']
+        self.failUnlessRaises(ValueError, normalize_filters, {'filters' : list()})
+
+    def test_evaluation(self):
+        """Verify records are matched just like shotgun would do it"""
+        project = {'type' : 'Project', 'id' : 1, 'name' : 'foo'}
+        linked = {project['id'] : dict(project, code='PRJ')}
+        records = [{'type' : 'Shot', 'id' : 1, 'code' : 'sh010', 'sg_cut_in' : 10, 'project' : project,
+                    'tag_list' : ['a', 'b'], 'created_at' : '2014-01-01 10:00:00+02:00'},
+                   {'type' : 'Shot', 'id' : 2, 'code' : 'SH020', 'sg_cut_in' : None, 'project' : None,
+                    'tag_list' : list(), 'created_at' : '2014-01-01 09:00:00Z'}]
+
+        def ids(filters, filter_operator='all'):
+            resolve_link = lambda link, field_name: linked[link['id']].get(field_name)
+            return [r['id'] for r in filter_records(records, filters, filter_operator, resolve_link)]
+        # end utility
+
+        assert ids(list()) == [1, 2]
+        assert ids([['code', 'is', 'sh010']]) == [1]
+        assert ids([['code', 'is', 'SH010']]) == [], "'is' is case-sensitive"
+        assert ids([['code', 'contains', 'sh0']]) == [1, 2], "text relations are not"
+        assert ids([['code', 'starts_with', 'SH0'], ['code', 'ends_with', '20']]) == [2]
+        assert ids([['sg_cut_in', 'is', None]]) == [2]
+        assert ids([['sg_cut_in', 'greater_than', 5]]) == [1], "None never compares"
+        assert ids([['sg_cut_in', 'not_between', 0, 5]]) == [1, 2]
+        assert ids([['id', 'in', [2, 3]]]) == [2]
+        assert ids([['id', 'is', 1], ['id', 'is', 2]], 'any') == [1, 2]
+        assert ids([['project', 'is', project]]) == [1]
+        assert ids([['project', 'is', None]]) == [2]
+        assert ids([['project', 'name_contains', 'FO']]) == [1]
+        assert ids([['project', 'type_is_not', 'Project']]) == [2]
+        assert ids([['project.Project.code', 'is', 'PRJ']]) == [1], "deep links are resolved"
+        assert ids([['tag_list', 'is', 'b']]) == [1], "lists match if any item matches"
+        assert ids([['tag_list', 'is_not', 'b']]) == [2]
+        assert ids([['tag_list', 'is', None]]) == [2], "empty lists are like None"
+        assert ids([['created_at', 'greater_than', '2014-01-01 08:30:00Z']]) == [2], "time zones are respected"
+        assert ids([['created_at', 'in_last', 1, 'DAY']]) == list()
+        assert ids({'filter_operator' : 'any', 
+                    'filters' : [['id', 'is', 1], 
+                                 {'filter_operator' : 'all', 
+                                  'filters' : [['code', 'contains', '2'], ['project', 'is', None]]}]}) == [1, 2]
+
+        self.failUnlessRaises(ValueError, FilterEvaluator, normalize_filters([['code', 'foo', 1]]))
+        assert normalize_filters([['project.Project.code', 'is', 1], ['id', 'is', 1]]).field_names() == \
+               set(('project', 'id'))
+
+    def test_order(self):
+        """Verify records are sorted like shotgun does it"""
+        assert normalize_order(None) == [('id', False)]
+        assert normalize_order([{'field_name' : 'code', 'direction' : 'desc'}, {'column' : 'id'}]) == \
+               [('code', True), ('id', False)]
+        self.failUnlessRaises(ValueError, normalize_order, [{'field_name' : 'project.Project.name'}])
+        self.failUnlessRaises(ValueError, normalize_order, [{'field_name' : 'code', 'direction' : 'up'}])
+
+        records = [{'id' : 1, 'code' : 'b', 'project' : {'type' : 'Project', 'id' : 1, 'name' : 'z'}},
+                   {'id' : 2, 'code' : None, 'project' : None},
+                   {'id' : 3, 'code' : 'b', 'project' : {'type' : 'Project', 'id' : 2, 'name' : 'a'}}]
+        ids = lambda order: [r['id'] for r in sort_records(list(records), normalize_order(order))]
+        assert ids([{'field_name' : 'code'}]) == [2, 1, 3], "None comes first, id is used as last resort"
+        assert ids([{'field_name' : 'code', 'direction' : 'desc'}]) == [1, 3, 2]
+        assert ids([{'field_name' : 'project'}]) == [2, 3, 1], "links are sorted by name"
@@ -0,0 +1,129 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.tests.test_journal
+@brief tests for bshotgun.journal
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = []
+
+import gc
+import os
+import xmlrpclib
+
+from .base import (ShotgunTestCase,
+                   ShotgunConnectionMock,
+                   temporary_directory)
+
+# test import *
+from bshotgun import *
+
+
+class SlowWriteJournal(WriteJournal):
+    """Only sends writes when asked to"""
+    __slots__ = ()
+
+    flush_interval = 60.0
+
+# end class SlowWriteJournal
+
+
+class TestJournal(ShotgunTestCase):
+    __slots__ = ()
+
+    def test_write_behind(self):
+        """Verify writes are sent in the background, combined into batches, and survive restarts"""
+        sg = ShotgunConnectionMock()
+        sg.set_entities([{'type' : 'Shot', 'id' : shot_id, 'code' : 'shot%i' % shot_id} for shot_id in range(1, 4)])
+        batches = list()
+        send_batch = sg.batch
+        def batch(requests):
+            batches.append(requests)
+            return send_batch(requests)
+        # end recording batch
+        sg.batch = batch
+
+        with temporary_directory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'journal.sqlite')
+            journal = SlowWriteJournal(path, lambda: sg)
+            conflicts = list()
+            journal.set_conflict_handler(lambda request, error: conflicts.append(request))
+            conn = ProxyShotgunConnection(sg).set_write_journal(journal)
+            assert conn.write_journal() is journal
+
+            assert conn.update('Shot', 1, {'code' : 'a'}) == {'type' : 'Shot', 'id' : 1, 'code' : 'a'}
+            conn.update('Shot', 2, {'code' : 'b'})
+            conn.update('Shot', 1, {'sg_status_list' : 'fin'})
+            assert conn.delete('Shot', 3) is True
+            assert journal.pending() == 4
+            assert sg.find_one('Shot', [['id', 'is', 1]])['code'] == 'shot1', "nothing was sent yet"
+
+            assert journal.wait(10)
+            assert len(batches) == 1 and len(batches[0]) == 3, "updates of the same entity were combined"
+            shot = sg.find_one('Shot', [['id', 'is', 1]])
+            assert shot['code'] == 'a' and shot['sg_status_list'] == 'fin'
+            assert sg.find_one('Shot', [['id', 'is', 3]]) is None
+
+            # rejected writes are kept as conflicts, the others are sent
+            del(batches[:])
+            conn.batch([{'request_type' : 'update', 'entity_type' : 'Shot', 'entity_id' : 3, 'data' : {}},
+                        {'request_type' : 'update', 'entity_type' : 'Shot', 'entity_id' : 2, 'data' : {'code' : 'c'}}])
+            conn.revive('Shot', 3)
+            assert journal.wait(10)
+            assert [c['request']['entity_id'] for c in journal.conflicts()] == [3]
+            assert [request['entity_id'] for request in conflicts] == [3]
+            assert sg.find_one('Shot', [['id', 'is', 2]])['code'] == 'c'
+            assert sg.find_one('Shot', [['id', 'is', 3]]) is not None, "revived after the rejected update"
+            assert not journal.clear_conflicts().conflicts()
+
+            # creations wait for pending writes
+            conn.update('Shot', 2, {'code' : 'd'})
+            created = conn.create('Shot', {'code' : 'new'})
+            assert journal.pending() == 0 and sg.find_one('Shot', [['id', 'is', 2]])['code'] == 'd'
+            assert created['id'] not in (1, 2, 3)
+
+            # writes survive restarts
+            conn.update('Shot', 2, {'code' : 'e'})
+            journal.close(flush = False)
+            assert sg.find_one('Shot', [['id', 'is', 2]])['code'] == 'd'
+            journal = SlowWriteJournal(path, lambda: sg)
+            assert journal.pending() == 1
+            assert journal.wait(10)
+            assert sg.find_one('Shot', [['id', 'is', 2]])['code'] == 'e'
+            journal.close()
+
+            # writes stay pending while shotgun is down for maintenance
+            journal = SlowWriteJournal(path, lambda: sg)
+            conn.set_write_journal(journal)
+            def unavailable(requests):
+                raise xmlrpclib.ProtocolError('shotgun', 503, 'Service Unavailable', dict())
+            # end unavailable shotgun
+            sg.batch = unavailable
+            conn.update('Shot', 1, {'code' : 'maintenance'})
+            assert not journal.wait(10)
+            assert journal.pending() == 1 and not journal.conflicts()
+            sg.batch = batch
+            assert journal.wait(10) and sg.find_one('Shot', [['id', 'is', 1]])['code'] == 'maintenance'
+            journal.close()
+
+            # creations fail if pending writes can't be sent
+            def unreachable():
+                raise IOError("shotgun is down")
+            # end unreachable shotgun
+            journal = SlowWriteJournal(os.path.join(tmp_dir, 'unreachable.sqlite'), unreachable)
+            conn.set_write_journal(journal)
+            conn.update('Shot', 2, {'code' : 'f'})
+            self.failUnlessRaises(IOError, conn.create, 'Shot', {'code' : 'late'})
+            assert journal.pending() == 1 and sg.find_one('Shot', [['id', 'is', 2]])['code'] == 'e'
+            journal.close(flush = False)
+
+            # closed journals can be collected, even if their conflict handler refers to them
+            journal.set_conflict_handler(lambda request, error, journal = journal: journal.clear_conflicts())
+            conn.set_write_journal(None)
+            del(journal)
+            gc.collect()
+            assert not [item for item in gc.garbage if isinstance(item, WriteJournal)]
+        # end with directory
+
+# end class TestJournal
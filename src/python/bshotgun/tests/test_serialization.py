@@ -0,0 +1,123 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.tests.test_serialization
+@brief tests for bshotgun.serialization
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = []
+
+import zlib
+import cPickle
+from datetime import (datetime,
+                      date)
+
+from butility import DictObject
+from .base import ShotgunTestCase
+
+# test import *
+from bshotgun import *
+from bshotgun.filters import utc
+
+
+class TestSerialization(ShotgunTestCase):
+    __slots__ = ()
+
+    def test_codecs(self):
+        """Verify all codecs round-trip records, and that blobs of all codecs can be read"""
+        record = {'type' : 'Shot', 'id' : 1, 'code' : u'f\xfc', 'sg_cut_in' : 10, 'sg_rate' : 1.5,
+                  'flag' : True, 'project' : {'type' : 'Project', 'id' : 2, 'name' : 'foo'}, 'assets' : [],
+                  'created_at' : datetime(2014, 5, 3, 10, 11, 12, tzinfo=utc),
+                  'sg_naive' : datetime(2014, 5, 3, 10, 11, 12), 'sg_due' : date(2014, 5, 3),
+                  'sg_other' : set([1]), 'description' : None}
+        assert DEFAULT_RECORD_CODEC in record_codec_names()
+        assert record_codec(None) is record_codec(DEFAULT_RECORD_CODEC)
+        self.failUnlessRaises(ValueError, record_codec, 'foo')
+
+        layout = RecordLayout('Shot', [('id', 'number'), ('code', 'text'), ('project', 'entity')])
+        sizes = dict()
+        for name in record_codec_names():
+            codec = record_codec(name)
+            blob = codec.encode(record, layout)
+            sizes[name] = len(blob)
+            for buf in (blob, buffer(blob)):
+                assert decode_record(buf, None, layout) == record, name
+                assert decode_record(buf, ['code', 'unknown'], layout) == \
+                                                                {'type' : 'Shot', 'id' : 1, 'code' : u'f\xfc'}
+                assert codec.decode(buf, None, layout) == record
+            # end for each buffer type
+            assert decode_value(codec.encode_value(record['project'])) == record['project']
+        # end for each codec
+        assert sizes['pickle-zlib'] < sizes['pickle'] and sizes['marshal-zlib'] < sizes['marshal']
+        assert sizes['schema'] < sizes['marshal'] and sizes['schema-zlib'] < sizes['marshal-zlib']
+
+        # blobs without header, as written before there were codecs
+        record = {'type' : 'Asset', 'id' : 1, 'code' : 'foo', 'project' : None}
+        blob = zlib.compress(cPickle.dumps(record), 9)
+        assert decode_record(blob) == record
+        assert decode_record(blob, ['code']) == {'type' : 'Asset', 'id' : 1, 'code' : 'foo'}
+        assert decode_value(zlib.compress(cPickle.dumps(record))) == record
+
+        self.failUnlessRaises(ValueError, decode_record, '\xb5\x01\xff')
+        self.failUnlessRaises(AssertionError, register_record_codec, RecordCodec('pickle', 100, None, None, 0))
+
+        res = benchmark_record_codecs([record] * 3, ['pickle', 'marshal'])
+        assert [r['codec'] for r in res] == ['pickle', 'marshal']
+        for r in res:
+            assert r['records'] == 3 and r['bytes'] > 0 and r['encode_time'] >= 0 and r['decode_time'] >= 0
+        # end for each result
+
+    def test_schema_codec(self):
+        """Verify records are stored positionally, and remain readable when fields are added"""
+        codec = record_codec('schema')
+        assert codec.uses_layout() and not record_codec('marshal').uses_layout()
+        link = {'type' : 'Project', 'id' : 2, 'name' : 'foo'}
+        record = {'type' : 'Shot', 'id' : 1, 'code' : 'a', 'project' : link, 'assets' : [link, {'id' : 3}]}
+        layout = RecordLayout('Shot', [('id', 'number'), ('code', 'text'), ('project', 'entity')])
+        assert not layout.is_changed()
+        self.failUnlessRaises(ValueError, codec.encode, record)
+
+        blob = codec.encode(record, layout)
+        assert layout.is_changed() and layout.ordinal('assets') == 3 and layout.fields()[3][1] == 'multi_entity'
+        assert 'Shot' not in blob and 'project' not in blob, "type and field names are not stored"
+        self.failUnlessRaises(ValueError, decode_record, blob)
+        assert decode_record(blob, ['project'], layout) == {'type' : 'Shot', 'id' : 1, 'project' : link}
+        assert decode_record(blob, ['assets', 'sg_foo'], layout)['assets'] == record['assets']
+
+        restored = RecordLayout.from_string(layout.to_string())
+        assert restored.fields() == layout.fields() and restored.type_name() == 'Shot'
+        assert not restored.is_changed()
+        assert restored.add_field('sg_foo', 'text') == 4 and restored.add_field('code', 'text') == 1
+        assert decode_record(blob, None, restored) == record, "new fields don't affect existing blobs"
+        record = dict(record, code=None)
+        del(record['project'])
+        assert decode_record(codec.encode(record, restored), None, restored) == record
+
+        schema = {'code' : DictObject({'data_type' : DictObject({'value' : 'text'})})}
+        assert RecordLayout.from_schema('Shot', schema).fields() == [('code', 'text')]
+
+    def test_dictionary_codec(self):
+        """Verify small records compress better with a trained dictionary"""
+        codec = record_codec('schema-zdict')
+        assert codec.uses_dictionary() and not record_codec('schema-zlib').uses_dictionary()
+        self.failUnlessRaises(NotImplementedError, record_codec('schema').train_dictionary, [], RecordLayout('a'))
+
+        project = {'type' : 'Project', 'id' : 2, 'name' : 'the project'}
+        records = [{'type' : 'PageHit', 'id' : i, 'project' : project, 'url' : '/page/%i/detail' % (i % 10),
+                    'sg_status_list' : 'in progress'} for i in xrange(100)]
+        layout = RecordLayout('PageHit')
+        assert layout.dictionary() == ''
+        dictionary = codec.train_dictionary(records[:50], layout, 1024)
+        assert dictionary and dictionary == layout.dictionary() and len(dictionary) <= 1024
+        assert 'the project' in dictionary and 'in progress' in dictionary
+
+        blobs = [codec.encode(record, layout) for record in records]
+        plain_layout = RecordLayout.from_string(layout.to_string())
+        plain = [record_codec('schema-zlib').encode(record, plain_layout) for record in records]
+        assert sum(map(len, blobs)) < sum(map(len, plain)) * 0.75
+        assert [decode_record(blob, None, layout) for blob in blobs] == records
+        assert decode_record(blobs[1], ['url'], layout)['url'] == records[1]['url']
+
+        other = RecordLayout.from_string(layout.to_string()).set_dictionary(dictionary)
+        assert decode_record(blobs[2], None, other) == records[2], "dictionaries are restored by value"
@@ -8,14 +8,24 @@
 """
 __all__ = []
 
+import gc
+import os
 import sys
+import zlib
+import cPickle
+import threading
 from time import time
 
 import shotgun_api3
 
 from .base import (ShotgunTestCase,
+                   ShotgunTestDatabase,
+                   ShotgunConnectionMock,
                    ReadOnlyTestSQLProxyShotgunConnection,
-                   TestShotgunTypeFactory)
+                   TestShotgunTypeFactory,
+                   ProjectShotTypeFactory,
+                   temporary_directory,
+                   temporary_database)
 
 # test import *
 from bshotgun import *
@@ -85,5 +95,653 @@ class TestShotgunSQL(ShotgunTestCase):
         # end for each type
         sys.stdout.write("Received a total of %i records in %i fetches in %fs\n" % (total_record_count, fetch_count, time() - tst))
         
-        
+    def test_columnar(self):
+        """Verify tables with columnar layout yield the same data as blob tables, reading only what's needed"""
+        blob_sg = ReadOnlyTestSQLProxyShotgunConnection()
+        sg = ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)
+        assert sg.has_database()
+
+        sg_id = 612
+        filters = [('id', 'is', sg_id)]
+        fields = ['code', 'project', 'sg_status_list', 'created_at', 'tag_list', 'sequences']
+        data = sg.find_one('Asset', filters, fields)
+        assert set(data.keys()) == set(fields) | set(('id', 'type')), "should only read what was asked for"
+        assert data['type'] == 'Asset'
+
+        blob_data = blob_sg.find_one('Asset', filters, fields)
+        for name in ('code', 'sg_status_list', 'tag_list', 'sequences'):
+            assert data[name] == blob_data[name]
+        # end for each field to compare
+        for name in ('type', 'id', 'name'):
+            assert data['project'][name] == blob_data['project'][name]
+        # end for each link part
+        assert data['created_at'].tzinfo is not None, "datetimes are returned in UTC"
+
+        assert sg.find_one('Asset', [('id', 'is', 10)], fields) is None, 'invalid ids just yield None'
+        assert len(sg.find('Asset', [], ['code'], limit=5)) == 5
+
+    def test_init_database(self):
+        """Verify records are streamed into the database in chunks"""
+        type_names = ProjectShotTypeFactory.TYPE_NAMES
+        db = ShotgunTestDatabase()
+        consumed = dict()
+
+        def fetch(type_name):
+            for record in db.records(type_name):
+                consumed[type_name] = consumed.get(type_name, 0) + 1
+                yield record
+            # end for each record
+        # end fetcher
+
+        sg = SQLProxyShotgunConnection.init_database('sqlite://', ProjectShotTypeFactory(), fetch, chunk_size=7)
+        assert sorted(sg.type_names()) == ['project', 'shot']
+        for type_name in type_names:
+            records = db.records(type_name)
+            assert consumed[type_name] == len(records) > 7
+            fields = [name for name in records[0] if name != 'type']
+            res = dict((r['id'], r) for r in sg.find(type_name, [], fields))
+            assert len(res) == len(records)
+            assert res[records[-1]['id']] == records[-1]
+        # end for each type
+
+    def test_lazy_tables(self):
+        """Verify tables are constructed when they are first used, from their description or by reflection"""
+        db = ShotgunTestDatabase()
+        with temporary_database('lazy') as url:
+            initialized = SQLProxyShotgunConnection.init_database(url, ProjectShotTypeFactory(), db.records, 
+                                                                  LAYOUT_COLUMNAR)
+            fields = initialized.field_names('Shot')
+            expected = initialized.find('Shot', [('sg_status_list', 'is_not', None)], fields, [{'field_name' : 'id'}])
+            assert expected
+
+            def verify():
+                sg = SQLProxyShotgunConnection(url)
+                assert not sg._meta.tables, "nothing is read before it is needed"
+                assert sorted(sg.type_names()) == ['project', 'shot']
+                assert sg.find('Shot', [('sg_status_list', 'is_not', None)], fields,
+                               [{'field_name' : 'id'}]) == expected
+                assert 'project' not in sg._meta.tables
+                codec, initialized_codec = sg._codec(sg._tables['shot']), initialized._codec(initialized._tables['shot'])
+                for field_name in fields:
+                    assert codec.field_kind(field_name) == initialized_codec.field_kind(field_name)
+                # end for each field
+            # end utility
+
+            verify()
+            # tables without description are reflected
+            meta_table = initialized._tables['bshotgun_meta']
+            initialized._meta.bind.execute(meta_table.delete(meta_table.c.key == 'columns:shot'))
+            verify()
+        # end with database
+
+    def test_layout_changes(self):
+        """Verify fields added to record layouts by several instances are stored, and never lost"""
+        db = ShotgunTestDatabase()
+        with temporary_database('layouts') as url:
+            SQLProxyShotgunConnection.init_database(url, ProjectShotTypeFactory(), db.records, codec='schema-zdict')
+            first, second = SQLProxyShotgunConnection(url), SQLProxyShotgunConnection(url)
+            shot_a, shot_b = sorted(db.records('Shot'), key=lambda r: r['id'])[:2]
+            for sg in (first, second):
+                assert sg.find_one('Shot', [('id', 'is', shot_a['id'])], ['code'])['code'] == shot_a['code']
+            # end read layouts
+
+            # both add a field, using the layout they read before
+            first.store_records('Shot', [dict(shot_a, sg_first='a')])
+            second.store_records('Shot', [dict(shot_b, sg_second='b')])
+            for sg in (second, first, SQLProxyShotgunConnection(url)):
+                assert sg.find_one('Shot', [('id', 'is', shot_a['id'])], ['sg_first'])['sg_first'] == 'a'
+                assert sg.find_one('Shot', [('id', 'is', shot_b['id'])], ['sg_second'])['sg_second'] == 'b'
+            # end for each instance
+
+            # fields of failed writes are forgotten
+            insert_rows = SQLProxyShotgunConnection.__dict__['_insert_rows']
+            def fail(cls, *args):
+                raise IOError("disk full")
+            # end utility
+            SQLProxyShotgunConnection._insert_rows = classmethod(fail)
+            try:
+                self.failUnlessRaises(IOError, first.store_records, 'Shot', [dict(shot_a, sg_lost=1)])
+            finally:
+                SQLProxyShotgunConnection._insert_rows = insert_rows
+            # end restore insertion
+            assert first._record_layout(first._tables['shot']).ordinal('sg_lost') is None
+
+            # layouts are only replaced if nobody changed them in the meantime
+            with first._begin() as connection:
+                key = 'layout:shot'
+                data = first.meta_value(key)
+                assert not first._replace_meta_value(connection.execute, first._meta_table(), key, 'other', 'x')
+                assert first._replace_meta_value(connection.execute, first._meta_table(), key, data, data)
+                assert not first._replace_meta_value(connection.execute, first._meta_table(), key, None, 'x')
+            # end with transaction
+        # end with database
+
+    def test_threads(self):
+        """Verify one instance can be used by many threads at once, with more threads than connections"""
+        sg = ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)
+        engine = SQLProxyShotgunConnection.make_engine(str(sg.engine().url), pool_size=2, max_overflow=1, 
+                                                       pool_recycle=10)
+        cache = RecordCache(max_entries = 50)
+        sg = SQLProxyShotgunConnection(record_cache=cache).set_db_url(engine)
+        assert sg.engine() is engine
+        assert engine.pool.size() == 2 and engine.pool._max_overflow == 1 and engine.pool._recycle == 10
+        fields = ['code', 'project']
+        shots = sg.find('Shot', [], fields, [{'field_name' : 'id'}])
+        assert len(shots) > 100
+
+        errors = list()
+        def read(offset):
+            try:
+                for index in range(offset, len(shots), 50):
+                    shot = shots[index]
+                    for attempt in range(2):
+                        assert sg.find_one('Shot', [('id', 'is', shot['id'])], fields) == shot
+                    # end for each attempt, the second one may be served by the cache
+                    assert sg.count('Shot', [('id', 'less_than', shot['id'])]) == index
+                # end for each shot
+            except Exception, err:
+                errors.append(err)
+            # end handle errors
+        # end utility
+
+        threads = [threading.Thread(target=read, args=(offset, )) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        # end for each thread
+        for thread in threads:
+            thread.join()
+        # end for each thread
+        assert not errors, errors
+        stats = cache.stats()
+        assert stats['hits'] and stats['entries'] <= 50
+        assert engine.pool.checkedin() <= 3
+
+    def test_close(self):
+        """Verify instances close the engines they created when asked to, and can be collected"""
+        sg = ReadOnlyTestSQLProxyShotgunConnection()
+        assert sg.find('Shot', [], ['code'], limit=1)
+        engine = sg.engine()
+        assert engine.pool.checkedin()
+        assert sg.close() is sg and not engine.pool.checkedin()
+        assert sg.find('Shot', [], ['code'], limit=1), "closed instances connect again when needed"
+        del(sg)
+        gc.collect()
+        assert not [item for item in gc.garbage if isinstance(item, SQLProxyShotgunConnection)]
+
+    def test_init_database_resume(self):
+        """Verify an interrupted initialization can be resumed where it left off"""
+        type_names = ProjectShotTypeFactory.TYPE_NAMES
+        db = ShotgunTestDatabase()
+        records = dict((tn, sorted(db.records(tn), key=lambda r: r['id'])) for tn in type_names)
+        # fail after the records used to train the dictionary were read, and some chunks were written
+        chunk_size = 100
+        fail_after = SQLProxyShotgunConnection.dictionary_sample_size + chunk_size * 5 // 2
+        assert len(records['Shot']) > fail_after
+
+        def failing_fetch(type_name):
+            for index, record in enumerate(records[type_name]):
+                if type_name == 'Shot' and index == fail_after:
+                    raise IOError("connection lost")
+                # end simulate failure
+                yield record
+            # end for each record
+        # end failing fetcher
+
+        requested = dict()
+        def fetch(type_name, after_id = None):
+            requested[type_name] = after_id
+            return iter([r for r in records[type_name] if after_id is None or r['id'] > after_id])
+        # end resuming fetcher
+
+        factory = ProjectShotTypeFactory()
+        with temporary_database('resume') as url:
+            self.failUnlessRaises(IOError, SQLProxyShotgunConnection.init_database, url, factory, 
+                                  failing_fetch, chunk_size=chunk_size)
+            # a partially filled database is not overwritten by accident
+            self.failUnlessRaises(AssertionError, SQLProxyShotgunConnection.init_database, url, factory,
+                                  fetch, chunk_size=chunk_size)
+
+            sg = SQLProxyShotgunConnection.init_database(url, factory, fetch, chunk_size=chunk_size, resume=True)
+            assert 'Project' not in requested, "completed types are skipped"
+            assert requested['Shot'] == records['Shot'][(fail_after // chunk_size) * chunk_size - 1]['id']
+
+            for type_name in type_names:
+                fields = [name for name in records[type_name][0] if name != 'type']
+                res = sorted(sg.find(type_name, [], fields), key=lambda r: r['id'])
+                assert res == records[type_name]
+            # end for each type
+
+            # resuming a complete database does nothing
+            requested.clear()
+            SQLProxyShotgunConnection.init_database(url, factory, fetch, resume=True)
+            assert not requested
+        # end with database
+
+    def test_write_through(self):
+        """Verify writes are applied to the database right away, so they can be read back"""
+        type_names = ProjectShotTypeFactory.TYPE_NAMES
+        sg = ShotgunConnectionMock()
+        db = ShotgunTestDatabase()
+        for type_name in type_names:
+            sg.set_entities(sorted(db.records(type_name), key=lambda r: r['id'])[:20])
+        # end for each type
+        meta = SQLProxyShotgunConnection.init_database('sqlite://', ProjectShotTypeFactory(), 
+                                                       lambda tn: sg.find(tn, [], None))._meta
+        cache = SQLProxyShotgunConnection(meta, shotgun=sg)
+        fields = cache.field_names('Shot')
+        shots = cache.find('Shot', [], fields)
+        project = dict((k, v) for k, v in shots[0]['project'].items() if k in ('type', 'id'))
+        by_id = lambda shot_id: cache.find_one('Shot', [('id', 'is', shot_id)], fields)
+        linked = lambda: [s['id'] for s in cache.find('Shot', [('project', 'is', project)], ['id'])]
+
+        created = cache.create('Shot', {'code' : 'new', 'project' : project}, ['code'])
+        assert set(created.keys()) == set(('id', 'type', 'code', 'project')), "only asked for fields are returned"
+        assert by_id(created['id'])['code'] == 'new'
+        assert created['id'] in linked()
+
+        shot = shots[1]
+        assert cache.update('Shot', shot['id'], {'code' : 'changed', 'project' : None})
+        record = by_id(shot['id'])
+        assert record['code'] == 'changed' and record['project'] is None
+        assert record['sg_status_list'] == shot['sg_status_list'], "other fields are kept"
+
+        assert cache.delete('Shot', shot['id']) and by_id(shot['id']) is None
+        assert cache.revive('Shot', shot['id']) and by_id(shot['id'])['code'] == 'changed'
+
+        results = cache.batch([{'request_type' : 'create', 'entity_type' : 'Shot', 'data' : {'code' : 'batch'}},
+                               {'request_type' : 'update', 'entity_type' : 'Shot', 'entity_id' : created['id'],
+                                'data' : {'project' : None}},
+                               {'request_type' : 'delete', 'entity_type' : 'Shot', 'entity_id' : shot['id']}])
+        assert set(results[0].keys()) == set(('id', 'type', 'code'))
+        assert by_id(results[0]['id'])['code'] == 'batch'
+        assert by_id(created['id'])['code'] == 'new' and created['id'] not in linked()
+        assert by_id(shot['id']) is None
+        assert len(cache.find('Shot', [], ['id'])) == len(sg.find('Shot', [], None))
+
+        # batched writes are applied to the database once they are sent
+        with cache.batching() as writes:
+            assert cache.update('Shot', created['id'], {'code' : 'batched'}) is None
+            assert by_id(created['id'])['code'] == 'new'
+        # end batching
+        assert writes.results()[0]['code'] == 'batched' and by_id(created['id'])['code'] == 'batched'
+
+        # with a write journal, writes are applied to the database before they are sent
+        with temporary_directory() as tmp_dir:
+            journal = WriteJournal(os.path.join(tmp_dir, 'journal.sqlite'), lambda: sg)
+            cache.set_write_journal(journal)
+            cache.update('Shot', created['id'], {'code' : 'journaled'})
+            assert by_id(created['id'])['code'] == 'journaled'
+            assert journal.wait(10)
+            assert sg.find_one('Shot', [['id', 'is', created['id']]])['code'] == 'journaled'
+
+            # records whose writes shotgun rejects are read again before the next query
+            gone = shots[2]['id']
+            sg.delete('Shot', gone)
+            cache.update('Shot', gone, {'code' : 'rejected'})
+            assert journal.wait(10) and journal.conflicts()
+            find = sg.find
+            def unreachable(*args, **kwargs):
+                raise IOError("shotgun is down")
+            # end unreachable shotgun
+            sg.find = unreachable
+            assert by_id(gone)['code'] == 'rejected', "we answer queries while shotgun can't be reached"
+            sg.find = find
+            assert by_id(gone) is None
+
+            # revived records are read once shotgun revived them
+            assert cache.delete('Shot', created['id']) and by_id(created['id']) is None
+            assert cache.revive('Shot', created['id'])
+            assert by_id(created['id'])['code'] == 'journaled'
+            journal.close()
+        # end with directory
+
+    def test_write_while_iterating(self):
+        """Verify records can be written while the ones of a query are streamed, by the same thread"""
+        type_names = ProjectShotTypeFactory.TYPE_NAMES
+        sg = ShotgunConnectionMock()
+        db = ShotgunTestDatabase()
+        for type_name in type_names:
+            sg.set_entities(sorted(db.records(type_name), key=lambda r: r['id'])[:20])
+        # end for each type
+        rows_per_fetch = SQLProxyShotgunConnection.rows_per_fetch
+        SQLProxyShotgunConnection.rows_per_fetch = 5
+        try:
+            with temporary_database('iterate') as url:
+                SQLProxyShotgunConnection.init_database(url, ProjectShotTypeFactory(), 
+                                                        lambda tn: sg.find(tn, [], None))
+                cache = SQLProxyShotgunConnection(url, shotgun=sg)
+                count = 0
+                for shot in cache.iter_find('Shot', [], ['code']):
+                    # the iterator shares the connection of this thread, and sees the writes it commits
+                    cache.update('Shot', shot['id'], {'code' : 'iterated'})
+                    assert cache.count('Shot', [['code', 'is', 'iterated']]) == count + 1
+                    count += 1
+                # end for each shot
+                assert count == 20
+            # end with database
+        finally:
+            SQLProxyShotgunConnection.rows_per_fetch = rows_per_fetch
+        # end restore configuration
+
+    def test_projection(self):
+        """Verify only the requested fields are decoded and returned, for all layouts"""
+        for sg in (ReadOnlyTestSQLProxyShotgunConnection(), 
+                   ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)):
+            all_fields = sg.field_names('Asset')
+            assert 'code' in all_fields and 'project' in all_fields
+            records = sg.find('Asset', [], ['code'])
+            assert records
+            for record in records:
+                assert set(record.keys()) == set(('id', 'type', 'code'))
+            # end for each record
+            record = sg.find_one('Asset', [('id', 'is', records[0]['id'])], all_fields)
+            assert set(record.keys()) >= set(all_fields)
+        # end for each layout
+
+        # blobs of the original format, which stores records as a whole, are still readable
+        record = {'type' : 'Asset', 'id' : 1, 'code' : 'foo', 'project' : None}
+        buf = zlib.compress(cPickle.dumps(record), 9)
+        deserialize = SQLProxyShotgunConnection._deserialize_properties
+        layout = RecordLayout('Asset')
+        for buf in (buf, SQLProxyShotgunConnection._serialize_properties(record, None, layout),
+                    SQLProxyShotgunConnection._serialize_properties(record, record_codec('pickle'))):
+            assert deserialize(buf, None, layout) == record
+            assert deserialize(buf, ['code', 'unknown'], layout) == {'type' : 'Asset', 'id' : 1, 'code' : 'foo'}
+        # end for each format
     
+    def test_filters(self):
+        """Verify filters are evaluated within the database, instead of being passed on to shotgun"""
+        sg = ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)
+        blob_sg = ReadOnlyTestSQLProxyShotgunConnection()
+        fields = ['code', 'project', 'sg_sequence', 'sg_cut_in']
+        shots = sg.find('Shot', [], fields)
+        assert shots
+
+        ids = [s['id'] for s in shots[:3]]
+        for db in (sg, blob_sg):
+            assert sorted(s['id'] for s in db.find('Shot', [('id', 'in', ids)], fields)) == sorted(ids)
+            assert len(db.find('Shot', [('id', 'is', ids[0]), ('id', 'is', ids[1])], fields, 
+                               filter_operator='any')) == 2
+        # end for each layout
+
+        project = shots[0]['project']
+        expected = [s['id'] for s in shots if s['project'] and s['project']['id'] == project['id']]
+        res = sg.find('Shot', [('project', 'is', project)], fields)
+        assert sorted(s['id'] for s in res) == sorted(expected)
+        assert len(sg.find('Shot', [('project', 'is_not', project)], fields)) == len(shots) - len(expected)
+        assert len(sg.find('Shot', [('project', 'type_is', 'Project')], fields)) == \
+               len([s for s in shots if s['project']])
+
+        code = shots[0]['code']
+        for relation, value in (('is', code), ('starts_with', code[:6]), ('ends_with', code[-6:]),
+                                ('contains', code[2:8].upper())):
+            assert shots[0]['id'] in [s['id'] for s in sg.find('Shot', [('code', relation, value)], fields)]
+        # end for each text relation
+        assert not sg.find('Shot', [('code', 'contains', '%')], fields), "wildcards are matched literally"
+
+        with_cut_in = [s for s in shots if s['sg_cut_in'] is not None]
+        assert len(sg.find('Shot', [('sg_cut_in', 'is_not', None)], fields)) == len(with_cut_in)
+        if with_cut_in:
+            cut_in = with_cut_in[0]['sg_cut_in']
+            res = sg.find('Shot', [('sg_cut_in', 'between', cut_in - 1, cut_in + 1)], fields)
+            assert len(res) == len([s for s in with_cut_in if cut_in - 1 <= s['sg_cut_in'] <= cut_in + 1])
+            res = sg.find('Shot', {'filter_operator' : 'any', 
+                                   'filters' : [('sg_cut_in', 'less_than', cut_in), 
+                                                ('sg_cut_in', 'greater_than', cut_in)]}, fields)
+            assert len(res) == len([s for s in with_cut_in if s['sg_cut_in'] != cut_in])
+        # end handle cut in
+
+        # Filters that can't be expressed in SQL are evaluated in memory
+        for db in (sg, blob_sg):
+            res = db.find('Shot', [('code', 'is', code), ('sg_sequence', 'name_contains', '')], ['code'])
+            assert [s['id'] for s in res] == [shots[0]['id']]
+            assert 'sg_sequence' not in res[0], "fields used for filtering are not returned"
+            if project:
+                name = project['name']
+                res = db.find('Shot', [('project.Project.name', 'is', name)], fields)
+                assert sorted(s['id'] for s in res) == sorted(expected), "deep links are resolved in the database"
+                assert len(db.find('Shot', [('project.Project.name', 'is', name)], fields, limit=1)) == 1
+            # end handle project
+        # end for each layout
+
+    def test_order_and_paging(self):
+        """Verify order, limit and page are handled locally, like shotgun does it"""
+        sg = ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)
+        blob_sg = ReadOnlyTestSQLProxyShotgunConnection()
+        fields = ['code', 'sg_cut_in', 'project']
+        by_cut_in = [{'field_name' : 'sg_cut_in', 'direction' : 'desc'}, {'field_name' : 'code'}]
+        shots = sg.find('Shot', [], fields, by_cut_in)
+        assert len(shots) > 10
+        keys = [(s['sg_cut_in'], s['code']) for s in shots]
+        for (cut_in, code), (prev_cut_in, prev_code) in zip(keys[1:], keys[:-1]):
+            assert cut_in < prev_cut_in or cut_in == prev_cut_in and code >= prev_code
+        # end for each pair
+
+        ids = [s['id'] for s in shots]
+        assert [s['id'] for s in blob_sg.find('Shot', [], fields, by_cut_in)] == ids, "sorting works in memory too"
+        assert [s['id'] for s in sg.find('Shot', [], ['code'], [{'field_name' : 'id', 'direction' : 'desc'}])] == \
+               list(reversed(sorted(ids)))
+
+        # Pages are 1-based and as large as limit. Keyset pagination yields the same results as OFFSET
+        limit = min(len(shots) // 4 + 1, sg.records_per_page)
+        for db in (sg, blob_sg):
+            for attempt in range(2):
+                paged = list()
+                for page in range(1, len(shots) // limit + 2):
+                    res = db.find('Shot', [], fields, by_cut_in, limit=limit, page=page)
+                    assert len(res) <= limit
+                    paged.extend(s['id'] for s in res)
+                # end for each page
+                assert paged == ids
+            # end for each attempt
+            assert not db.find('Shot', [], fields, by_cut_in, limit=limit, page=len(shots))
+            res = db.find('Shot', [], fields, by_cut_in, limit=limit, page=3)
+            assert [s['id'] for s in res] == ids[2 * limit:3 * limit], "pages can be read directly"
+            assert len(db.find('Shot', [], fields, page=1)) == min(len(shots), db.records_per_page)
+        # end for each layout
+
+        # the keys of page ends are read along with the records
+        last = shots[limit - 1]
+        keys = [key for (query_key, page), key in sg._page_keys.items() if page == 1 and len(key) == 3]
+        assert keys and set(keys) == set([(last['sg_cut_in'], last['code'], last['id'])])
+
+        # in-memory filters are paged too
+        res = sg.find('Shot', [('project.Project.name', 'is_not', None)], fields, by_cut_in, limit=2, page=2)
+        expected = [s['id'] for s in shots if s['project']][2:4]
+        assert [s['id'] for s in res] == expected
+        assert sg.find_one('Shot', [], fields, by_cut_in)['id'] == ids[0]
+
+    def test_iter_find(self):
+        """Verify records are streamed, and are the same find() returns"""
+        fields = ['code', 'sg_cut_in']
+        by_cut_in = [{'field_name' : 'sg_cut_in', 'direction' : 'desc'}, {'field_name' : 'id'}]
+        ReadOnlyTestSQLProxyShotgunConnection.rows_per_fetch = 3
+        try:
+            for sg in (ReadOnlyTestSQLProxyShotgunConnection(),
+                       ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)):
+                ids = [s['id'] for s in sg.find('Shot', [], ['code'])][:5]
+                for args in ((['code'], by_cut_in), (fields, by_cut_in, 'all', 7),
+                             (fields, [{'field_name' : 'id', 'direction' : 'desc'}]),
+                             (fields, [], 'all', 4)):
+                    for filters in ([], [('code', 'is_not', None)], [('project.Project.name', 'is_not', None)],
+                                    [('id', 'in', ids)]):
+                        records = sg.iter_find('Shot', filters, *args)
+                        assert not isinstance(records, list)
+                        assert list(records) == sg.find('Shot', filters, *args)
+                    # end for each filter
+                # end for each set of arguments
+            # end for each layout
+        finally:
+            del(ReadOnlyTestSQLProxyShotgunConnection.rows_per_fetch)
+        # end restore fetch size
+
+    def test_id_lists(self):
+        """Verify lists of ids are read with few queries, in the order of the caller"""
+        for sg in (ReadOnlyTestSQLProxyShotgunConnection(), 
+                   ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)):
+            ids = [s['id'] for s in sg.find('Shot', [], ['code'])][:20]
+            assert len(ids) == 20
+            wanted = list(reversed(ids)) + [-1, ids[-1]]
+            res = sg.find('Shot', [('id', 'in', wanted)], ['code'])
+            assert [s['id'] for s in res] == list(reversed(ids)), "caller order is kept, missing ids are skipped"
+            res = sg.find('Shot', [('id', 'in', wanted)], ['code'], limit=5, page=2)
+            assert [s['id'] for s in res] == list(reversed(ids))[5:10]
+
+            by_id = [{'field_name' : 'id'}]
+            assert [s['id'] for s in sg.find('Shot', [('id', 'in', wanted)], ['code'], by_id)] == sorted(ids)
+
+            # lookups by id reuse compiled statements, one per table, fields and power of two of ids
+            sg._statements.clear()
+            for count in range(1, 9):
+                res = sg.find('Shot', [('id', 'in', ids[:count])], ['code', 'sg_status_list'])
+                assert [s['id'] for s in res] == ids[:count]
+                assert res == sg.find('Shot', [('id', 'in', ids[:count]), ('id', 'is_not', None)],
+                                      ['code', 'sg_status_list']), "same result as uncompiled queries"
+            # end for each amount of ids
+            assert len(sg._statements) == 4
+            assert sg.find_one('Shot', [('id', 'is', ids[0])], ['code'])['code'] == res[0]['code']
+            assert sg.find_one('Shot', [('id', 'is', -1)], ['code']) is None
+            assert len(sg._statements) == 4 + int(sg._codec(sg._tables['shot']) is not None)
+            sg.set_db_url(sg.engine())
+            assert not sg._statements, "statements are compiled for the engine they are used with"
+
+            ReadOnlyTestSQLProxyShotgunConnection.max_ids_per_query = 3
+            try:
+                res = sg.find('Shot', [('id', 'in', wanted), ('code', 'is_not', None)], ['code'])
+                assert [s['id'] for s in res] == list(reversed(ids)), "chunks yield the same result"
+                res = sg.find('Shot', [('id', 'in', wanted)], ['code'], [{'field_name' : 'code'}], limit=4)
+                assert [s['code'] for s in res] == sorted(s['code'] for s in res)
+                assert res[0]['code'] == min(s['code'] for s in sg.find('Shot', [('id', 'in', ids)], ['code']))
+                assert set(res[0].keys()) == set(('id', 'type', 'code'))
+            finally:
+                del(ReadOnlyTestSQLProxyShotgunConnection.max_ids_per_query)
+            # end restore chunk size
+        # end for each layout
+
+    def test_record_cache(self):
+        """Verify lookups by id are served from the record cache"""
+        sg = ReadOnlyTestSQLProxyShotgunConnection()
+        assert sg.record_cache() is None
+        cache = RecordCache()
+        assert sg.set_record_cache(cache).record_cache() is cache
+
+        ids = [s['id'] for s in sg.find('Shot', [], ['code'])][:5]
+        first = sg.find('Shot', [('id', 'in', ids)], ['code'])
+        assert cache.misses == len(ids) and cache.stats()['entries'] == len(ids)
+        assert sg.find('Shot', [('id', 'in', ids)], ['code']) == first and cache.hits == len(ids)
+        assert sg.find_one('Shot', [('id', 'is', ids[0])], ['code']) == first[0] and cache.hits == len(ids) + 1
+
+        misses = cache.misses
+        rec = sg.find_one('Shot', [('id', 'is', ids[0])], ['code', 'sg_status_list'])
+        assert 'sg_status_list' in rec and cache.misses == misses + 1, "new fields must be read"
+        assert sg.find_one('Shot', [('id', 'is', None)], ['code']) is None
+
+        sg.invalidate_records('Shot', ids[:1])
+        assert cache.stats()['entries'] == len(ids) - 1
+        sg.invalidate_records()
+        assert cache.stats()['entries'] == 0
+
+    def test_links(self):
+        """Verify link filters are answered by the links table, for all layouts"""
+        for sg in (ReadOnlyTestSQLProxyShotgunConnection(), 
+                   ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)):
+            assert not [tn for tn in sg.type_names() if tn.startswith('bshotgun_')], "internal tables are hidden"
+            fields = ['project', 'assets']
+            shots = sg.find('Shot', [('id', 'greater_than', 0)], fields)
+            with_assets = [s for s in shots if s['assets']]
+            assert with_assets
+            asset = with_assets[0]['assets'][-1]
+            project = with_assets[0]['project']
+
+            def ids(filters):
+                group = normalize_filters(filters)
+                table = sg._tables['shot']
+                assert sg._compile_filters(table, group)[1], "filter should be handled in SQL"
+                return sorted(s['id'] for s in sg.find('Shot', filters, ['code']))
+            # end utility
+
+            linked_to = lambda s: asset['id'] in [a['id'] for a in s['assets']]
+            expected = sorted(s['id'] for s in shots if linked_to(s))
+            assert expected and ids([('assets', 'is', asset)]) == expected
+            assert ids([('assets', 'in', [asset, None])]) == \
+                   sorted(s['id'] for s in shots if linked_to(s) or not s['assets'])
+            assert ids([('assets', 'is_not', asset)]) == sorted(s['id'] for s in shots if not linked_to(s))
+            assert ids([('assets', 'is', None)]) == sorted(s['id'] for s in shots if not s['assets'])
+            assert ids([('assets', 'not_in', [])]) == sorted(s['id'] for s in shots)
+            assert ids([('project', 'is', project)]) == \
+                   sorted(s['id'] for s in shots if s['project'] and s['project']['id'] == project['id'])
+        # end for each layout
+
+    def test_count(self):
+        """Verify records are counted without reading them, unless filters are evaluated in memory"""
+        for sg in (ReadOnlyTestSQLProxyShotgunConnection(),
+                   ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)):
+            shots = sg.find('Shot', [], ['code'])
+            assert sg.count('Shot', []) == len(shots) > 0
+            ids = [s['id'] for s in shots][:5] + [-1]
+            for filters, operator in (([('id', 'in', ids)], 'all'), 
+                                      ([('id', 'greater_than', ids[2])], 'all'),
+                                      ([('code', 'is_not', None), ('id', 'in', ids)], 'any'),
+                                      ([('project.Project.name', 'is_not', None)], 'all')):
+                assert sg.count('Shot', filters, operator) == len(sg.find('Shot', filters, ['code'], 
+                                                                          filter_operator=operator))
+            # end for each filter
+        # end for each layout
+
+    def test_summarize(self):
+        """Verify summaries computed in SQL match the ones computed in memory"""
+        sg = ReadOnlyTestSQLProxyShotgunConnection(layout=LAYOUT_COLUMNAR)
+        blob_sg = ReadOnlyTestSQLProxyShotgunConnection()
+        shots = sg.find('Shot', [], ['sg_status_list'])
+        statuses = [s['sg_status_list'] for s in shots]
+        status = max(set(statuses), key=statuses.count)
+        summary_fields = [{'field' : 'id', 'type' : 'record_count'},
+                          {'field' : 'code', 'type' : 'count'},
+                          {'field' : 'sg_cut_in', 'type' : 'sum'},
+                          {'field' : 'sg_cut_out', 'type' : 'average'},
+                          {'field' : 'sg_cut_duration', 'type' : 'max'},
+                          {'field' : 'project', 'type' : 'count'},
+                          {'field' : 'sg_status_list', 'type' : 'status_percentage', 'value' : status}]
+        grouping = [{'field' : 'project', 'type' : 'exact', 'direction' : 'asc'},
+                    {'field' : 'sg_status_list', 'type' : 'exact', 'direction' : 'desc'}]
+
+        table = sg._tables['shot']
+        assert sg._summarize_sql(table, None, normalize_summary_fields(summary_fields), 
+                                 normalize_grouping(grouping)) is not None, "columnar tables use SQL aggregates"
+
+        for filters in ([], [('id', 'greater_than', shots[len(shots) // 2]['id'])]):
+            res = sg.summarize('Shot', filters, summary_fields, grouping=grouping)
+            assert res == blob_sg.summarize('Shot', filters, summary_fields, grouping=grouping)
+        # end for each filter
+        assert res['summaries']['id'] < len(shots)
+
+        res = sg.summarize('Shot', [], summary_fields, grouping=grouping)
+        assert res['summaries']['id'] == len(shots)
+        assert sum(g['summaries']['id'] for g in res['groups']) == len(shots)
+        for group in res['groups']:
+            assert sum(g['summaries']['id'] for g in group['groups']) == group['summaries']['id']
+        # end for each group
+        assert res['summaries']['sg_status_list'] == int(round(100.0 * statuses.count(status) / len(shots)))
+        assert res['summaries']['sg_status_list'] > 0
+
+        # empty strings are not counted, no matter where the summary is computed
+        shotgun = ShotgunConnectionMock()
+        db = ShotgunTestDatabase()
+        for type_name in ProjectShotTypeFactory.TYPE_NAMES:
+            records = sorted(db.records(type_name), key=lambda r: r['id'])[:20]
+            if type_name == 'Shot':
+                records = [dict(record, code='') for record in records[:5]] + records[5:]
+            # end add empty strings
+            shotgun.set_entities(records)
+        # end for each type
+        for layout in (LAYOUT_BLOB, LAYOUT_COLUMNAR):
+            cache = SQLProxyShotgunConnection.init_database('sqlite://', ProjectShotTypeFactory(), 
+                                                            lambda tn: shotgun.find(tn, [], None), layout)
+            res = cache.summarize('Shot', [], [{'field' : 'code', 'type' : 'count'}])
+            assert res['summaries']['code'] == 15
+        # end for each layout
+
+        # filters evaluated in memory work as well
+        filters = [('project.Project.name', 'is_not', None)]
+        res = sg.summarize('Shot', filters, [{'field' : 'id', 'type' : 'record_count'}])
+        assert res['summaries']['id'] == len(sg.find('Shot', filters, ['code']))
@@ -0,0 +1,53 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.tests.test_summaries
+@brief tests for bshotgun.summaries
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = []
+
+from .base import ShotgunTestCase
+
+# test import *
+from bshotgun import *
+
+
+class TestSummaries(ShotgunTestCase):
+    __slots__ = ()
+
+    def test_summarize_records(self):
+        """Verify summaries are computed like shotgun does it"""
+        project = {'type' : 'Project', 'id' : 1, 'name' : 'foo'}
+        records = [{'id' : 1, 'sg_status_list' : 'ip', 'sg_cut_in' : 10, 'project' : project, 'checked' : True},
+                   {'id' : 2, 'sg_status_list' : 'fin', 'sg_cut_in' : 20, 'project' : project, 'checked' : False},
+                   {'id' : 3, 'sg_status_list' : 'ip', 'sg_cut_in' : None, 'project' : None, 'checked' : False}]
+        summary_fields = [{'field' : 'id', 'type' : 'record_count'},
+                          {'field' : 'sg_cut_in', 'type' : 'count'},
+                          {'field' : 'sg_cut_in', 'type' : 'sum'},
+                          {'field' : 'project', 'type' : 'count'},
+                          {'field' : 'sg_status_list', 'type' : 'status_percentage', 'value' : 'ip'},
+                          {'field' : 'checked', 'type' : 'unchecked'}]
+        res = summarize_records(records, summary_fields)
+        assert res['groups'] == list()
+        assert res['summaries'] == {'id' : 3, 'sg_cut_in' : 30, 'project' : 2, 'sg_status_list' : 67, 
+                                    'checked' : 2}, "last summary per field wins"
+
+        res = summarize_records(records, [{'field' : 'sg_cut_in', 'type' : 'average'}, 
+                                          {'field' : 'id', 'type' : 'max'}])
+        assert res['summaries'] == {'sg_cut_in' : 15.0, 'id' : 3}
+
+        grouping = [{'field' : 'project', 'type' : 'exact', 'direction' : 'desc'}, 
+                    {'field' : 'sg_status_list', 'type' : 'exact'}]
+        res = summarize_records(records, [{'field' : 'id', 'type' : 'count'}], grouping)
+        assert res['summaries'] == {'id' : 3}
+        assert [g['group_name'] for g in res['groups']] == ['foo', '']
+        group = res['groups'][0]
+        assert group['group_value'] == project and group['summaries'] == {'id' : 2}
+        assert [(g['group_value'], g['summaries']['id']) for g in group['groups']] == [('fin', 1), ('ip', 1)]
+
+        self.failUnlessRaises(ValueError, summarize_records, records, [{'field' : 'id', 'type' : 'foo'}])
+        self.failUnlessRaises(ValueError, summarize_records, records, [{'field' : 'id', 'type' : 'percentage'}])
+        self.failUnlessRaises(ValueError, summarize_records, records, list(), 
+                                          [{'field' : 'id', 'type' : 'tens'}])
@@ -0,0 +1,166 @@
+#-*-coding:utf-8-*-
+"""
+@package bshotgun.tests.test_sync
+@brief tests for bshotgun.sync
+
+@author Sebastian Thiel
+@copyright [GNU Lesser General Public License](https://github.com/Byron/bshotgun/blob/master/LICENSE.md)
+"""
+__all__ = []
+
+from datetime import (datetime,
+                      timedelta)
+
+from .base import (ShotgunTestCase,
+                   ShotgunTestDatabase,
+                   ShotgunConnectionMock,
+                   ProjectShotTypeFactory)
+
+# test import *
+from bshotgun import *
+from bshotgun.filters import _comparable
+
+
+class TestSync(ShotgunTestCase):
+    __slots__ = ()
+
+    def _make_shotgun(self):
+        """@return a ShotgunConnectionMock with a few records of all our types"""
+        sg = ShotgunConnectionMock()
+        db = ShotgunTestDatabase()
+        for type_name in ProjectShotTypeFactory.TYPE_NAMES:
+            sg.set_entities(sorted(db.records(type_name), key=lambda r: r['id'])[:20])
+        # end for each type
+        return sg
+
+    def _make_cache(self, sg):
+        """@return an in-memory SQLProxyShotgunConnection with all records of all our types in sg"""
+        return SQLProxyShotgunConnection.init_database('sqlite://', ProjectShotTypeFactory(), 
+                                                       lambda tn: sg.find(tn, [], None))
+
+    def test_parse_event(self):
+        """Verify the entity an event is about is found"""
+        event = {'event_type' : 'Shotgun_Shot_Change', 'entity' : {'type' : 'Shot', 'id' : 5},
+                 'meta' : {'entity_type' : 'Shot', 'entity_id' : 5, 'attribute_name' : 'code'}}
+        assert parse_event(event) == ('Shot', 5, EVENT_CHANGE)
+        event = {'event_type' : 'Shotgun_CustomEntity01_Retirement', 'entity' : None,
+                 'meta' : {'entity_type' : 'CustomEntity01', 'entity_id' : 7}}
+        assert parse_event(event) == ('CustomEntity01', 7, EVENT_RETIREMENT)
+        event = {'event_type' : 'Shotgun_Task_New', 'entity' : {'type' : 'Task', 'id' : 1}, 'meta' : None}
+        assert parse_event(event) == ('Task', 1, EVENT_NEW)
+        for event_type in ('Toolkit_App_Startup', 'Shotgun_User_Login', 'Shotgun_Shot'):
+            assert parse_event({'event_type' : event_type, 'entity' : {'type' : 'Shot', 'id' : 1}}) is None
+        # end for each unrelated event
+
+    def test_event_log_sync(self):
+        """Verify changes logged by shotgun are applied to the SQL cache, with few requests"""
+        sg = self._make_shotgun()
+        events = list()
+        def log(event_type, entity_type, entity_id, event_id = None):
+            event = {'type' : 'EventLogEntry', 'id' : event_id or len(events) + 1, 'event_type' : event_type,
+                     'entity' : {'type' : entity_type, 'id' : entity_id}, 'attribute_name' : None,
+                     'meta' : {'entity_type' : entity_type, 'entity_id' : entity_id}}
+            events.append(event)
+            sg.set_entities(event)
+        # end utility
+
+        log('Shotgun_Shot_Change', 'Shot', 1)
+        cache = self._make_cache(sg)
+        class PagedEventLogSync(EventLogSync):
+            __slots__ = ()
+            events_per_page = 4
+        # end class PagedEventLogSync
+
+        sync = PagedEventLogSync(sg, cache)
+        assert sync.high_water_mark() is None
+        assert sync.sync()['events'] == 0
+        assert sync.high_water_mark() == 1, "the first sync just remembers where we are"
+
+        shots = sg.find('Shot', [], None)
+        fields = cache.field_names('Shot')
+        changed, retired, revived = shots[0], shots[1], shots[2]
+        sg.update('Shot', changed['id'], {'code' : 'changed', 'project' : None})
+        log('Shotgun_Shot_Change', 'Shot', changed['id'])
+        log('Shotgun_Shot_Change', 'Shot', changed['id'])
+        created = sg.create('Shot', dict((k, v) for k, v in changed.items() if k not in ('id', 'type')))
+        log('Shotgun_Shot_New', 'Shot', created['id'])
+        log('Shotgun_Shot_Change', 'Shot', retired['id'])
+        del(sg.db()[('Shot', retired['id'])])
+        log('Shotgun_Shot_Retirement', 'Shot', retired['id'])
+        log('Shotgun_Shot_Retirement', 'Shot', revived['id'])
+        log('Shotgun_Shot_Revival', 'Shot', revived['id'])
+        log('Shotgun_Asset_Change', 'Asset', 1)
+        log('Toolkit_App_Startup', 'Shot', changed['id'])
+
+        stats = sync.sync(max_events = 6)
+        assert stats['events'] == 6 and sync.high_water_mark() == 7
+        stats = sync.sync()
+        assert stats['events'] == 3 and sync.high_water_mark() == len(events)
+        assert stats['stored'] == 1, "only the revived shot is left to be read"
+
+        record = cache.find_one('Shot', [('id', 'is', changed['id'])], fields)
+        assert record['code'] == 'changed' and record['project'] is None
+        assert changed['project']
+        linked = cache.find('Shot', [('project', 'is', changed['project'])], ['id'])
+        assert changed['id'] not in [r['id'] for r in linked], "links were updated"
+        assert cache.find_one('Shot', [('id', 'is', created['id'])], fields)['code'] == changed['code']
+        assert cache.find_one('Shot', [('id', 'is', retired['id'])], fields) is None
+        assert cache.find_one('Shot', [('id', 'is', revived['id'])], fields) is not None
+        assert len(cache.find('Shot', [], ['id'])) == len(sg.find('Shot', [], None))
+
+        # nothing happened, so nothing is read but the log itself
+        assert sync.sync() == {'events' : 0, 'stored' : 0, 'removed' : 0, 'requests' : 1}
+
+        # events committed after newer ones are applied once they show up, and only once
+        late_id = len(events) + 1
+        log('Shotgun_Shot_Change', 'Shot', revived['id'], late_id + 1)
+        assert sync.sync()['events'] == 1 and sync.high_water_mark() == late_id + 1
+        sg.update('Shot', changed['id'], {'code' : 'late'})
+        log('Shotgun_Shot_Change', 'Shot', changed['id'], late_id)
+        stats = sync.sync()
+        assert stats['events'] == 1 and sync.high_water_mark() == late_id + 1
+        assert cache.find_one('Shot', [('id', 'is', changed['id'])], fields)['code'] == 'late'
+        assert sync.sync()['events'] == 0, "applied events are skipped"
+
+    def test_delta_refresh(self):
+        """Verify changed and deleted records are found without the event log, with few requests"""
+        sg = self._make_shotgun()
+        cache = self._make_cache(sg)
+        refresh = DeltaRefresh(sg, cache)
+        assert refresh.high_water_mark('Shot') is None
+        stats = refresh.refresh(ProjectShotTypeFactory.TYPE_NAMES)
+        assert stats['removed'] == 0 and stats['stored'] < 10, "only the latest records are read again"
+        latest = max(_comparable(r['updated_at']) for r in sg.find('Shot', [], None))
+        assert refresh.high_water_mark('Shot') == latest
+
+        shots = sg.find('Shot', [], None)
+        changed, deleted = shots[0], shots[1]
+        sg.update('Shot', changed['id'], {'code' : 'changed', 'updated_at' : u'2020-01-01 01:00:00+01:00'})
+        del(sg.db()[('Shot', deleted['id'])])
+        created = sg.create('Shot', dict((k, v) for k, v in changed.items() if k not in ('id', 'type')))
+        sg.update('Shot', created['id'], {'updated_at' : u'2020-01-01 00:00:10+00:00'})
+
+        # records updated in the same second as the latest one are read again
+        overlap = [r for r in shots if _comparable(r['updated_at']) >= latest - timedelta(seconds = 1) and
+                                       r['id'] not in (changed['id'], deleted['id'])]
+        stats = refresh.refresh(['Shot'])
+        assert stats['stored'] == 2 + len(overlap) and stats['removed'] == 1
+        assert refresh.high_water_mark('Shot') == datetime(2020, 1, 1, 0, 0, 10)
+        fields = cache.field_names('Shot')
+        assert cache.find_one('Shot', [('id', 'is', changed['id'])], fields)['code'] == 'changed'
+        assert cache.find_one('Shot', [('id', 'is', created['id'])], fields) is not None
+        assert cache.find_one('Shot', [('id', 'is', deleted['id'])], fields) is None
+        assert len(cache.find('Shot', [], ['id'])) == len(sg.find('Shot', [], None))
+
+        # the records are the same, and only the latest one is read again
+        assert refresh.refresh(['Shot']) == {'stored' : 1, 'removed' : 0, 'requests' : 2}
+
+        # records revived without changes are found, even if as many others were deleted
+        assert sg.delete('Shot', changed['id']) and refresh.refresh(['Shot'])['removed'] == 1
+        assert sg.revive('Shot', changed['id']) and sg.delete('Shot', created['id'])
+        stats = refresh.refresh(['Shot'])
+        assert stats['removed'] == 1 and stats['stored'] == 1, "only the revived record is read"
+        assert cache.find_one('Shot', [('id', 'is', changed['id'])], fields)['code'] == 'changed'
+        assert cache.find_one('Shot', [('id', 'is', created['id'])], fields) is None
+
+# end class TestSync